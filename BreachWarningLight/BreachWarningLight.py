@@ -3,6 +3,19 @@ import unittest
 from __main__ import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
 import logging
+import sys
+import time
+
+# LumpNavLib is in the LumpNav module directory, which is not on the path in the source tree before LumpNav is loaded
+try:
+  import LumpNavLib
+except ImportError:
+  sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'LumpNav'))
+
+from LumpNavLib.BreachEventLog import ZONE_INSIDE, ZONE_MARGIN, ZONE_OUTSIDE, COMMAND_UNCHANGED, COMMAND_SENT, COMMAND_QUEUED, COMMAND_NOT_CONNECTED, COMMAND_LIGHT_DISABLED
+from LumpNavLib.CallbackProfiler import profiled
+from LumpNavLib.EventRateMonitor import eventRateMonitor, BREACH_LIGHT_COMMAND_EVENT
+from LumpNavLib.ObserverRegistry import ObserverRegistry
 
 #
 # BreachWarningLight
@@ -138,7 +151,8 @@ class BreachWarningLightLogic(ScriptedLoadableModuleLogic):
     ScriptedLoadableModuleLogic.__init__(self)
     
     self.breachWarningNode = None
-    self.observerTags = []
+    self.lightFeedbackActive = False
+    self.observers = ObserverRegistry('BreachWarningLightLogic')
     self.connectorNode = None
     self.marginSizeMm = 2
     
@@ -151,28 +165,45 @@ class BreachWarningLightLogic(ScriptedLoadableModuleLogic):
     # in this variable. When the command is completed then we send the command
     self.queuedLightSetCommandText = None
 
+    # Optional LumpNavLib BreachEventLogWriter, if set then each breach warning update is appended to it
+    self.breachEventLog = None
+    self.toolToWorldMatrix = vtk.vtkMatrix4x4()
+    self.worldToModelMatrix = vtk.vtkMatrix4x4()
+    self.toolToModelMatrix = vtk.vtkMatrix4x4()
+    self.tipPositionInModel = [0.0, 0.0, 0.0]
+
   def addObservers(self):
     if self.breachWarningNode:
-      print "Add observer to {0}".format(self.breachWarningNode.GetName())
-      self.observerTags.append([self.breachWarningNode, self.breachWarningNode.AddObserver(vtk.vtkCommand.ModifiedEvent, self.onBreachWarningNodeModified)])
-      self.observerTags.append([self.lightSetCommand, self.lightSetCommand.AddObserver(self.lightSetCommand.CommandCompletedEvent, self.onLightSetCommandCompleted)])
+      self.observers.addObserver(self.lightSetCommand, self.lightSetCommand.CommandCompletedEvent, self.onLightSetCommandCompleted, group='lightFeedback')
+    self.updateBreachWarningNodeObserver()
+
+  def updateBreachWarningNodeObserver(self):
+    # The breach warning node is observed while the light feedback is active or breach events are logged.
+    # There is a single observer for both, so each update is logged once and sends at most one light command.
+    self.observers.removeObservers('breachWarningNode')
+    if self.breachWarningNode and (self.lightFeedbackActive or self.breachEventLog):
+      logging.debug("Add observer to {0}".format(self.breachWarningNode.GetName()))
+      self.observers.addObserver(self.breachWarningNode, vtk.vtkCommand.ModifiedEvent, self.onBreachWarningNodeModified, group='breachWarningNode')
 
   def removeObservers(self):
-    print "Remove observers"
-    for nodeTagPair in self.observerTags:
-      nodeTagPair[0].RemoveObserver(nodeTagPair[1])
+    logging.debug("Remove observers")
+    self.observers.removeObservers()
 
   def startLightFeedback(self, breachWarningNode, connectorNode):
-    self.removeObservers()
+    self.observers.removeObservers('lightFeedback')
     self.breachWarningNode=breachWarningNode
     self.connectorNode=connectorNode    
+    self.lightFeedbackActive = True
 
     # Start the updates
     self.addObservers()
     self.onBreachWarningNodeModified(0,0)
 
   def stopLightFeedback(self):
-    self.removeObservers()
+    self.lightFeedbackActive = False
+    self.observers.removeObservers('lightFeedback')
+    # Breach events are still logged if a log is set
+    self.updateBreachWarningNodeObserver()
     # Disable light
     rgbIntensity = '000'
     flashTimeMsec = '000'
@@ -186,25 +217,44 @@ class BreachWarningLightLogic(ScriptedLoadableModuleLogic):
     flashTimeMsec = '000'
     lightSetCommandText = rgbIntensity + flashTimeMsec
     self.lightSetCommand.SetCommandAttribute('Text', lightSetCommandText)
-    slicer.modules.openigtlinkremote.logic().SendCommand(self.lightSetCommand, self.connectorNode.GetID())
+    self.sendLightSetCommand()
     logging.debug('shutdownLight completed')
 
+  def setBreachEventLog(self, breachEventLog, breachWarningNode=None):
+    """Sets the log that breach warning updates are appended to (None stops logging). Breach events are logged
+    whether or not the light feedback is active, the breach warning node is observed while a log is set.
+    """
+    self.breachEventLog = breachEventLog
+    if breachWarningNode:
+      self.breachWarningNode = breachWarningNode
+    self.updateBreachWarningNodeObserver()
+
   def setMarginSizeMm(self, marginSizeMm):
     self.marginSizeMm = marginSizeMm
     self.onBreachWarningNodeModified(0,0)
  
   def queueLightSetCommand(self, lightSetCommandText):
+    """Sends the command, or queues it if the previous command is still in progress.
+    Returns the command status (COMMAND_... constants of LumpNavLib.BreachEventLog).
+    """
     if self.lightSetCommand.IsSucceeded() and self.lightSetCommand.GetCommandAttribute('Text') == lightSetCommandText:
       # The command has been already sent successfully, no need to resend
-      return
+      return COMMAND_UNCHANGED
     if self.lightSetCommand.IsInProgress():
       # The previous command is still in progress anymore, so we have to wait until it is completed
       self.queuedLightSetCommandText = lightSetCommandText
-      return
+      return COMMAND_QUEUED
     # Ready to send a new setting
     self.lightSetCommand.SetCommandAttribute('Text', lightSetCommandText)
+    self.sendLightSetCommand()
+    return COMMAND_SENT
+
+  def sendLightSetCommand(self):
+    # All light commands are sent through this method, tests and benchmarks may override it to run without a light controller
+    eventRateMonitor.tick(BREACH_LIGHT_COMMAND_EVENT)
     slicer.modules.openigtlinkremote.logic().SendCommand(self.lightSetCommand, self.connectorNode.GetID())
  
+  @profiled('BreachWarningLightLogic.onLightSetCommandCompleted')
   def onLightSetCommandCompleted(self, observer, eventid):
     # If there was a queued command that we could not execute because a command was already in progress
     # then send it now
@@ -213,15 +263,44 @@ class BreachWarningLightLogic(ScriptedLoadableModuleLogic):
       self.queuedLightSetCommandText = None
       self.queueLightSetCommand(text)
  
+  def getZone(self, distanceMm):
+    if distanceMm<0:
+      return ZONE_INSIDE
+    elif distanceMm<self.marginSizeMm:
+      return ZONE_MARGIN
+    return ZONE_OUTSIDE
+
+  def getToolTipPositionInModel(self):
+    """Returns the tool tip position in the coordinate system of the watched model (e.g., the needle coordinate system
+    for the tumor), computed into preallocated matrices.
+    """
+    toolTransformNode = self.breachWarningNode.GetToolTransformNode()
+    modelNode = self.breachWarningNode.GetWatchedModelNode()
+    if not toolTransformNode or not modelNode:
+      return None
+    toolTransformNode.GetMatrixTransformToWorld(self.toolToWorldMatrix)
+    modelTransformNode = modelNode.GetParentTransformNode()
+    if modelTransformNode:
+      modelTransformNode.GetMatrixTransformToWorld(self.worldToModelMatrix)
+      self.worldToModelMatrix.Invert()
+    else:
+      self.worldToModelMatrix.Identity()
+    vtk.vtkMatrix4x4.Multiply4x4(self.worldToModelMatrix, self.toolToWorldMatrix, self.toolToModelMatrix)
+    for i in range(3):
+      self.tipPositionInModel[i] = self.toolToModelMatrix.GetElement(i, 3)
+    return self.tipPositionInModel
+
   def getLightSetCommandText(self, distanceMm):
     rgbIntensity = '000' # R, G, B intensities, each between 0 and 9
     flashTimeMsec = '000' # light is on for flashTimeMsec and then off for flashTimeMsec (0 means solid on)
 
-    if distanceMm<0:
+    # Zone is also what the breach event log records, so the logged zone always matches the light color
+    zone = self.getZone(distanceMm)
+    if zone == ZONE_INSIDE:
       # inside the tumor
       rgbIntensity =  '900' # red
       flashTimeMsec = '051' # this is the fastest possible blinking
-    elif distanceMm<self.marginSizeMm:
+    elif zone == ZONE_MARGIN:
       # good
       rgbIntensity =  '090' # green
       flashTimeMsec = '000' # solid
@@ -233,9 +312,11 @@ class BreachWarningLightLogic(ScriptedLoadableModuleLogic):
     lightSetCommandText = rgbIntensity + flashTimeMsec
     return lightSetCommandText
  
+  @profiled('BreachWarningLightLogic.onBreachWarningNodeModified')
   def onBreachWarningNodeModified(self, observer, eventid):
   
-    if not self.breachWarningNode or not self.connectorNode:
+    lightFeedbackConnected = self.lightFeedbackActive and self.connectorNode
+    if not self.breachWarningNode or not (lightFeedbackConnected or self.breachEventLog):
       return
 
     distanceMm = self.breachWarningNode.GetClosestDistanceToModelFromToolTip()
@@ -245,7 +326,17 @@ class BreachWarningLightLogic(ScriptedLoadableModuleLogic):
     # print('Light pattern: '+lightSetCommandText)
 
     #send the output data to the serial input of the arduino     
-    self.queueLightSetCommand(lightSetCommandText)
+    if not self.lightFeedbackActive:
+      commandStatus = COMMAND_LIGHT_DISABLED
+    elif not self.connectorNode:
+      commandStatus = COMMAND_NOT_CONNECTED
+    else:
+      commandStatus = self.queueLightSetCommand(lightSetCommandText)
+
+    if self.breachEventLog:
+      tipPositionInModel = self.getToolTipPositionInModel()
+      self.breachEventLog.append(time.time(), distanceMm, self.getZone(distanceMm),
+        tipPositionInModel if tipPositionInModel else (float('nan'), float('nan'), float('nan')), commandStatus)
  
 class BreachWarningLightTest(ScriptedLoadableModuleTest):
   """
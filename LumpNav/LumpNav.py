@@ -5,6 +5,28 @@ from __main__ import vtk, qt, ctk, slicer
 from GuideletLib import *
 import logging
 import time
+import numpy
+from vtk.util import numpy_support
+
+from LumpNavLib.BreachEventLog import BreachEventLogWriter
+from LumpNavLib.CallbackProfiler import callbackProfiler, profiled
+from LumpNavLib.ClippingRange import ClippingRangeEngine
+from LumpNavLib.EventRateMonitor import eventRateMonitor, TRACKER_TRANSFORM_EVENT, VIEWPOINT_CAMERA_EVENT, TUMOR_REBUILD_EVENT, BREACH_LIGHT_COMMAND_EVENT, RENDER_EVENT
+from LumpNavLib.FocalDistance import FocalDistanceService
+from LumpNavLib.IncomingTransformCoalescer import IncomingTransformCoalescer
+from LumpNavLib.MatrixUtil import arrayFromVtkMatrix
+from LumpNavLib.ObserverRegistry import ObserverRegistry
+from LumpNavLib.PointSweep import PointSweep
+from LumpNavLib.PoseHistory import poseHistoryService
+from LumpNavLib.ResectionCoverage import ResectionCoverageMap
+from LumpNavLib.SceneNodeIndex import getSceneNodeIndex
+from LumpNavLib.SessionReplay import SessionReplay
+from LumpNavLib.SliceIntersectionCache import SliceIntersectionCache
+from LumpNavLib.ToolModelCache import ToolModelCache
+from LumpNavLib.TrackedUltrasoundRecording import TrackedUltrasoundRecorder, TrackedUltrasoundRecordingReader
+from LumpNavLib.TransformChainCache import TransformChainCache
+from LumpNavLib.TumorSurface import createDisplaySurface, preprocessTumorPoints, TumorSurfacePipeline, getTumorSurfaceParameters, DEFAULT_PREPROCESSING_PARAMETERS, DEFAULT_STRATEGY_THRESHOLDS
+from LumpNavLib.ViewRenderThrottle import ViewRenderThrottle
 
 #
 # LumpNav ###
@@ -185,9 +207,33 @@ class LumpNavLogic(GuideletLogic):
                      'PivotCalibrationDurationSec': 5,
                      'EnableBreachWarningLight':'True',
                      'BreachWarningLightMarginSizeMm':2.0,
+                     'BreachEventLogPath': os.path.dirname(slicer.modules.lumpnav.path)+'/BreachEventLogs',
                      'TestMode':'False',
+                     'StreamingRecordingPath': os.path.dirname(slicer.modules.lumpnav.path)+'/Recordings',
+                     'StreamingRecordingTransformNames': 'CauteryToReference NeedleToReference',
+                     'CallbackProfilingEnabled': 'False',
+                     'CallbackProfilingTraceFilePath': '',
+                     'EventRateLogIntervalSec': 0,
+                     'TumorDisplayTriangleBudget': 2000,
+                     'CachedSliceIntersections': 'True',
+                     'LeftViewSecondaryMaximumUpdateRateHz': 15,
+                     'RightViewSecondaryMaximumUpdateRateHz': 15,
+                     'TumorPointSweepMinimumSpacingMm': 2.0,
+                     'IncomingTransformCoalescing': 'False',
+                     'IncomingTransformCoalescingIntervalMs': 16,
+                     'IncomingTransformCoalescingNames': 'CauteryToReference NeedleToReference',
+                     'AnalyticClippingRange': 'True',
+                     'AutoFocalDistance': 'True',
+                     'ResectionCoverageVoxelSizeMm': 1.0,
+                     'ResectionCoverageMaximumDistanceMm': 10.0,
+                     'ResectionCoverageRefreshRateHz': 2.0,
+                     'ResectionCoverageMaximumTrackingGapSec': 0.5,
                      }
 
+    # Tumor surface strategy thresholds, calibrated values can be stored in the configuration settings
+    parameterList.update(DEFAULT_STRATEGY_THRESHOLDS)
+    parameterList.update(DEFAULT_PREPROCESSING_PARAMETERS)
+
     for parameter in parameterList:
       if not node.GetParameter(parameter):
         node.SetParameter(parameter, str(parameterList[parameter]))
@@ -214,6 +260,9 @@ class LumpNavGuidelet(Guidelet):
     Guidelet.__init__(self, parent, logic, configurationName, parameterList, widgetClass)
     logging.debug('LumpNavGuidelet.__init__')
 
+    # All observers of the guidelet are added through the registry and are removed when it is closed
+    self.observers = ObserverRegistry('LumpNavGuidelet')
+
     moduleDirectoryPath = slicer.modules.lumpnav.path.replace('LumpNav.py', '')
 
     # Set up main frame.
@@ -230,16 +279,80 @@ class LumpNavGuidelet(Guidelet):
     # Setting up callback functions for widgets.
     self.setupConnections()
     
+    # Generated tool models are cached in the module resources directory if it is writable (e.g., in a build tree)
+    toolModelCacheDirectoryPath = moduleDirectoryPath + '/Resources/ToolModelCache'
+    if not os.access(moduleDirectoryPath + '/Resources', os.W_OK):
+      toolModelCacheDirectoryPath = slicer.app.temporaryPath + '/LumpNavToolModelCache'
+    self.toolModelCache = ToolModelCache(toolModelCacheDirectoryPath)
+
+    # Tumor surface is regenerated by the same pipeline objects after each markup change
+    self.tumorSurfacePipeline = TumorSurfacePipeline()
+    self.tumorDisplayDecimation = vtk.vtkQuadricDecimation()
+
     # Set needle and cautery transforms and models
     self.tumorMarkups_Needle = None
-    self.tumorMarkups_NeedleObserver = None
     self.setupScene()
 
+    # Callback profiling can be switched on and off at runtime by changing the CallbackProfilingEnabled parameter
+    self.observers.addObserver(self.parameterNode, vtk.vtkCommand.ModifiedEvent, self.onParameterNodeModified)
+    self.onParameterNodeModified(self.parameterNode, None)
+
+    # Tracker messages that arrive faster than the UI refresh are coalesced, only the newest pose per tool is applied
+    self.incomingTransformCoalescer = None
+    if self.parameterNode.GetParameter('IncomingTransformCoalescing') == 'True':
+      self.startIncomingTransformCoalescing()
+
+    self.setupEventRateMonitor()
+    self.setupPoseHistory()
+
+    # Composite tool transforms (e.g., CauteryTipToNeedle) are computed once per tracker update for all consumers
+    self.transformChainCache = TransformChainCache()
+    self.viewpointLogic.setTransformChainCache(self.transformChainCache)
+
+    # Viewpoint camera clipping ranges only need to enclose the tumor and the tools
+    self.clippingRangeEngine = None
+    if self.parameterNode.GetParameter('AnalyticClippingRange') == 'True':
+      self.clippingRangeEngine = ClippingRangeEngine([self.tumorDisplayModel_Needle, self.cauteryModel_CauteryTip, self.needleModel_NeedleTip],
+        self.transformChainCache)
+      self.viewpointLogic.setClippingRangeEngine(self.clippingRangeEngine)
+
+    # Viewpoint camera focal point is placed on the tumor surface, found by casting a ray from the cautery camera
+    self.focalDistanceService = None
+    if self.parameterNode.GetParameter('AutoFocalDistance') == 'True':
+      self.focalDistanceService = FocalDistanceService(self.tumorDisplayModel_Needle, self.transformChainCache)
+      self.viewpointLogic.setFocalDistanceService(self.focalDistanceService)
+
+    # Slice intersections of the tumor and needle are only recomputed when the model or the slice plane moves
+    self.sliceIntersectionCaches = []
+    if self.parameterNode.GetParameter('CachedSliceIntersections') == 'True':
+      self.sliceIntersectionCaches = [SliceIntersectionCache(self.tumorDisplayModel_Needle), SliceIntersectionCache(self.needleModel_NeedleTip)]
+
+    # In dual view navigation the view of the camera that is not bound to the viewpoint logic is rendered at reduced rate
+    self.viewRenderThrottle = ViewRenderThrottle(['View1', 'View2'])
+    self.viewRenderThrottle.setSecondaryMaximumUpdateRate('View1', float(self.parameterNode.GetParameter('LeftViewSecondaryMaximumUpdateRateHz')))
+    self.viewRenderThrottle.setSecondaryMaximumUpdateRate('View2', float(self.parameterNode.GetParameter('RightViewSecondaryMaximumUpdateRateHz')))
+
     # Setting button open on startup.
     self.calibrationCollapsibleButton.setProperty('collapsed', False)
     
     self.showFullScreen()
 
+  def onParameterNodeModified(self, caller, eventId):
+    profilingEnabled = (self.parameterNode.GetParameter('CallbackProfilingEnabled') == 'True')
+    if profilingEnabled == callbackProfiler.enabled:
+      return
+    callbackProfiler.setEnabled(profilingEnabled)
+    if profilingEnabled:
+      logging.info('Callback profiling started')
+      callbackProfiler.reset()
+      return
+    # Profiling stopped, report results
+    logging.info('Callback profiling stopped\n' + callbackProfiler.getTableText())
+    traceFilePath = self.parameterNode.GetParameter('CallbackProfilingTraceFilePath')
+    if traceFilePath:
+      callbackProfiler.saveChromeTrace(traceFilePath)
+      logging.info('Callback profiling trace saved to ' + traceFilePath)
+
   def createFeaturePanels(self):
     featurePanelList = Guidelet.createFeaturePanels(self)
 
@@ -264,8 +377,31 @@ class LumpNavGuidelet(Guidelet):
     Guidelet.cleanup(self)
     logging.debug('cleanup')
     self.breachWarningNode.UnRegister(slicer.mrmlScene)
+    # Pending sweep points are added to the tumor markups, so the sweep is stopped before the markups node is released
+    self.stopTumorPointSweep()
     self.setAndObserveTumorMarkupsNode(None)
     self.breachWarningLightLogic.stopLightFeedback()
+    if self.breachEventLog:
+      self.breachWarningLightLogic.setBreachEventLog(None)
+      self.breachEventLog.close()
+    self.stopStreamingRecording()
+    self.stopReplay()
+    self.stopIncomingTransformCoalescing()
+    self.stopEventRateMonitor()
+    self.stopResectionCoverage()
+    self.stopPoseHistory()
+    self.viewpointLogic.setTransformChainCache(None)
+    if self.clippingRangeEngine:
+      self.viewpointLogic.setClippingRangeEngine(None)
+      self.clippingRangeEngine.cleanup()
+    if self.focalDistanceService:
+      self.viewpointLogic.setFocalDistanceService(None)
+      self.focalDistanceService.cleanup()
+    self.transformChainCache.cleanup()
+    for sliceIntersectionCache in self.sliceIntersectionCaches:
+      sliceIntersectionCache.cleanup()
+    self.viewRenderThrottle.cleanup()
+    self.observers.removeObservers()
     
   def setupConnections(self):
     logging.debug('LumpNav.setupConnections()')
@@ -280,11 +416,21 @@ class LumpNavGuidelet(Guidelet):
     self.deleteLastFiducialButton.connect('clicked()', self.onDeleteLastFiducialClicked)
     self.deleteLastFiducialDuringNavigationButton.connect('clicked()', self.onDeleteLastFiducialClicked)    
     self.deleteAllFiducialsButton.connect('clicked()', self.onDeleteAllFiducialsClicked)
+    self.streamingRecordingButton.connect('clicked(bool)', self.onStreamingRecordingClicked)
+    self.loadRecordingButton.connect('clicked()', self.onLoadRecordingClicked)
+    self.replayPlayButton.connect('clicked(bool)', self.onReplayPlayClicked)
+    self.replaySpeedComboBox.connect('currentIndexChanged(int)', self.onReplaySpeedChanged)
+    self.replayTimeSlider.connect('valueChanged(double)', self.onReplayTimeSliderChanged)
     
     self.rightCameraButton.connect('clicked()', self.onRightCameraButtonClicked)
     self.leftCameraButton.connect('clicked()', self.onLeftCameraButtonClicked)
+    self.rightCameraToolComboBox.connect('currentIndexChanged(int)', self.onRightCameraToolChanged)
+    self.leftCameraToolComboBox.connect('currentIndexChanged(int)', self.onLeftCameraToolChanged)
 
     self.placeTumorPointAtCauteryTipButton.connect('clicked(bool)', self.onPlaceTumorPointAtCauteryTipClicked)
+    self.sweepTumorPointsAtCauteryTipButton.connect('toggled(bool)', self.onSweepTumorPointsAtCauteryTipToggled)
+    self.resectionCoverageButton.connect('toggled(bool)', self.onResectionCoverageToggled)
+    self.resetResectionCoverageButton.connect('clicked()', self.onResetResectionCoverageClicked)
 
     self.pivotSamplingTimer.connect('timeout()',self.onPivotSamplingTimeout)
 
@@ -301,88 +447,51 @@ class LumpNavGuidelet(Guidelet):
 
     logging.debug('Create transforms')
 
-    self.cauteryTipToCautery = slicer.util.getNode('CauteryTipToCautery')
-    if not self.cauteryTipToCautery:
-      self.cauteryTipToCautery=slicer.vtkMRMLLinearTransformNode()
-      self.cauteryTipToCautery.SetName("CauteryTipToCautery")
-      m = self.readTransformFromSettings('CauteryTipToCautery') 
-      if m:
-        self.cauteryTipToCautery.SetMatrixTransformToParent(m)
-      slicer.mrmlScene.AddNode(self.cauteryTipToCautery)
-
-    self.cauteryModelToCauteryTip = slicer.util.getNode('CauteryModelToCauteryTip')
-    if not self.cauteryModelToCauteryTip:
-      self.cauteryModelToCauteryTip=slicer.vtkMRMLLinearTransformNode()
-      self.cauteryModelToCauteryTip.SetName("CauteryModelToCauteryTip")
-      m = self.readTransformFromSettings('CauteryModelToCauteryTip') 
-      if m:
-        self.cauteryModelToCauteryTip.SetMatrixTransformToParent(m)
-      self.cauteryModelToCauteryTip.SetMatrixTransformToParent(m)
-      slicer.mrmlScene.AddNode(self.cauteryModelToCauteryTip)
-
-    self.needleTipToNeedle = slicer.util.getNode('NeedleTipToNeedle')
-    if not self.needleTipToNeedle:
-      self.needleTipToNeedle=slicer.vtkMRMLLinearTransformNode()
-      self.needleTipToNeedle.SetName("NeedleTipToNeedle")
-      m = self.readTransformFromSettings('NeedleTipToNeedle') 
-      if m:
-        self.needleTipToNeedle.SetMatrixTransformToParent(m)
-      slicer.mrmlScene.AddNode(self.needleTipToNeedle)      
-      
-    self.needleModelToNeedleTip = slicer.util.getNode('NeedleModelToNeedleTip')
-    if not self.needleModelToNeedleTip:
-      self.needleModelToNeedleTip=slicer.vtkMRMLLinearTransformNode()
-      self.needleModelToNeedleTip.SetName("NeedleModelToNeedleTip")
-      m = self.readTransformFromSettings('NeedleModelToNeedleTip') 
-      if m:
-        self.needleModelToNeedleTip.SetMatrixTransformToParent(m)
-      self.needleModelToNeedleTip.SetMatrixTransformToParent(m)
-      slicer.mrmlScene.AddNode(self.needleModelToNeedleTip)
-
-    self.cauteryCameraToCautery = slicer.util.getNode('CauteryCameraToCautery')
-    if not self.cauteryCameraToCautery:
-      self.cauteryCameraToCautery=slicer.vtkMRMLLinearTransformNode()
-      self.cauteryCameraToCautery.SetName("CauteryCameraToCautery")
-      m = vtk.vtkMatrix4x4()
-      m.SetElement( 0, 0, 0 )
-      m.SetElement( 0, 2, -1 )
-      m.SetElement( 1, 1, 0 )
-      m.SetElement( 1, 0, 1 )
-      m.SetElement( 2, 2, 0 )
-      m.SetElement( 2, 1, -1 )
-      self.cauteryCameraToCautery.SetMatrixTransformToParent(m)
-      slicer.mrmlScene.AddNode(self.cauteryCameraToCautery)
-
-    self.CauteryToNeedle = slicer.util.getNode('CauteryToNeedle')
-    if not self.CauteryToNeedle:
-      self.CauteryToNeedle=slicer.vtkMRMLLinearTransformNode()
-      self.CauteryToNeedle.SetName("CauteryToNeedle")
-      slicer.mrmlScene.AddNode(self.CauteryToNeedle)
-      
-    # Create transforms that will be updated through OpenIGTLink
-      
-    self.cauteryToReference = slicer.util.getNode('CauteryToReference')
-    if not self.cauteryToReference:
-      self.cauteryToReference=slicer.vtkMRMLLinearTransformNode()
-      self.cauteryToReference.SetName("CauteryToReference")
-      slicer.mrmlScene.AddNode(self.cauteryToReference)
-
-    self.needleToReference = slicer.util.getNode('NeedleToReference')
-    if not self.needleToReference:
-      self.needleToReference=slicer.vtkMRMLLinearTransformNode()
-      self.needleToReference.SetName("NeedleToReference")
-      slicer.mrmlScene.AddNode(self.needleToReference)
-      
+    self.sceneNodeIndex = getSceneNodeIndex()
+
+    cauteryCameraToCauteryDefault = vtk.vtkMatrix4x4()
+    cauteryCameraToCauteryDefault.SetElement( 0, 0, 0 )
+    cauteryCameraToCauteryDefault.SetElement( 0, 2, -1 )
+    cauteryCameraToCauteryDefault.SetElement( 1, 1, 0 )
+    cauteryCameraToCauteryDefault.SetElement( 1, 0, 1 )
+    cauteryCameraToCauteryDefault.SetElement( 2, 2, 0 )
+    cauteryCameraToCauteryDefault.SetElement( 2, 1, -1 )
+
+    # CauteryToReference and NeedleToReference will be updated through OpenIGTLink
+    # (name, parent name or node, matrix of newly created node)
+    transformTree = [
+      ('CauteryToReference', self.ReferenceToRas, None),
+      ('CauteryCameraToCautery', 'CauteryToReference', cauteryCameraToCauteryDefault),
+      ('CauteryTipToCautery', 'CauteryToReference', self.readTransformFromSettings('CauteryTipToCautery')),
+      ('CauteryModelToCauteryTip', 'CauteryTipToCautery', self.readTransformFromSettings('CauteryModelToCauteryTip')),
+      ('NeedleToReference', self.ReferenceToRas, None),
+      # Needle camera uses the same default orientation as the cautery camera
+      ('NeedleCameraToNeedle', 'NeedleToReference', cauteryCameraToCauteryDefault),
+      ('NeedleTipToNeedle', 'NeedleToReference', self.readTransformFromSettings('NeedleTipToNeedle')),
+      ('NeedleModelToNeedleTip', 'NeedleTipToNeedle', self.readTransformFromSettings('NeedleModelToNeedleTip')),
+      ('CauteryToNeedle', None, None),
+      ]
+    transformNodes = self.sceneNodeIndex.getOrCreateTransformNodes(transformTree)
+    self.cauteryToReference = transformNodes['CauteryToReference']
+    self.cauteryCameraToCautery = transformNodes['CauteryCameraToCautery']
+    self.cauteryTipToCautery = transformNodes['CauteryTipToCautery']
+    self.cauteryModelToCauteryTip = transformNodes['CauteryModelToCauteryTip']
+    self.needleToReference = transformNodes['NeedleToReference']
+    self.needleCameraToNeedle = transformNodes['NeedleCameraToNeedle']
+    self.needleTipToNeedle = transformNodes['NeedleTipToNeedle']
+    self.needleModelToNeedleTip = transformNodes['NeedleModelToNeedleTip']
+    self.CauteryToNeedle = transformNodes['CauteryToNeedle']
+
     # Cameras
     logging.debug('Create cameras')
       
-    self.LeftCamera = slicer.util.getNode('Left Camera')
+    self.LeftCamera = self.sceneNodeIndex.getNode('Left Camera')
     if not self.LeftCamera:
       self.LeftCamera=slicer.vtkMRMLCameraNode()
       self.LeftCamera.SetName("Left Camera")
       slicer.mrmlScene.AddNode(self.LeftCamera)
 
-    self.RightCamera = slicer.util.getNode('Right Camera')
+    self.RightCamera = self.sceneNodeIndex.getNode('Right Camera')
     if not self.RightCamera:
       self.RightCamera=slicer.vtkMRMLCameraNode()
       self.RightCamera.SetName("Right Camera")
@@ -391,31 +500,32 @@ class LumpNavGuidelet(Guidelet):
     # Models
     logging.debug('Create models')
 
-    self.cauteryModel_CauteryTip = slicer.util.getNode('CauteryModel')
+    self.cauteryModel_CauteryTip = self.sceneNodeIndex.getNode('CauteryModel')
     if not self.cauteryModel_CauteryTip:
       if (self.parameterNode.GetParameter('TestMode')=='True'):
           moduleDirectoryPath = slicer.modules.lumpnav.path.replace('LumpNav.py', '')
           slicer.util.loadModel(qt.QDir.toNativeSeparators(moduleDirectoryPath + '../../../models/temporary/cautery.stl'))
-          self.cauteryModel_CauteryTip=slicer.util.getNode(pattern="cautery")
+          self.cauteryModel_CauteryTip=self.sceneNodeIndex.getNode("cautery")
       else:
-          slicer.modules.createmodels.logic().CreateNeedle(100,1.0,2.5,0)
-          self.cauteryModel_CauteryTip=slicer.util.getNode(pattern="NeedleModel")
+          self.cauteryModel_CauteryTip=self.createNeedleModel(100,1.0,2.5,0)
           self.cauteryModel_CauteryTip.GetDisplayNode().SetColor(1.0, 1.0, 0)
-      self.cauteryModel_CauteryTip.SetName("CauteryModel")
+      self.sceneNodeIndex.setNodeName(self.cauteryModel_CauteryTip, "CauteryModel")
 
-    self.needleModel_NeedleTip = slicer.util.getNode('NeedleModel')
+    self.needleModel_NeedleTip = self.sceneNodeIndex.getNode('NeedleModel')
     if not self.needleModel_NeedleTip:
-      slicer.modules.createmodels.logic().CreateNeedle(80,1.0,2.5,0)
-      self.needleModel_NeedleTip=slicer.util.getNode(pattern="NeedleModel")
+      self.needleModel_NeedleTip=self.createNeedleModel(80,1.0,2.5,0)
       self.needleModel_NeedleTip.GetDisplayNode().SetColor(0.333333, 1.0, 1.0)
-      self.needleModel_NeedleTip.SetName("NeedleModel")
+      self.sceneNodeIndex.setNodeName(self.needleModel_NeedleTip, "NeedleModel")
       self.needleModel_NeedleTip.GetDisplayNode().SliceIntersectionVisibilityOn()
 
     # Create surface from point set
     
     logging.debug('Create surface from point set')
 
-    self.tumorModel_Needle = slicer.util.getNode('TumorModel')
+    # The tumor is kept in two representations generated from the same surface:
+    # TumorModel is the accurate surface watched by the breach warning, it is not displayed, and
+    # TumorModelDisplay is decimated to TumorDisplayTriangleBudget triangles for 3D and slice view rendering.
+    self.tumorModel_Needle = self.sceneNodeIndex.getNode('TumorModel')
     if not self.tumorModel_Needle:
       self.tumorModel_Needle = slicer.vtkMRMLModelNode()
       self.tumorModel_Needle.SetName("TumorModel")
@@ -423,17 +533,33 @@ class LumpNavGuidelet(Guidelet):
       sphereSource.SetRadius(0.001)
       self.tumorModel_Needle.SetPolyDataConnection(sphereSource.GetOutputPort())      
       slicer.mrmlScene.AddNode(self.tumorModel_Needle)
-      # Add display node
+      # Add display node, only used for its color that the breach warning sets
       modelDisplayNode = slicer.vtkMRMLModelDisplayNode()
       modelDisplayNode.SetColor(0,1,0) # Green
+      slicer.mrmlScene.AddNode(modelDisplayNode)
+      self.tumorModel_Needle.SetAndObserveDisplayNodeID(modelDisplayNode.GetID())
+    self.tumorModel_Needle.GetDisplayNode().SetVisibility(False)
+    self.tumorModel_Needle.GetDisplayNode().SliceIntersectionVisibilityOff()
+
+    self.tumorDisplayModel_Needle = self.sceneNodeIndex.getNode('TumorModelDisplay')
+    if not self.tumorDisplayModel_Needle:
+      self.tumorDisplayModel_Needle = slicer.vtkMRMLModelNode()
+      self.tumorDisplayModel_Needle.SetName("TumorModelDisplay")
+      self.tumorDisplayModel_Needle.SetPolyDataConnection(self.tumorModel_Needle.GetPolyDataConnection())
+      slicer.mrmlScene.AddNode(self.tumorDisplayModel_Needle)
+      # Add display node
+      modelDisplayNode = slicer.vtkMRMLModelDisplayNode()
+      modelDisplayNode.SetColor(self.tumorModel_Needle.GetDisplayNode().GetColor())
       modelDisplayNode.BackfaceCullingOff()
       modelDisplayNode.SliceIntersectionVisibilityOn()
       modelDisplayNode.SetSliceIntersectionThickness(4)
       modelDisplayNode.SetOpacity(0.3) # Between 0-1, 1 being opaque
       slicer.mrmlScene.AddNode(modelDisplayNode)
-      self.tumorModel_Needle.SetAndObserveDisplayNodeID(modelDisplayNode.GetID())
+      self.tumorDisplayModel_Needle.SetAndObserveDisplayNodeID(modelDisplayNode.GetID())
+    # Breach warning changes the color of the watched model, show it on the displayed model
+    self.observers.addObserver(self.tumorModel_Needle.GetDisplayNode(), vtk.vtkCommand.ModifiedEvent, self.onTumorModelDisplayNodeModified)
 
-    tumorMarkups_Needle = slicer.util.getNode('T')
+    tumorMarkups_Needle = self.sceneNodeIndex.getNode('T')
     if not tumorMarkups_Needle:
       tumorMarkups_Needle = slicer.vtkMRMLMarkupsFiducialNode()
       tumorMarkups_Needle.SetName("T")
@@ -444,7 +570,7 @@ class LumpNavGuidelet(Guidelet):
 
     # Set up breach warning node
     logging.debug('Set up breach warning')
-    self.breachWarningNode = slicer.util.getNode('LumpNavBreachWarning')
+    self.breachWarningNode = self.sceneNodeIndex.getNode('LumpNavBreachWarning')
 
     if not self.breachWarningNode:
       self.breachWarningNode = slicer.mrmlScene.CreateNodeByClass('vtkMRMLBreachWarningNode')
@@ -461,6 +587,18 @@ class LumpNavGuidelet(Guidelet):
     logging.debug('Set up breach warning light')
     self.breachWarningLightLogic = BreachWarningLight.BreachWarningLightLogic()
     self.breachWarningLightLogic.setMarginSizeMm(float(self.parameterNode.GetParameter('BreachWarningLightMarginSizeMm')))
+    # Breach warning updates are logged for post-operative analysis (read by LumpNavLib.BreachEventLog.readBreachEventLog)
+    self.breachEventLog = None
+    breachEventLogPath = self.parameterNode.GetParameter('BreachEventLogPath')
+    if breachEventLogPath:
+      breachEventLogFilePath = os.path.join(breachEventLogPath, 'BreachEvents-' + time.strftime("%Y%m%d-%H%M%S") + '.bin')
+      try:
+        self.breachEventLog = BreachEventLogWriter(breachEventLogFilePath)
+      except (IOError, OSError) as e:
+        # E.g., the default location in the module directory is not writable, navigation works without the log
+        logging.error('Breach event log {0} cannot be created, breach events are not logged: {1}'.format(breachEventLogFilePath, e))
+    if self.breachEventLog:
+      self.breachWarningLightLogic.setBreachEventLog(self.breachEventLog, self.breachWarningNode)
     if (self.parameterNode.GetParameter('EnableBreachWarningLight')=='True'):
       logging.debug("BreachWarningLight: active")
       self.breachWarningLightLogic.startLightFeedback(self.breachWarningNode, self.connectorNode)
@@ -470,16 +608,11 @@ class LumpNavGuidelet(Guidelet):
 
     # Build transform tree
     logging.debug('Set up transform tree')
-    self.cauteryToReference.SetAndObserveTransformNodeID(self.ReferenceToRas.GetID())
-    self.cauteryCameraToCautery.SetAndObserveTransformNodeID(self.cauteryToReference.GetID())
-    self.cauteryTipToCautery.SetAndObserveTransformNodeID(self.cauteryToReference.GetID())
-    self.cauteryModelToCauteryTip.SetAndObserveTransformNodeID(self.cauteryTipToCautery.GetID())
-    self.needleToReference.SetAndObserveTransformNodeID(self.ReferenceToRas.GetID())
-    self.needleTipToNeedle.SetAndObserveTransformNodeID(self.needleToReference.GetID())
-    self.needleModelToNeedleTip.SetAndObserveTransformNodeID(self.needleTipToNeedle.GetID())
+    # Transforms are already connected by getOrCreateTransformNodes, only models and markups are added here
     self.cauteryModel_CauteryTip.SetAndObserveTransformNodeID(self.cauteryModelToCauteryTip.GetID())
     self.needleModel_NeedleTip.SetAndObserveTransformNodeID(self.needleModelToNeedleTip.GetID())
     self.tumorModel_Needle.SetAndObserveTransformNodeID(self.needleToReference.GetID())
+    self.tumorDisplayModel_Needle.SetAndObserveTransformNodeID(self.needleToReference.GetID())
     self.tumorMarkups_Needle.SetAndObserveTransformNodeID(self.needleToReference.GetID())      
     # self.liveUltrasoundNode_Reference.SetAndObserveTransformNodeID(self.ReferenceToRas.GetID())
     
@@ -491,14 +624,30 @@ class LumpNavGuidelet(Guidelet):
     dataProbeParameterNode=dataProbeUtil.getParameterNode()
     dataProbeParameterNode.SetParameter('showSliceViewAnnotations', '0')
 
+  def createNeedleModel(self, lengthMm, radiusMm, tipRadiusMm, markers):
+    cacheKey = self.toolModelCache.getNeedleKey(lengthMm, radiusMm, tipRadiusMm, markers)
+    polyData = self.toolModelCache.load(cacheKey)
+    if polyData:
+      modelNode = slicer.vtkMRMLModelNode()
+      modelNode.SetName("NeedleModel")
+      modelNode.SetAndObservePolyData(polyData)
+      slicer.mrmlScene.AddNode(modelNode)
+      modelDisplayNode = slicer.vtkMRMLModelDisplayNode()
+      slicer.mrmlScene.AddNode(modelDisplayNode)
+      modelNode.SetAndObserveDisplayNodeID(modelDisplayNode.GetID())
+      return modelNode
+    # Not in the cache yet, generate the model and store it for the next launch
+    slicer.modules.createmodels.logic().CreateNeedle(lengthMm, radiusMm, tipRadiusMm, markers)
+    modelNode = self.sceneNodeIndex.getNode("NeedleModel")
+    self.toolModelCache.save(cacheKey, modelNode.GetPolyData())
+    return modelNode
+
   def disconnect(self):#TODO see connect
     logging.debug('LumpNav.disconnect()')
     Guidelet.disconnect(self)
       
     # Remove observer to old parameter node
-    if self.tumorMarkups_Needle and self.tumorMarkups_NeedleObserver:
-      self.tumorMarkups_Needle.RemoveObserver(self.tumorMarkups_NeedleObserver)
-      self.tumorMarkups_NeedleObserver = None
+    self.observers.removeObservers('tumorMarkups')
 
     self.calibrationCollapsibleButton.disconnect('toggled(bool)', self.onCalibrationPanelToggled)
     self.navigationCollapsibleButton.disconnect('toggled(bool)', self.onNavigationPanelToggled)
@@ -508,10 +657,17 @@ class LumpNavGuidelet(Guidelet):
     self.deleteLastFiducialButton.disconnect('clicked()', self.onDeleteLastFiducialClicked)
     self.deleteLastFiducialDuringNavigationButton.disconnect('clicked()', self.onDeleteLastFiducialClicked)    
     self.deleteAllFiducialsButton.disconnect('clicked()', self.onDeleteAllFiducialsClicked)
+    self.streamingRecordingButton.disconnect('clicked(bool)', self.onStreamingRecordingClicked)
+    self.loadRecordingButton.disconnect('clicked()', self.onLoadRecordingClicked)
+    self.replayPlayButton.disconnect('clicked(bool)', self.onReplayPlayClicked)
+    self.replaySpeedComboBox.disconnect('currentIndexChanged(int)', self.onReplaySpeedChanged)
+    self.replayTimeSlider.disconnect('valueChanged(double)', self.onReplayTimeSliderChanged)
     self.placeButton.disconnect('clicked(bool)', self.onPlaceClicked)
 
     self.rightCameraButton.disconnect('clicked()', self.onRightCameraButtonClicked)
     self.leftCameraButton.disconnect('clicked()', self.onLeftCameraButtonClicked)
+    self.rightCameraToolComboBox.disconnect('currentIndexChanged(int)', self.onRightCameraToolChanged)
+    self.leftCameraToolComboBox.disconnect('currentIndexChanged(int)', self.onLeftCameraToolChanged)
 
     self.pivotSamplingTimer.disconnect('timeout()',self.onPivotSamplingTimeout)
 
@@ -521,6 +677,9 @@ class LumpNavGuidelet(Guidelet):
     self.cameraZPosSlider.disconnect('valueChanged(double)', self.viewpointLogic.SetCameraZPosMm)
     
     self.placeTumorPointAtCauteryTipButton.disconnect('clicked(bool)', self.onPlaceTumorPointAtCauteryTipClicked)
+    self.sweepTumorPointsAtCauteryTipButton.disconnect('toggled(bool)', self.onSweepTumorPointsAtCauteryTipToggled)
+    self.resectionCoverageButton.disconnect('toggled(bool)', self.onResectionCoverageToggled)
+    self.resetResectionCoverageButton.disconnect('clicked()', self.onResetResectionCoverageClicked)
 
     
   def onPivotSamplingTimeout(self):#lumpnav
@@ -594,16 +753,397 @@ class LumpNavGuidelet(Guidelet):
     self.deleteLastFiducialButton.setEnabled(False)
     self.deleteAllFiducialsButton.setEnabled(False)
     self.deleteLastFiducialDuringNavigationButton.setEnabled(False)
+    self.tumorPointCountLabel.setText('')
     sphereSource = vtk.vtkSphereSource()
     sphereSource.SetRadius(0.001)
-    self.tumorModel_Needle.SetPolyDataConnection(sphereSource.GetOutputPort())      
-    self.tumorModel_Needle.Modified()
+    self.setTumorSurface(sphereSource)
 
   def onPlaceTumorPointAtCauteryTipClicked(self):
-    cauteryTipToNeedle = vtk.vtkMatrix4x4()
-    self.cauteryTipToCautery.GetMatrixTransformToNode(self.needleToReference, cauteryTipToNeedle)
-    self.tumorMarkups_Needle.AddFiducial(cauteryTipToNeedle.GetElement(0,3), cauteryTipToNeedle.GetElement(1,3), cauteryTipToNeedle.GetElement(2,3))
-      
+    cauteryTipToNeedle = self.transformChainCache.getMatrixBetween(self.cauteryTipToCautery, self.needleToReference)
+    self.tumorMarkups_Needle.AddFiducial(cauteryTipToNeedle[0,3], cauteryTipToNeedle[1,3], cauteryTipToNeedle[2,3])
+
+  def onSweepTumorPointsAtCauteryTipToggled(self, toggled):
+    if toggled:
+      self.startTumorPointSweep()
+    else:
+      self.stopTumorPointSweep()
+
+  def startTumorPointSweep(self):
+    # Cautery tip positions in the needle coordinate system are collected at each tracker update,
+    # from the pose history, and added to the tumor markups when the sweep is stopped
+    matrix = vtk.vtkMatrix4x4()
+    self.cauteryTipToCautery.GetMatrixTransformToParent(matrix)
+    self.tumorPointSweepCauteryTipInCautery = arrayFromVtkMatrix(matrix)[:, 3]
+    self.tumorPointSweep = PointSweep(float(self.parameterNode.GetParameter('TumorPointSweepMinimumSpacingMm')), self.getTumorMarkupsPoints())
+    logging.info('Tumor point sweep started')
+
+  def stopTumorPointSweep(self):
+    if not getattr(self, 'tumorPointSweep', None):
+      return
+    newPoints = self.tumorPointSweep.getNewPoints()
+    logging.info('Tumor point sweep stopped: {0} points added, {1} points closer than the minimum spacing skipped'.format(
+      len(newPoints), self.tumorPointSweep.numberOfRejectedPoints))
+    self.tumorPointSweep = None
+    if not self.tumorMarkups_Needle:
+      logging.warning('Tumor point sweep points are dropped, there is no tumor markups node')
+      return
+    # All points are added in one batch, so that the tumor surface is only regenerated once
+    wasModifying = self.tumorMarkups_Needle.StartModify()
+    for point in newPoints:
+      self.tumorMarkups_Needle.AddFiducial(point[0], point[1], point[2])
+    self.tumorMarkups_Needle.EndModify(wasModifying)
+
+  def addTumorPointSweepPoint(self):
+    # no logging - called at the tracker update rate
+    needleToReference = poseHistoryService.getLatestPose('NeedleToReference')
+    cauteryToReference = poseHistoryService.getLatestPose('CauteryToReference')
+    cauteryTipInReference = cauteryToReference.dot(self.tumorPointSweepCauteryTipInCautery)
+    cauteryTipInNeedle = numpy.linalg.solve(needleToReference, cauteryTipInReference)
+    self.tumorPointSweep.addPoint(cauteryTipInNeedle[0:3])
+
+  def onResectionCoverageToggled(self, toggled):
+    if toggled:
+      self.startResectionCoverage()
+    else:
+      self.stopResectionCoverage()
+
+  def onResetResectionCoverageClicked(self):
+    if getattr(self, 'resectionCoverageMap', None):
+      self.resectionCoverageMap.reset()
+      self.updateResectionCoverageDisplay()
+
+  def startResectionCoverage(self):
+    # Cautery tip path is accumulated at each tracker update, the tumor surface is colored
+    # by the nearest approach of the path at a fixed, lower rate
+    voxelSizeMm = float(self.parameterNode.GetParameter('ResectionCoverageVoxelSizeMm'))
+    if not getattr(self, 'resectionCoverageMap', None) or self.resectionCoverageMap.voxelSizeMm != voxelSizeMm:
+      self.resectionCoverageMap = ResectionCoverageMap(voxelSizeMm)
+    self.resectionCoverageMap.resetPath()
+    self.resectionCoverageMaximumTrackingGapSec = float(self.parameterNode.GetParameter('ResectionCoverageMaximumTrackingGapSec'))
+    self.resectionCoverageLastCauteryUpdateTimeSec = 0.0
+    self.resectionCoverageDisplayedVersion = None
+    self.resectionCoverageDisplayedPolyDataMTime = None
+    self.resectionCoverageTimer = qt.QTimer()
+    self.resectionCoverageTimer.setInterval(int(1000.0 / float(self.parameterNode.GetParameter('ResectionCoverageRefreshRateHz'))))
+    self.resectionCoverageTimer.connect('timeout()', self.updateResectionCoverageDisplay)
+    self.resectionCoverageTimer.start()
+
+    maximumDistanceMm = float(self.parameterNode.GetParameter('ResectionCoverageMaximumDistanceMm'))
+    displayNode = self.tumorDisplayModel_Needle.GetDisplayNode()
+    displayNode.SetActiveScalarName('ResectionCoverageDistanceMm')
+    displayNode.SetAndObserveColorNodeID('vtkMRMLColorTableNodeRainbow')
+    if hasattr(displayNode, 'SetScalarRangeFlag'):
+      displayNode.SetScalarRangeFlag(slicer.vtkMRMLDisplayNode.UseManualScalarRange)
+    else:
+      displayNode.SetAutoScalarRange(False)
+    displayNode.SetScalarRange(0, maximumDistanceMm)
+    self.updateResectionCoverageDisplay()
+    displayNode.SetScalarVisibility(True)
+    logging.info('Resection coverage tracking started')
+
+  def stopResectionCoverage(self):
+    if not getattr(self, 'resectionCoverageTimer', None):
+      return
+    self.resectionCoverageTimer.stop()
+    self.resectionCoverageTimer.disconnect('timeout()', self.updateResectionCoverageDisplay)
+    self.resectionCoverageTimer = None
+    self.tumorDisplayModel_Needle.GetDisplayNode().SetScalarVisibility(False)
+    logging.info('Resection coverage tracking stopped: {0} voxels covered, {1} points dropped'.format(
+      self.resectionCoverageMap.numberOfOccupiedVoxels, self.resectionCoverageMap.numberOfDroppedPoints))
+
+  def updateResectionCoverageDisplay(self):
+    polyData = self.tumorDisplayModel_Needle.GetPolyData()
+    if not polyData or not polyData.GetNumberOfPoints():
+      return
+    # Skip the update if neither the path nor the tumor surface changed since the last update
+    if (self.resectionCoverageMap.version == self.resectionCoverageDisplayedVersion
+      and polyData.GetMTime() == self.resectionCoverageDisplayedPolyDataMTime):
+      return
+    vertices = numpy_support.vtk_to_numpy(polyData.GetPoints().GetData())
+    distancesMm = self.resectionCoverageMap.computeNearestApproachDistances(vertices,
+      float(self.parameterNode.GetParameter('ResectionCoverageMaximumDistanceMm')))
+    distanceArray = numpy_support.numpy_to_vtk(distancesMm, deep=True)
+    distanceArray.SetName('ResectionCoverageDistanceMm')
+    polyData.GetPointData().AddArray(distanceArray)
+    polyData.Modified()
+    self.resectionCoverageDisplayedVersion = self.resectionCoverageMap.version
+    self.resectionCoverageDisplayedPolyDataMTime = polyData.GetMTime()
+
+  def onStreamingRecordingClicked(self, pushed):
+    moduleDirectoryPath = slicer.modules.lumpnav.path.replace('LumpNav.py', '')
+    if pushed:
+      if not self.startStreamingRecording():
+        # Button stays in the start state, the reason is logged (setChecked does not emit clicked)
+        self.streamingRecordingButton.setChecked(False)
+        return
+      self.streamingRecordingButton.setText("Stop streaming recording")
+      self.streamingRecordingButton.setIcon(qt.QIcon(moduleDirectoryPath + '/Resources/Icons/icon_Stop.png'))
+    else:
+      self.stopStreamingRecording()
+      self.streamingRecordingButton.setText("Start streaming recording")
+      self.streamingRecordingButton.setIcon(qt.QIcon(moduleDirectoryPath + '/Resources/Icons/icon_Record.png'))
+
+  def startStreamingRecording(self):
+    """Returns False if the recording cannot be started.
+    """
+    self.stopStreamingRecording()
+    ultrasoundNode = getattr(self, 'liveUltrasoundNode_Reference', None) or self.sceneNodeIndex.getNode('Image_Reference')
+    if not ultrasoundNode:
+      logging.error('Streaming recording cannot be started, live ultrasound image node is not found')
+      return False
+
+    transformNames = self.parameterNode.GetParameter('StreamingRecordingTransformNames').split()
+    self.streamingRecordingTransformNames = transformNames
+    self.streamingRecordingTransformNodes = []
+    for transformName in transformNames:
+      transformNode = self.sceneNodeIndex.getNode(transformName)
+      if not transformNode:
+        logging.warning('Transform {0} is not found, it will be recorded as identity'.format(transformName))
+      self.streamingRecordingTransformNodes.append(transformNode)
+
+    # Calibrations and image geometry do not change during recording, they are stored once in the header
+    matrix = vtk.vtkMatrix4x4()
+    staticTransforms = {}
+    self.cauteryTipToCautery.GetMatrixTransformToParent(matrix)
+    staticTransforms['CauteryTipToCautery'] = arrayFromVtkMatrix(matrix)
+    self.needleTipToNeedle.GetMatrixTransformToParent(matrix)
+    staticTransforms['NeedleTipToNeedle'] = arrayFromVtkMatrix(matrix)
+    ultrasoundNode.GetIJKToRASMatrix(matrix)
+    staticTransforms['ImageIJKToReference'] = arrayFromVtkMatrix(matrix)
+
+    recordingPath = os.path.join(self.parameterNode.GetParameter('StreamingRecordingPath'),
+      self.parameterNode.GetParameter('RecordingFilenamePrefix') + time.strftime("%Y%m%d-%H%M%S"))
+    self.streamingRecorder = TrackedUltrasoundRecorder(recordingPath, transformNames, staticTransforms,
+      tumorSurfaceParameters=self.getTumorSurfaceParameterValues())
+    if not self.streamingRecorder.start():
+      self.streamingRecorder = None
+      return False
+    self.streamingRecorder.addMarkupsSnapshot(time.time(), self.getTumorMarkupsPoints())
+    self.streamingRecordingPoses = numpy.tile(numpy.eye(4), (len(transformNames), 1, 1))
+    self.streamingRecordingMatrix = vtk.vtkMatrix4x4()
+    self.streamingRecordingUltrasoundNode = ultrasoundNode
+    self.observers.addObserver(ultrasoundNode, slicer.vtkMRMLVolumeNode.ImageDataModifiedEvent, self.onStreamingRecordingImageModified, group='streamingRecording')
+    logging.info('Streaming recording started: {0}'.format(recordingPath))
+    return True
+
+  def stopStreamingRecording(self):
+    if not getattr(self, 'streamingRecorder', None):
+      return
+    self.observers.removeObservers('streamingRecording')
+    self.streamingRecordingUltrasoundNode = None
+    self.streamingRecorder.stop()
+    self.streamingRecorder = None
+
+  def getTumorMarkupsPoints(self):
+    numberOfPoints = self.tumorMarkups_Needle.GetNumberOfFiducials()
+    points = numpy.zeros((numberOfPoints, 3))
+    for i in range(numberOfPoints):
+      self.tumorMarkups_Needle.GetNthFiducialPosition(i, points[i])
+    return points
+
+  def onStreamingRecordingImageModified(self, caller, eventId):
+    # no logging - called at the ultrasound frame rate
+    imageData = self.streamingRecordingUltrasoundNode.GetImageData()
+    if not imageData or not imageData.GetPointData().GetScalars():
+      return
+    dimensions = imageData.GetDimensions()
+    scalars = imageData.GetPointData().GetScalars()
+    frame = numpy_support.vtk_to_numpy(scalars).reshape(dimensions[2], dimensions[1], dimensions[0], scalars.GetNumberOfComponents())
+    trackedToolNames = poseHistoryService.getToolNames()
+    for transformIndex, transformNode in enumerate(self.streamingRecordingTransformNodes):
+      transformName = self.streamingRecordingTransformNames[transformIndex]
+      if transformName in trackedToolNames:
+        # Tracked tool poses are taken from the pose history
+        self.streamingRecordingPoses[transformIndex] = poseHistoryService.getLatestPose(transformName)
+      elif transformNode:
+        transformNode.GetMatrixTransformToParent(self.streamingRecordingMatrix)
+        arrayFromVtkMatrix(self.streamingRecordingMatrix, self.streamingRecordingPoses[transformIndex])
+    self.streamingRecorder.addFrame(time.time(), frame, self.streamingRecordingPoses)
+
+  def onLoadRecordingClicked(self):
+    recordingPath = qt.QFileDialog.getExistingDirectory(None, "Select recording", self.parameterNode.GetParameter('StreamingRecordingPath'))
+    if recordingPath:
+      self.startReplay(recordingPath)
+
+  def startReplay(self, recordingPath):
+    self.stopReplay()
+    try:
+      reader = TrackedUltrasoundRecordingReader(recordingPath)
+    except (IOError, OSError, ValueError) as e:
+      logging.error('Failed to load recording {0}: {1}'.format(recordingPath, e))
+      return
+    logging.info('Replay recording {0} ({1} frames)'.format(recordingPath, reader.getNumberOfFrames()))
+
+    # Replayed data would be overwritten by live data. The connection is restarted when the replay is stopped.
+    self.replayStoppedConnector = False
+    if self.connectorNode and self.connectorNode.GetState() != slicer.vtkMRMLIGTLConnectorNode.STATE_OFF:
+      self.connectorNode.Stop()
+      self.replayStoppedConnector = True
+
+    transformNodes = {}
+    for transformName in reader.transformNames:
+      transformNodes[transformName] = self.sceneNodeIndex.getNode(transformName)
+    ultrasoundNode = getattr(self, 'liveUltrasoundNode_Reference', None) or self.sceneNodeIndex.getNode('Image_Reference')
+    self.sessionReplay = SessionReplay(reader, transformNodes, ultrasoundNode, self.tumorMarkups_Needle)
+    self.sessionReplay.timeChangedCallback = self.onReplayTimeChanged
+    self.onReplaySpeedChanged(self.replaySpeedComboBox.currentIndex)
+
+    self.replayTimeSlider.maximum = self.sessionReplay.durationSec
+    self.replayTimeSlider.value = 0
+    self.replayTimeSlider.setEnabled(True)
+    self.replayPlayButton.setEnabled(True)
+    self.sessionReplay.seek(0)
+
+  def stopReplay(self):
+    if not getattr(self, 'sessionReplay', None):
+      return
+    # Restores the live ultrasound image and tumor points
+    self.sessionReplay.cleanup()
+    self.sessionReplay = None
+    if self.replayStoppedConnector and self.connectorNode:
+      self.connectorNode.Start()
+    self.replayStoppedConnector = False
+    self.replayPlayButton.setChecked(False)
+    self.replayPlayButton.setEnabled(False)
+    self.replayTimeSlider.setEnabled(False)
+
+  def onReplayPlayClicked(self, pushed):
+    if not getattr(self, 'sessionReplay', None):
+      return
+    if pushed:
+      self.sessionReplay.play()
+    else:
+      self.sessionReplay.stop()
+
+  def onReplaySpeedChanged(self, index):
+    if getattr(self, 'sessionReplay', None):
+      self.sessionReplay.setPlaybackRate(float(self.replaySpeedComboBox.itemText(index).rstrip('x')))
+
+  def onReplayTimeSliderChanged(self, timeSec):
+    if getattr(self, 'sessionReplay', None) and abs(timeSec - self.sessionReplay.currentTimeSec) > 1e-3:
+      self.sessionReplay.seek(timeSec)
+
+  def onReplayTimeChanged(self, timeSec):
+    # Update the slider without seeking again
+    wasBlocked = self.replayTimeSlider.blockSignals(True)
+    self.replayTimeSlider.value = timeSec
+    self.replayTimeSlider.blockSignals(wasBlocked)
+    if not self.sessionReplay.isPlaying():
+      self.replayPlayButton.setChecked(False)
+
+  def setupEventRateMonitor(self):
+    # Tracker updates are counted on the cautery transform, which is the one that drives the camera and breach warning
+    self.observers.addObserver(self.cauteryToReference, slicer.vtkMRMLTransformNode.TransformModifiedEvent,
+      self.onTrackerTransformModified, group='eventRateMonitor')
+    self.renderWindow = slicer.app.layoutManager().threeDWidget(0).threeDView().renderWindow()
+    self.observers.addObserver(self.renderWindow, vtk.vtkCommand.EndEvent, self.onRenderWindowRendered, group='eventRateMonitor')
+    # Main thread stalls are measured from the delay of a periodic timer, which also refreshes the rate display
+    self.eventRateTimer = qt.QTimer()
+    self.eventRateTimer.setInterval(int(eventRateMonitor.stallRecorder.intervalSec * 1000))
+    self.eventRateTimer.connect('timeout()', self.onEventRateTimerTimeout)
+    self.eventRateTimerTicksPerDisplayUpdate = 10
+    self.eventRateTimerTickCount = 0
+    self.eventRateLastLogTimeSec = time.time()
+    eventRateMonitor.reset()
+    self.eventRateTimer.start()
+
+  def setupPoseHistory(self):
+    # Poses of the tracked tools are added to the shared pose history once per tracker update,
+    # consumers query the history instead of the transform nodes
+    self.poseHistoryMatrix = vtk.vtkMatrix4x4()
+    self.poseHistoryToolNamesByNodeID = {}
+    for toolTransformNode in [self.cauteryToReference, self.needleToReference]:
+      self.poseHistoryToolNamesByNodeID[toolTransformNode.GetID()] = toolTransformNode.GetName()
+      self.observers.addObserver(toolTransformNode, slicer.vtkMRMLTransformNode.TransformModifiedEvent,
+        self.onToolTransformModified, group='poseHistory')
+      self.onToolTransformModified(toolTransformNode, None)
+
+  def stopPoseHistory(self):
+    self.observers.removeObservers('poseHistory')
+
+  def onToolTransformModified(self, caller, eventId):
+    # no logging - called at the tracker update rate
+    caller.GetMatrixTransformToParent(self.poseHistoryMatrix)
+    toolHistory = poseHistoryService.getToolHistory(self.poseHistoryToolNamesByNodeID[caller.GetID()])
+    arrayFromVtkMatrix(self.poseHistoryMatrix, toolHistory.getPoseArrayForWriting(time.time()))
+    if getattr(self, 'tumorPointSweep', None):
+      self.addTumorPointSweepPoint()
+    if getattr(self, 'resectionCoverageTimer', None):
+      self.addResectionCoverageTipPosition(caller)
+
+  def addResectionCoverageTipPosition(self, toolTransformNode):
+    # no logging - called at the tracker update rate
+    timeSec = time.time()
+    cauteryTracked = (timeSec - self.resectionCoverageLastCauteryUpdateTimeSec <= self.resectionCoverageMaximumTrackingGapSec)
+    if toolTransformNode == self.cauteryToReference:
+      if not cauteryTracked:
+        # Tracking of the cautery was interrupted, the path is not continued across the gap
+        self.resectionCoverageMap.resetPath()
+      self.resectionCoverageLastCauteryUpdateTimeSec = timeSec
+    elif not cauteryTracked:
+      # Cautery pose is not valid, the needle moving would move the stale cautery tip along the tumor
+      return
+    cauteryTipToNeedle = self.transformChainCache.getMatrixBetween(self.cauteryTipToCautery, self.needleToReference)
+    self.resectionCoverageMap.addTipPosition(cauteryTipToNeedle[0:3, 3])
+
+  def startIncomingTransformCoalescing(self):
+    self.stopIncomingTransformCoalescing()
+    if not self.connectorNode:
+      logging.warning('Incoming transform coalescing is not started, there is no connector')
+      return
+    transformNodes = []
+    for transformName in self.parameterNode.GetParameter('IncomingTransformCoalescingNames').split():
+      transformNode = self.sceneNodeIndex.getNode(transformName)
+      if transformNode:
+        transformNodes.append(transformNode)
+      else:
+        logging.warning('Incoming transform {0} is not coalesced, node not found'.format(transformName))
+    self.incomingTransformCoalescer = IncomingTransformCoalescer(self.connectorNode, transformNodes,
+      int(self.parameterNode.GetParameter('IncomingTransformCoalescingIntervalMs')))
+
+  def stopIncomingTransformCoalescing(self):
+    if not getattr(self, 'incomingTransformCoalescer', None):
+      return
+    self.incomingTransformCoalescer.cleanup()
+    self.incomingTransformCoalescer = None
+
+  def stopEventRateMonitor(self):
+    self.eventRateTimer.stop()
+    self.eventRateTimer.disconnect('timeout()', self.onEventRateTimerTimeout)
+    self.observers.removeObservers('eventRateMonitor')
+
+  def onTrackerTransformModified(self, caller, eventId):
+    eventRateMonitor.tick(TRACKER_TRANSFORM_EVENT)
+
+  def onRenderWindowRendered(self, caller, eventId):
+    eventRateMonitor.tick(RENDER_EVENT)
+
+  def onEventRateTimerTimeout(self):
+    eventRateMonitor.stallRecorder.tick()
+    self.eventRateTimerTickCount += 1
+    if self.eventRateTimerTickCount % self.eventRateTimerTicksPerDisplayUpdate:
+      return
+    if not self.eventRateCollapsibleButton.collapsed:
+      self.updateEventRateDisplay()
+    logIntervalSec = float(self.parameterNode.GetParameter('EventRateLogIntervalSec'))
+    if logIntervalSec > 0 and time.time() - self.eventRateLastLogTimeSec >= logIntervalSec:
+      self.eventRateLastLogTimeSec = time.time()
+      logging.info('Event rates: ' + eventRateMonitor.getSummaryText())
+
+  def updateEventRateDisplay(self):
+    snapshot = eventRateMonitor.getSnapshot()
+    for eventName, label in self.eventRateLabels.items():
+      label.setText('{0:.1f} Hz'.format(snapshot['ratesHz'].get(eventName, 0.0)))
+    self.stallTimeLabel.setText('{0:.1f}% (max {1:.0f} ms)'.format(snapshot['stallTimePercent'], 1000.0 * snapshot['maximumStallSec']))
+    viewStatistics = self.viewRenderThrottle.getStatistics()
+    self.viewFrameTimeLabel.setText(', '.join('{0}: {1:.1f} ms ({2:.0f} Hz)'.format(viewName, viewStatistics[viewName]['meanFrameTimeMs'], viewStatistics[viewName]['frameRateHz'])
+      for viewName in sorted(viewStatistics.keys())))
+    if self.incomingTransformCoalescer:
+      counters = self.incomingTransformCoalescer.getCounters()
+      self.incomingTransformLabel.setText('{0} applied, {1} dropped of {2}'.format(counters['applied'], counters['dropped'], counters['received']))
+    else:
+      self.incomingTransformLabel.setText('not coalesced')
+
   def setupCalibrationPanel(self):
     logging.debug('setupCalibrationPanel')
 
@@ -656,6 +1196,48 @@ class LumpNavGuidelet(Guidelet):
     hbox.addWidget(self.deleteAllFiducialsButton)
     self.ultrasoundLayout.addRow(hbox)
 
+    self.tumorPointCountLabel = qt.QLabel()
+    self.ultrasoundLayout.addRow("Points: ", self.tumorPointCountLabel)
+
+    moduleDirectoryPath = slicer.modules.lumpnav.path.replace('LumpNav.py', '')
+    self.streamingRecordingButton = qt.QPushButton("Start streaming recording")
+    self.streamingRecordingButton.setCheckable(True)
+    self.streamingRecordingButton.setIcon(qt.QIcon(moduleDirectoryPath + '/Resources/Icons/icon_Record.png'))
+    self.streamingRecordingButton.setToolTip("Record ultrasound frames and tool poses to a chunked binary recording")
+    setButtonStyle(self.streamingRecordingButton)
+    self.ultrasoundLayout.addRow(self.streamingRecordingButton)
+
+    self.replayCollapsibleButton = ctk.ctkCollapsibleGroupBox()
+    self.replayCollapsibleButton.title = "Replay"
+    self.replayCollapsibleButton.collapsed = True
+    self.ultrasoundLayout.addRow(self.replayCollapsibleButton)
+    self.replayFormLayout = qt.QFormLayout(self.replayCollapsibleButton)
+
+    self.loadRecordingButton = qt.QPushButton("Load recording")
+    self.loadRecordingButton.setToolTip("Replay a streaming recording instead of live data. Live connection is stopped during the replay.")
+    setButtonStyle(self.loadRecordingButton)
+    self.replayFormLayout.addRow(self.loadRecordingButton)
+
+    self.replayPlayButton = qt.QPushButton("Play")
+    self.replayPlayButton.setCheckable(True)
+    self.replayPlayButton.setEnabled(False)
+    setButtonStyle(self.replayPlayButton)
+    self.replaySpeedComboBox = qt.QComboBox()
+    for speed in ['0.5x', '1x', '2x', '4x', '8x']:
+      self.replaySpeedComboBox.addItem(speed)
+    self.replaySpeedComboBox.setCurrentIndex(1)
+    hbox = qt.QHBoxLayout()
+    hbox.addWidget(self.replayPlayButton)
+    hbox.addWidget(self.replaySpeedComboBox)
+    self.replayFormLayout.addRow(hbox)
+
+    self.replayTimeSlider = ctk.ctkSliderWidget()
+    self.replayTimeSlider.singleStep = 0.1
+    self.replayTimeSlider.minimum = 0
+    self.replayTimeSlider.maximum = 0
+    self.replayTimeSlider.setEnabled(False)
+    self.replayFormLayout.addRow("Time [s]: ", self.replayTimeSlider)
+
   def setupNavigationPanel(self):
     logging.debug('setupNavigationPanel')
 
@@ -691,6 +1273,31 @@ class LumpNavGuidelet(Guidelet):
     hbox.addWidget(self.rightCameraButton)
     self.navigationCollapsibleLayout.addRow(hbox)
 
+    # Each camera follows the cautery or the needle, both cameras can follow tools at the same time
+    self.leftCameraToolComboBox = qt.QComboBox()
+    self.rightCameraToolComboBox = qt.QComboBox()
+    for toolComboBox in [self.leftCameraToolComboBox, self.rightCameraToolComboBox]:
+      for toolName in ['Cautery', 'Needle']:
+        toolComboBox.addItem(toolName)
+      toolComboBox.setToolTip("Tool that the camera follows")
+    hbox = qt.QHBoxLayout()
+    hbox.addWidget(self.leftCameraToolComboBox)
+    hbox.addWidget(self.rightCameraToolComboBox)
+    self.navigationCollapsibleLayout.addRow(hbox)
+
+    self.resectionCoverageButton = qt.QPushButton("Show resection coverage")
+    self.resectionCoverageButton.setCheckable(True)
+    self.resectionCoverageButton.setToolTip("While pushed, the cautery tip path is tracked and the tumor surface is colored by the closest approach of the path")
+    setButtonStyle(self.resectionCoverageButton)
+
+    self.resetResectionCoverageButton = qt.QPushButton("Reset coverage")
+    setButtonStyle(self.resetResectionCoverageButton)
+
+    hbox = qt.QHBoxLayout()
+    hbox.addWidget(self.resectionCoverageButton)
+    hbox.addWidget(self.resetResectionCoverageButton)
+    self.navigationCollapsibleLayout.addRow(hbox)
+
     # "Camera Control" Collapsible
     self.zoomCollapsibleButton = ctk.ctkCollapsibleGroupBox()
     self.zoomCollapsibleButton.collapsed=True
@@ -769,6 +1376,12 @@ class LumpNavGuidelet(Guidelet):
     self.placeTumorPointAtCauteryTipButton = qt.QPushButton("Mark point at cautery tip")
     setButtonStyle(self.placeTumorPointAtCauteryTipButton)
     self.contourAdjustmentFormLayout.addRow(self.placeTumorPointAtCauteryTipButton)
+
+    self.sweepTumorPointsAtCauteryTipButton = qt.QPushButton("Sweep points at cautery tip")
+    self.sweepTumorPointsAtCauteryTipButton.setCheckable(True)
+    self.sweepTumorPointsAtCauteryTipButton.setToolTip("While pushed, cautery tip positions are collected (at least TumorPointSweepMinimumSpacingMm apart) and added to the tumor contour when released")
+    setButtonStyle(self.sweepTumorPointsAtCauteryTipButton)
+    self.contourAdjustmentFormLayout.addRow(self.sweepTumorPointsAtCauteryTipButton)
     
     self.deleteLastFiducialDuringNavigationButton = qt.QPushButton("Delete last")
     self.deleteLastFiducialDuringNavigationButton.setIcon(qt.QIcon(":/Icons/MarkupsDelete.png"))
@@ -776,6 +1389,27 @@ class LumpNavGuidelet(Guidelet):
     self.deleteLastFiducialDuringNavigationButton.setEnabled(False)
     self.contourAdjustmentFormLayout.addRow(self.deleteLastFiducialDuringNavigationButton)
 
+    # "Event rates" Collapsible
+    self.eventRateCollapsibleButton = ctk.ctkCollapsibleGroupBox()
+    self.eventRateCollapsibleButton.title = "Event rates"
+    self.eventRateCollapsibleButton.collapsed=True
+    self.navigationCollapsibleLayout.addRow(self.eventRateCollapsibleButton)
+
+    # Layout within the collapsible button
+    self.eventRateFormLayout = qt.QFormLayout(self.eventRateCollapsibleButton)
+
+    self.eventRateLabels = {}
+    for eventName, labelText in [(TRACKER_TRANSFORM_EVENT, "Tracker: "), (VIEWPOINT_CAMERA_EVENT, "Camera: "),
+      (RENDER_EVENT, "Render: "), (TUMOR_REBUILD_EVENT, "Tumor rebuild: "), (BREACH_LIGHT_COMMAND_EVENT, "Breach light: ")]:
+      self.eventRateLabels[eventName] = qt.QLabel()
+      self.eventRateFormLayout.addRow(labelText, self.eventRateLabels[eventName])
+    self.stallTimeLabel = qt.QLabel()
+    self.eventRateFormLayout.addRow("Main thread stall: ", self.stallTimeLabel)
+    self.viewFrameTimeLabel = qt.QLabel()
+    self.eventRateFormLayout.addRow("View frame time: ", self.viewFrameTimeLabel)
+    self.incomingTransformLabel = qt.QLabel()
+    self.eventRateFormLayout.addRow("Incoming transforms: ", self.incomingTransformLabel)
+
   def onCalibrationPanelToggled(self, toggled):
     if toggled == False:
       return
@@ -794,10 +1428,6 @@ class LumpNavGuidelet(Guidelet):
     logging.debug('createTumorFromMarkups')
     #self.tumorMarkups_Needle.SetDisplayVisibility(0)
     
-    # Create polydata point set from markup points
-    points = vtk.vtkPoints()
-    cellArray = vtk.vtkCellArray()
-    
     numberOfPoints = self.tumorMarkups_Needle.GetNumberOfFiducials()
 
     if numberOfPoints>0:
@@ -810,64 +1440,39 @@ class LumpNavGuidelet(Guidelet):
     if numberOfPoints<1:
       return
 
-    points.SetNumberOfPoints(numberOfPoints)
-    new_coord = [0.0, 0.0, 0.0]
-
-    for i in range(numberOfPoints):
-      self.tumorMarkups_Needle.GetNthFiducialPosition(i,new_coord)
-      points.SetPoint(i, new_coord)
-
-    cellArray.InsertNextCell(numberOfPoints)
-    for i in range(numberOfPoints):
-      cellArray.InsertCellPoint(i)
-
-    pointPolyData = vtk.vtkPolyData()
-    pointPolyData.SetLines(cellArray)
-    pointPolyData.SetPoints(points)
-    
-    delaunay = vtk.vtkDelaunay3D()
-
-    if numberOfPoints<10:
-      logging.debug("use glyphs")
-      sphere = vtk.vtkCubeSource()
-      glyph = vtk.vtkGlyph3D()
-      glyph.SetInputData(pointPolyData)
-      glyph.SetSourceConnection(sphere.GetOutputPort())
-      #glyph.SetVectorModeToUseNormal()
-      #glyph.SetScaleModeToScaleByVector()
-      #glyph.SetScaleFactor(0.25)
-      delaunay.SetInputConnection(glyph.GetOutputPort())
-    else:
-      delaunay.SetInputData(pointPolyData)
-
-    surfaceFilter = vtk.vtkDataSetSurfaceFilter()
-    surfaceFilter.SetInputConnection(delaunay.GetOutputPort())
-
-    smoother = vtk.vtkButterflySubdivisionFilter()
-    smoother.SetInputConnection(surfaceFilter.GetOutputPort())
-    smoother.SetNumberOfSubdivisions(3)
-    smoother.Update()
-    
-    forceConvexShape = True
-
-    if (forceConvexShape == True):
-        delaunaySmooth = vtk.vtkDelaunay3D()
-        delaunaySmooth.SetInputData(smoother.GetOutput())
-        delaunaySmooth.Update()
-    
-        smoothSurfaceFilter = vtk.vtkDataSetSurfaceFilter()
-        smoothSurfaceFilter.SetInputConnection(delaunaySmooth.GetOutputPort())
-        self.tumorModel_Needle.SetPolyDataConnection(smoothSurfaceFilter.GetOutputPort())
-    else:
-        self.tumorModel_Needle.SetPolyDataConnection(smoother.GetOutputPort())
-    
+    preprocessingParameters, thresholds = getTumorSurfaceParameters(self.getTumorSurfaceParameterValues())
+    points, preprocessingReport = preprocessTumorPoints(self.getTumorMarkupsPoints(), preprocessingParameters)
+    self.tumorPointCountLabel.setText('{0} marked, {1} used for surface ({2})'.format(
+      preprocessingReport['numberOfInputPoints'], preprocessingReport['numberOfEffectivePoints'], preprocessingReport['shape']))
+    self.tumorSurfacePipeline.setPoints(points, thresholds)
+    self.setTumorSurface(self.tumorSurfacePipeline.outputAlgorithm)
+    eventRateMonitor.tick(TUMOR_REBUILD_EVENT)
+
+  def getTumorSurfaceParameterValues(self):
+    # Parameters that determine the tumor surface generated from the markups, they are also stored in streaming recordings
+    return dict((name, self.parameterNode.GetParameter(name)) for name in list(DEFAULT_STRATEGY_THRESHOLDS) + list(DEFAULT_PREPROCESSING_PARAMETERS))
+
+  def setTumorSurface(self, tumorSurface):
+    # Both tumor models are fed from the same surface generation pipeline, the surface is only generated once
+    self.tumorModel_Needle.SetPolyDataConnection(tumorSurface.GetOutputPort())
     self.tumorModel_Needle.Modified()
+    displaySurface = createDisplaySurface(tumorSurface, int(self.parameterNode.GetParameter('TumorDisplayTriangleBudget')), self.tumorDisplayDecimation)
+    self.tumorDisplayModel_Needle.SetPolyDataConnection(displaySurface.GetOutputPort())
+    self.tumorDisplayModel_Needle.Modified()
+
+  def onTumorModelDisplayNodeModified(self, caller, eventId):
+    tumorDisplayModelDisplayNode = self.tumorDisplayModel_Needle.GetDisplayNode()
+    if tumorDisplayModelDisplayNode:
+      tumorDisplayModelDisplayNode.SetColor(caller.GetColor())
 
   def setupViewpoint(self):
-    rightView = slicer.util.getNode("view2")
-    self.RightCamera.SetActiveTag(rightView.GetID())
-    leftView = slicer.util.getNode("view1")
-    self.LeftCamera.SetActiveTag(leftView.GetID())
+    # View nodes are named as in the view render throttle
+    rightView = self.sceneNodeIndex.getNode('View2')
+    if rightView:
+      self.RightCamera.SetActiveTag(rightView.GetID())
+    leftView = self.sceneNodeIndex.getNode('View1')
+    if leftView:
+      self.LeftCamera.SetActiveTag(leftView.GetID())
 
   def setDisableSliders(self, disable):
     self.cameraViewAngleSlider.setDisabled(disable)
@@ -877,29 +1482,39 @@ class LumpNavGuidelet(Guidelet):
 
   def onRightCameraButtonClicked(self):
     logging.debug("onRightCameraButtonClicked {0}".format(self.rightCameraButton.isChecked()))
-    if (self.rightCameraButton.isChecked()== True):
-        self.leftCameraButton.setDisabled(True)
-        self.viewpointLogic.setCameraNode(self.RightCamera)
-        self.viewpointLogic.setTransformNode(self.cauteryCameraToCautery)
-        self.viewpointLogic.startViewpoint()
-        self.setDisableSliders(False)
-    else:
-        self.setDisableSliders(True)
-        self.viewpointLogic.stopViewpoint()
-        self.leftCameraButton.setDisabled(False)
+    self.setCameraFollowsTool(self.RightCamera, self.getCameraToToolTransformNode(self.rightCameraToolComboBox), self.rightCameraButton.isChecked())
 
   def onLeftCameraButtonClicked(self):
     logging.debug("onLeftCameraButtonClicked {0}".format(self.leftCameraButton.isChecked()))
-    if (self.leftCameraButton.isChecked() == True):
-      self.viewpointLogic.setCameraNode(self.LeftCamera)
-      self.viewpointLogic.setTransformNode(self.cauteryCameraToCautery)
-      self.viewpointLogic.startViewpoint()
-      self.rightCameraButton.setDisabled(True)
-      self.setDisableSliders(False)
+    self.setCameraFollowsTool(self.LeftCamera, self.getCameraToToolTransformNode(self.leftCameraToolComboBox), self.leftCameraButton.isChecked())
+
+  def onRightCameraToolChanged(self, index):
+    if self.rightCameraButton.isChecked():
+      self.setCameraFollowsTool(self.RightCamera, self.getCameraToToolTransformNode(self.rightCameraToolComboBox), True)
+
+  def onLeftCameraToolChanged(self, index):
+    if self.leftCameraButton.isChecked():
+      self.setCameraFollowsTool(self.LeftCamera, self.getCameraToToolTransformNode(self.leftCameraToolComboBox), True)
+
+  def getCameraToToolTransformNode(self, toolComboBox):
+    if toolComboBox.currentText == 'Needle':
+      return self.needleCameraToNeedle
+    return self.cauteryCameraToCautery
+
+  def setCameraFollowsTool(self, cameraNode, cameraToToolTransformNode, follow):
+    # Both cameras can follow a tool at the same time, the viewpoint logic updates them in one pass
+    # (cameras that follow the same tool share the transform-to-world computation)
+    if follow:
+      self.viewpointLogic.addCameraBinding(cameraToToolTransformNode, cameraNode)
     else:
-      self.setDisableSliders(True)
-      self.viewpointLogic.stopViewpoint()
-      self.rightCameraButton.setDisabled(False)
+      self.viewpointLogic.removeCameraBinding(cameraNode)
+    boundCameraNodes = self.viewpointLogic.getBoundCameraNodes()
+    self.setDisableSliders(not boundCameraNodes)
+    # If only one camera follows the tool then its view is the primary view, the other view is throttled
+    primaryViewName = None
+    if len(boundCameraNodes) == 1:
+      primaryViewName = 'View2' if boundCameraNodes[0] == self.RightCamera else 'View1'
+    self.viewRenderThrottle.setPrimaryView(primaryViewName)
 
   def onNavigationPanelToggled(self, toggled):
     if toggled == False:
@@ -907,6 +1522,9 @@ class LumpNavGuidelet(Guidelet):
 
     logging.debug('onNavigationPanelToggled')
     self.onViewSelect(self.viewDual3d)
+    # Right view is created when the dual 3D layout is first shown
+    if self.viewRenderThrottle.updateViews():
+      self.viewRenderThrottle.setPrimaryView(self.viewRenderThrottle.primaryViewName)
     self.tumorMarkups_Needle.SetDisplayVisibility(0)
     self.setupViewpoint()
 
@@ -914,19 +1532,20 @@ class LumpNavGuidelet(Guidelet):
     #if self.connectorNode != None:
     #  self.connectorNode.Stop()
 
+  @profiled('LumpNavGuidelet.onTumorMarkupsNodeModified')
   def onTumorMarkupsNodeModified(self, observer, eventid):
     self.createTumorFromMarkups()
+    if getattr(self, 'streamingRecorder', None):
+      self.streamingRecorder.addMarkupsSnapshot(time.time(), self.getTumorMarkupsPoints())
 
   def setAndObserveTumorMarkupsNode(self, tumorMarkups_Needle):
-    if tumorMarkups_Needle == self.tumorMarkups_Needle and self.tumorMarkups_NeedleObserver:
+    if tumorMarkups_Needle == self.tumorMarkups_Needle and self.observers.hasObservers('tumorMarkups'):
       # no change and node is already observed
       return
     # Remove observer to old parameter node
-    if self.tumorMarkups_Needle and self.tumorMarkups_NeedleObserver:
-      self.tumorMarkups_Needle.RemoveObserver(self.tumorMarkups_NeedleObserver)
-      self.tumorMarkups_NeedleObserver = None
+    self.observers.removeObservers('tumorMarkups')
     # Set and observe new parameter node
     self.tumorMarkups_Needle = tumorMarkups_Needle
     if self.tumorMarkups_Needle:
-      self.tumorMarkups_NeedleObserver = self.tumorMarkups_Needle.AddObserver(vtk.vtkCommand.ModifiedEvent, self.onTumorMarkupsNodeModified)
+      self.observers.addObserver(self.tumorMarkups_Needle, vtk.vtkCommand.ModifiedEvent, self.onTumorMarkupsNodeModified, group='tumorMarkups')
      
\ No newline at end of file
@@ -0,0 +1,204 @@
+import numpy
+
+#
+# Vectorized point to triangle mesh distance
+#
+
+# Number of (point, triangle) pairs processed at once, bounds the size of the temporary arrays
+# (about 20 float64 arrays of this size are alive at the same time)
+DEFAULT_MAXIMUM_PAIRS_PER_CHUNK = 250000
+
+def getTriangleMeshArrays(polyData):
+  """Returns the vertices (number of points, 3) and triangle vertex indices (number of triangles, 3) of a VTK
+  surface as NumPy arrays. Polygons are triangulated, other cells are ignored.
+  """
+  import vtk
+  from vtk.util import numpy_support
+  triangulator = vtk.vtkTriangleFilter()
+  triangulator.SetInputData(polyData)
+  triangulator.PassVertsOff()
+  triangulator.PassLinesOff()
+  triangulator.Update()
+  triangulated = triangulator.GetOutput()
+  if triangulated.GetNumberOfPoints() == 0 or triangulated.GetNumberOfPolys() == 0:
+    return numpy.zeros((0, 3)), numpy.zeros((0, 3), dtype=numpy.int64)
+  vertices = numpy_support.vtk_to_numpy(triangulated.GetPoints().GetData()).astype(numpy.float64)
+  # Cell array of triangles is a flat list of (3, id0, id1, id2) records
+  triangles = numpy_support.vtk_to_numpy(triangulated.GetPolys().GetData()).reshape(-1, 4)[:, 1:4].astype(numpy.int64)
+  return vertices, triangles
+
+class TriangleMesh(object):
+  """Triangle mesh with the per-triangle quantities that the distance queries need precomputed.
+  """
+
+  def __init__(self, vertices, triangles):
+    self.vertices = numpy.asarray(vertices, dtype=numpy.float64)
+    self.triangles = numpy.asarray(triangles, dtype=numpy.int64)
+    a = self.vertices[self.triangles[:, 0]]
+    b = self.vertices[self.triangles[:, 1]]
+    c = self.vertices[self.triangles[:, 2]]
+    self.a, self.b, self.c = a, b, c
+    self.ab = b - a
+    self.ac = c - a
+    self.abDotAb = numpy.sum(self.ab * self.ab, axis=1)
+    self.abDotAc = numpy.sum(self.ab * self.ac, axis=1)
+    self.acDotAc = numpy.sum(self.ac * self.ac, axis=1)
+    self.aDotAb = numpy.sum(a * self.ab, axis=1)
+    self.aDotAc = numpy.sum(a * self.ac, axis=1)
+    self.aDotA = numpy.sum(a * a, axis=1)
+    # Quantities of the solid angle (winding number) computation
+    self.bDotB = numpy.sum(b * b, axis=1)
+    self.cDotC = numpy.sum(c * c, axis=1)
+    self.aDotB = numpy.sum(a * b, axis=1)
+    self.aDotC = numpy.sum(a * c, axis=1)
+    self.bDotC = numpy.sum(b * c, axis=1)
+    self.determinants = numpy.sum(a * numpy.cross(b, c), axis=1)
+    # det(a-p, b-p, c-p) = det(a, b, c) - p . (a x b + b x c + c x a)
+    self.crossProductSums = numpy.cross(a, b) + numpy.cross(b, c) + numpy.cross(c, a)
+
+  def getNumberOfTriangles(self):
+    return len(self.triangles)
+
+  def computeSquaredDistancesChunk(self, points):
+    """Returns the squared distance of each point to the closest point of the mesh. All point-triangle pairs
+    are evaluated at once, using the closest point on triangle regions of Ericson, Real-Time Collision Detection.
+    Only dot products of the points with per-triangle vectors are needed, no (points, triangles, 3) arrays.
+    """
+    pointDotAb = points.dot(self.ab.T)
+    pointDotAc = points.dot(self.ac.T)
+    d1 = pointDotAb - self.aDotAb
+    d2 = pointDotAc - self.aDotAc
+    d3 = d1 - self.abDotAb
+    d4 = d2 - self.abDotAc
+    d5 = d1 - self.abDotAc
+    d6 = d2 - self.acDotAc
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+      # Barycentric coordinates (s, t) of the closest point a + s * ab + t * ac in each Voronoi region,
+      # listed in the order of precedence of the regions
+      regions = [
+        ((d1 <= 0) & (d2 <= 0), 0.0, 0.0),
+        ((d3 >= 0) & (d4 <= d3), 1.0, 0.0),
+        ((vc <= 0) & (d1 >= 0) & (d3 <= 0), d1 / (d1 - d3), 0.0),
+        ((d6 >= 0) & (d5 <= d6), 0.0, 1.0),
+        ((vb <= 0) & (d2 >= 0) & (d6 <= 0), 0.0, d2 / (d2 - d6)),
+        ]
+      edgeBcFraction = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+      regions.append(((va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0), 1.0 - edgeBcFraction, edgeBcFraction))
+      sumOfAreas = va + vb + vc
+      conditions = [condition for condition, s, t in regions]
+      s = numpy.select(conditions, [numpy.broadcast_to(s, d1.shape) for condition, s, t in regions], vb / sumOfAreas)
+      t = numpy.select(conditions, [numpy.broadcast_to(t, d1.shape) for condition, s, t in regions], vc / sumOfAreas)
+
+    # |p - a - s * ab - t * ac|^2 expanded into the precomputed dot products
+    apDotAp = numpy.sum(points * points, axis=1)[:, numpy.newaxis] - 2.0 * points.dot(self.a.T) + self.aDotA
+    squaredDistances = apDotAp - 2.0 * s * d1 - 2.0 * t * d2 + s * s * self.abDotAb + 2.0 * s * t * self.abDotAc + t * t * self.acDotAc
+    return numpy.maximum(squaredDistances.min(axis=1), 0.0)
+
+  def computeWindingNumbersChunk(self, points):
+    """Returns the generalized winding number of the mesh at each point (about 1 inside a consistently oriented closed
+    surface and 0 outside, both for outward and inward normals), computed from the solid angles of the triangles
+    (Van Oosterom-Strackee formula).
+    """
+    pointDotPoint = numpy.sum(points * points, axis=1)[:, numpy.newaxis]
+    pointDotA = points.dot(self.a.T)
+    pointDotB = points.dot(self.b.T)
+    pointDotC = points.dot(self.c.T)
+    lengthA = numpy.sqrt(numpy.maximum(pointDotPoint - 2.0 * pointDotA + self.aDotA, 0.0))
+    lengthB = numpy.sqrt(numpy.maximum(pointDotPoint - 2.0 * pointDotB + self.bDotB, 0.0))
+    lengthC = numpy.sqrt(numpy.maximum(pointDotPoint - 2.0 * pointDotC + self.cDotC, 0.0))
+    aDotB = self.aDotB - pointDotA - pointDotB + pointDotPoint
+    aDotC = self.aDotC - pointDotA - pointDotC + pointDotPoint
+    bDotC = self.bDotC - pointDotB - pointDotC + pointDotPoint
+    determinants = self.determinants - points.dot(self.crossProductSums.T)
+    denominators = lengthA * lengthB * lengthC + aDotB * lengthC + aDotC * lengthB + bDotC * lengthA
+    solidAngles = 2.0 * numpy.arctan2(determinants, denominators)
+    return numpy.abs(solidAngles.sum(axis=1)) / (4.0 * numpy.pi)
+
+  def computeSignedDistances(self, points, maximumPairsPerChunk=DEFAULT_MAXIMUM_PAIRS_PER_CHUNK):
+    """Returns the distance of each point (NumPy array of shape (N, 3)) to the mesh surface, negative inside.
+    Points are processed in chunks, so that memory use does not depend on the number of points.
+    """
+    points = numpy.asarray(points, dtype=numpy.float64)
+    distances = numpy.full(len(points), numpy.nan)
+    if not self.getNumberOfTriangles():
+      return distances
+    pointsPerChunk = max(1, maximumPairsPerChunk // self.getNumberOfTriangles())
+    for start in range(0, len(points), pointsPerChunk):
+      chunk = points[start:start + pointsPerChunk]
+      chunkDistances = numpy.sqrt(self.computeSquaredDistancesChunk(chunk))
+      inside = self.computeWindingNumbersChunk(chunk) > 0.5
+      chunkDistances[inside] *= -1.0
+      distances[start:start + pointsPerChunk] = chunkDistances
+    return distances
+
+#
+# Breach timeline statistics
+#
+
+def computeToolTipPositions(toolToReferencePoses, modelToReferencePoses, toolTipToTool):
+  """Returns the tool tip positions in model coordinates for each frame (array of shape (N, 3)).
+  Poses are arrays of shape (N, 4, 4), e.g., CauteryToReference and NeedleToReference timelines.
+  """
+  tipInReference = toolToReferencePoses.dot(toolTipToTool[:, 3])
+  return numpy.linalg.solve(modelToReferencePoses, tipInReference[:, :, numpy.newaxis])[:, 0:3, 0]
+
+def findIntervals(mask, timestamps):
+  """Returns the [start, stop] times of the runs of True values of mask, as a list of (startTime, stopTime, startFrame, stopFrame).
+  The stop frame is the last frame of the run.
+  """
+  if not len(mask):
+    return []
+  changes = numpy.diff(numpy.concatenate([[False], mask, [False]]).astype(numpy.int8))
+  startFrames = numpy.nonzero(changes == 1)[0]
+  stopFrames = numpy.nonzero(changes == -1)[0] - 1
+  return [(float(timestamps[start]), float(timestamps[stop]), int(start), int(stop)) for start, stop in zip(startFrames, stopFrames)]
+
+def computeBreachStatistics(timestamps, distancesMm, marginSizeMm):
+  """Returns breach intervals (tool tip inside the tumor), minimum margins and time spent in each zone:
+  inside (distance < 0), margin (0 <= distance < marginSizeMm, the targeted resection zone) and outside.
+  Frames with unknown distance (NaN, e.g., before the tumor was contoured) are excluded.
+  Each frame is weighted by the time until the next frame.
+  """
+  timestamps = numpy.asarray(timestamps, dtype=numpy.float64)
+  distancesMm = numpy.asarray(distancesMm, dtype=numpy.float64)
+  valid = ~numpy.isnan(distancesMm)
+  frameDurationsSec = numpy.append(numpy.diff(timestamps), 0.0) if len(timestamps) else numpy.zeros(0)
+  # NaN compares as False, so invalid frames are in none of the zones
+  with numpy.errstate(invalid='ignore'):
+    inside = distancesMm < 0
+    inMargin = (distancesMm >= 0) & (distancesMm < marginSizeMm)
+    outside = distancesMm >= marginSizeMm
+  breachIntervals = findIntervals(inside, timestamps)
+
+  statistics = {
+    'numberOfFrames': int(len(timestamps)),
+    'numberOfAnalyzedFrames': int(valid.sum()),
+    'marginSizeMm': float(marginSizeMm),
+    'durationSec': float(timestamps[-1] - timestamps[0]) if len(timestamps) else 0.0,
+    'timeInsideSec': float(frameDurationsSec[inside].sum()),
+    'timeInMarginSec': float(frameDurationsSec[inMargin].sum()),
+    'timeOutsideSec': float(frameDurationsSec[outside].sum()),
+    'numberOfBreaches': len(breachIntervals),
+    'breachIntervals': [{'startTime': startTime, 'stopTime': stopTime, 'startFrame': startFrame, 'stopFrame': stopFrame,
+      'maximumDepthMm': float(-distancesMm[startFrame:stopFrame + 1].min())}
+      for startTime, stopTime, startFrame, stopFrame in breachIntervals],
+    'minimumDistanceMm': None,
+    'minimumDistanceTime': None,
+    'minimumMarginMm': None,
+    'minimumMarginTime': None,
+    }
+  if valid.any():
+    minimumIndex = int(numpy.nanargmin(distancesMm))
+    statistics['minimumDistanceMm'] = float(distancesMm[minimumIndex])
+    statistics['minimumDistanceTime'] = float(timestamps[minimumIndex])
+  if (~inside & valid).any():
+    # Closest approach without breaching the tumor
+    outsideDistances = numpy.where(inside | ~valid, numpy.inf, distancesMm)
+    minimumIndex = int(numpy.argmin(outsideDistances))
+    statistics['minimumMarginMm'] = float(distancesMm[minimumIndex])
+    statistics['minimumMarginTime'] = float(timestamps[minimumIndex])
+  return statistics
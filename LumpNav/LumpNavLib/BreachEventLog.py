@@ -0,0 +1,126 @@
+import os
+import numpy
+
+#
+# Breach event log file
+#
+# A log file is a fixed-size header followed by fixed-size BREACH_EVENT_DTYPE records. The file is preallocated
+# and memory-mapped, the number of valid records is stored in the header and is updated after each record is
+# written, so a log of an interrupted session is readable up to the last complete record.
+#
+
+BREACH_EVENT_LOG_MAGIC = b'LNBE'
+BREACH_EVENT_LOG_FORMAT_VERSION = 1
+BREACH_EVENT_LOG_HEADER_DTYPE = numpy.dtype([('magic', 'S4'), ('formatVersion', '<u4'), ('numberOfRecords', '<u8')])
+BREACH_EVENT_DTYPE = numpy.dtype([
+  ('timestamp', '<f8'),
+  ('distanceMm', '<f4'),
+  ('tipPositionInNeedle', '<f4', (3,)),
+  ('zone', 'u1'),
+  ('commandStatus', 'u1'),
+  ('reserved', 'u1', (6,)), # records are 32 bytes
+  ])
+
+# Zones of the tool tip (same as the light colors of BreachWarningLightLogic)
+ZONE_INSIDE = 0
+ZONE_MARGIN = 1
+ZONE_OUTSIDE = 2
+
+# Status of the light set command of the event
+COMMAND_UNCHANGED = 0 # light already shows this pattern, no command was sent
+COMMAND_SENT = 1
+COMMAND_QUEUED = 2 # previous command was still in progress, sent when it completes
+COMMAND_NOT_CONNECTED = 3
+COMMAND_LIGHT_DISABLED = 4 # light feedback is not active, the event is only logged
+
+#
+# BreachEventLogWriter
+#
+
+class BreachEventLogWriter(object):
+  """Appends breach events to a memory-mapped log file. Records are written in place into the preallocated
+  file through field views that are created when the file is mapped, so appending an event does not allocate
+  arrays. There is a single writer (the main thread), the header record count is written last, so readers
+  never need a lock. When the file is full it is extended (to twice its capacity) and mapped again.
+  """
+
+  def __init__(self, filePath, initialCapacity=65536):
+    self.filePath = filePath
+    self.numberOfRecords = 0
+    self.capacity = 0
+    self.header = None
+    self.records = None
+    directoryPath = os.path.dirname(filePath)
+    if directoryPath and not os.path.isdir(directoryPath):
+      os.makedirs(directoryPath)
+    self.mapFile(initialCapacity)
+    self.header['magic'] = BREACH_EVENT_LOG_MAGIC
+    self.header['formatVersion'] = BREACH_EVENT_LOG_FORMAT_VERSION
+    self.header['numberOfRecords'] = 0
+
+  def mapFile(self, capacity):
+    self.unmapFile()
+    fileSize = BREACH_EVENT_LOG_HEADER_DTYPE.itemsize + capacity * BREACH_EVENT_DTYPE.itemsize
+    with open(self.filePath, 'r+b' if os.path.exists(self.filePath) else 'w+b') as logFile:
+      logFile.truncate(fileSize)
+    self.header = numpy.memmap(self.filePath, dtype=BREACH_EVENT_LOG_HEADER_DTYPE, mode='r+', shape=(1,))
+    self.records = numpy.memmap(self.filePath, dtype=BREACH_EVENT_DTYPE, mode='r+', offset=BREACH_EVENT_LOG_HEADER_DTYPE.itemsize, shape=(capacity,))
+    self.capacity = capacity
+    # Field views are created once, appending only writes into them
+    self.numberOfRecordsField = self.header['numberOfRecords']
+    self.timestamps = self.records['timestamp']
+    self.distancesMm = self.records['distanceMm']
+    self.tipPositionsInNeedle = self.records['tipPositionInNeedle']
+    self.zones = self.records['zone']
+    self.commandStatuses = self.records['commandStatus']
+
+  def unmapFile(self):
+    if self.records is None:
+      return
+    self.records.flush()
+    self.header.flush()
+    self.header = self.records = None
+    self.numberOfRecordsField = self.timestamps = self.distancesMm = self.tipPositionsInNeedle = self.zones = self.commandStatuses = None
+
+  def close(self):
+    """Flushes the log and truncates the file to the written records.
+    """
+    if self.records is None:
+      return
+    self.unmapFile()
+    with open(self.filePath, 'r+b') as logFile:
+      logFile.truncate(BREACH_EVENT_LOG_HEADER_DTYPE.itemsize + self.numberOfRecords * BREACH_EVENT_DTYPE.itemsize)
+
+  def append(self, timestamp, distanceMm, zone, tipPositionInNeedle, commandStatus):
+    # no logging - called at the tracker update rate
+    if self.numberOfRecords == self.capacity:
+      self.mapFile(2 * self.capacity)
+    recordIndex = self.numberOfRecords
+    self.timestamps[recordIndex] = timestamp
+    self.distancesMm[recordIndex] = distanceMm
+    self.tipPositionsInNeedle[recordIndex] = tipPositionInNeedle
+    self.zones[recordIndex] = zone
+    self.commandStatuses[recordIndex] = commandStatus
+    # Record is complete, make it visible to readers
+    self.numberOfRecords += 1
+    self.numberOfRecordsField[0] = self.numberOfRecords
+
+#
+# Reading
+#
+
+def readBreachEventLog(filePath, memoryMapped=False):
+  """Returns the records of a breach event log as a NumPy structured array of BREACH_EVENT_DTYPE.
+  The log may be still being written, only the complete records are returned.
+  """
+  header = numpy.fromfile(filePath, dtype=BREACH_EVENT_LOG_HEADER_DTYPE, count=1)
+  if len(header) != 1 or header['magic'][0] != BREACH_EVENT_LOG_MAGIC:
+    raise ValueError('Not a breach event log file: ' + filePath)
+  numberOfRecords = int(header['numberOfRecords'][0])
+  if memoryMapped:
+    if numberOfRecords == 0:
+      return numpy.zeros(0, dtype=BREACH_EVENT_DTYPE)
+    return numpy.memmap(filePath, dtype=BREACH_EVENT_DTYPE, mode='r', offset=BREACH_EVENT_LOG_HEADER_DTYPE.itemsize, shape=(numberOfRecords,))
+  with open(filePath, 'rb') as logFile:
+    logFile.seek(BREACH_EVENT_LOG_HEADER_DTYPE.itemsize)
+    return numpy.fromfile(logFile, dtype=BREACH_EVENT_DTYPE, count=numberOfRecords)
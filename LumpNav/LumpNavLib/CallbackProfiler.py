@@ -0,0 +1,115 @@
+import array
+import functools
+import json
+import timeit
+
+timer = timeit.default_timer
+
+#
+# CallbackRecord
+#
+
+class CallbackRecord(object):
+  """Call statistics of one callback. Start times and durations of the most recent calls are kept in
+  preallocated ring buffers, so recording a call does not allocate memory.
+  """
+
+  def __init__(self, name, capacity):
+    self.name = name
+    self.capacity = capacity
+    self.startTimesSec = array.array('d', [0.0]) * capacity
+    self.durationsSec = array.array('d', [0.0]) * capacity
+    self.reset()
+
+  def reset(self):
+    self.numberOfCalls = 0
+    self.cumulativeDurationSec = 0.0
+    self.maximumDurationSec = 0.0
+
+  def add(self, startTimeSec, durationSec):
+    position = self.numberOfCalls % self.capacity
+    self.startTimesSec[position] = startTimeSec
+    self.durationsSec[position] = durationSec
+    self.numberOfCalls += 1
+    self.cumulativeDurationSec += durationSec
+    if durationSec > self.maximumDurationSec:
+      self.maximumDurationSec = durationSec
+
+  def getRecentCalls(self):
+    """Returns (start time, duration) of the calls that are still in the ring buffer, oldest first.
+    """
+    numberOfRecentCalls = min(self.numberOfCalls, self.capacity)
+    firstPosition = (self.numberOfCalls - numberOfRecentCalls) % self.capacity
+    positions = [(firstPosition + i) % self.capacity for i in range(numberOfRecentCalls)]
+    return [(self.startTimesSec[position], self.durationsSec[position]) for position in positions]
+
+#
+# CallbackProfiler
+#
+
+class CallbackProfiler(object):
+  """Registry of profiled callbacks. Decorated callbacks are only measured while the profiler is enabled,
+  otherwise the only overhead is checking the enabled flag.
+  """
+
+  def __init__(self, capacity=4096):
+    self.capacity = capacity
+    self.enabled = False
+    self.records = {}
+
+  def setEnabled(self, enabled):
+    self.enabled = enabled
+
+  def getRecord(self, name):
+    if name not in self.records:
+      self.records[name] = CallbackRecord(name, self.capacity)
+    return self.records[name]
+
+  def reset(self):
+    for record in self.records.values():
+      record.reset()
+
+  def profiled(self, name):
+    """Decorator that records the calls of a function under the given name.
+    """
+    def decorator(function):
+      record = self.getRecord(name)
+      profiler = self
+      @functools.wraps(function)
+      def wrapper(*args, **kwargs):
+        if not profiler.enabled:
+          return function(*args, **kwargs)
+        startTimeSec = timer()
+        try:
+          return function(*args, **kwargs)
+        finally:
+          record.add(startTimeSec, timer() - startTimeSec)
+      return wrapper
+    return decorator
+
+  def getTableText(self):
+    lines = ['{0:<48}{1:>10}{2:>14}{3:>12}{4:>12}'.format('Callback', 'Calls', 'Total [ms]', 'Mean [ms]', 'Max [ms]')]
+    for name in sorted(self.records.keys()):
+      record = self.records[name]
+      meanMs = 1000.0 * record.cumulativeDurationSec / record.numberOfCalls if record.numberOfCalls else 0.0
+      lines.append('{0:<48}{1:>10d}{2:>14.3f}{3:>12.3f}{4:>12.3f}'.format(
+        name, record.numberOfCalls, 1000.0 * record.cumulativeDurationSec, meanMs, 1000.0 * record.maximumDurationSec))
+    return '\n'.join(lines)
+
+  def getChromeTrace(self):
+    """Returns the recent calls in Chrome trace event format (can be opened in chrome://tracing).
+    """
+    traceEvents = []
+    for name, record in self.records.items():
+      for startTimeSec, durationSec in record.getRecentCalls():
+        traceEvents.append({'name': name, 'ph': 'X', 'pid': 0, 'tid': 0, 'ts': startTimeSec * 1e6, 'dur': durationSec * 1e6})
+    traceEvents.sort(key=lambda event: event['ts'])
+    return {'traceEvents': traceEvents, 'displayTimeUnit': 'ms'}
+
+  def saveChromeTrace(self, filePath):
+    with open(filePath, 'w') as traceFile:
+      json.dump(self.getChromeTrace(), traceFile)
+
+# Profiler shared by all LumpNav modules
+callbackProfiler = CallbackProfiler()
+profiled = callbackProfiler.profiled
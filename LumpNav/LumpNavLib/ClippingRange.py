@@ -0,0 +1,105 @@
+from __main__ import vtk
+import numpy
+
+from LumpNavLib.MatrixUtil import arrayFromVtkMatrix
+
+def computeClippingRange(cornersInRAS, cameraPositionInRAS, directionOfProjectionInRAS, nearPlaneTolerance=0.001, marginRatio=0.05):
+  """Returns the (near, far) distances along the direction of projection that enclose the corners (NumPy array of
+  shape (N, 3)), or None if all corners are behind the camera. Same tolerance rules as vtkRenderer::ResetCameraClippingRange.
+  """
+  depths = (cornersInRAS - cameraPositionInRAS).dot(directionOfProjectionInRAS)
+  far = depths.max()
+  if far <= 0:
+    return None
+  near = depths.min()
+  # Expand the range a bit, so that surfaces that touch the bounds are not clipped
+  margin = marginRatio * (far - near)
+  far += margin
+  near = max(near - margin, nearPlaneTolerance * far)
+  return near, far
+
+#
+# ClippingRangeEngine
+#
+
+class ClippingRangeEngine(object):
+  """Computes camera clipping ranges from the bounds of a set of models (e.g., tumor and tools), instead of the
+  bounds of all props of the renderer. Model bounds (8 corners in model coordinates) are cached with the modified
+  time of the model mesh and refreshed when it changes, so each camera update only transforms the corners and takes
+  their depths.
+  """
+
+  def __init__(self, modelNodes=None, transformChainCache=None):
+    self.transformChainCache = transformChainCache
+    self.modelNodes = []
+    # (mesh modified time, corners) of each model
+    self.cornersByModelNodeID = {}
+    self.vtkMatrix = vtk.vtkMatrix4x4()
+    self.setModelNodes(modelNodes or [])
+
+  def cleanup(self):
+    self.setModelNodes([])
+
+  def setModelNodes(self, modelNodes):
+    self.cornersByModelNodeID = {}
+    self.modelNodes = [modelNode for modelNode in modelNodes if modelNode]
+
+  def setTransformChainCache(self, transformChainCache):
+    self.transformChainCache = transformChainCache
+
+  def getModelCorners(self, modelNode):
+    """Returns the corners of the model bounding box in model coordinates as a NumPy array of shape (8, 4),
+    or None if the model is empty.
+    """
+    # The mesh may change without a mesh modified event (e.g., the tumor surface pipeline is updated in place),
+    # so the cached bounds are compared with the modified time of the mesh
+    polyData = modelNode.GetPolyData()
+    if not polyData:
+      return None
+    meshMTime = polyData.GetMTime()
+    nodeID = modelNode.GetID()
+    cachedMeshMTime, corners = self.cornersByModelNodeID.get(nodeID, (None, None))
+    if cachedMeshMTime != meshMTime:
+      corners = None
+      if polyData.GetNumberOfPoints() > 0:
+        bounds = polyData.GetBounds()
+        corners = numpy.array([[x, y, z, 1.0] for x in bounds[0:2] for y in bounds[2:4] for z in bounds[4:6]])
+      self.cornersByModelNodeID[nodeID] = (meshMTime, corners)
+    return corners
+
+  def getModelToWorldMatrix(self, modelNode):
+    parentTransformNode = modelNode.GetParentTransformNode()
+    if not parentTransformNode:
+      return None
+    if self.transformChainCache:
+      return self.transformChainCache.getMatrixToWorld(parentTransformNode)
+    parentTransformNode.GetMatrixTransformToWorld(self.vtkMatrix)
+    return arrayFromVtkMatrix(self.vtkMatrix)
+
+  def getVisibleCornersInRAS(self):
+    cornersInRAS = []
+    for modelNode in self.modelNodes:
+      displayNode = modelNode.GetDisplayNode()
+      if not displayNode or not displayNode.GetVisibility():
+        continue
+      corners = self.getModelCorners(modelNode)
+      if corners is None:
+        continue
+      modelToWorldMatrix = self.getModelToWorldMatrix(modelNode)
+      cornersInRAS.append(corners[:, 0:3] if modelToWorldMatrix is None else corners.dot(modelToWorldMatrix[0:3].T))
+    if not cornersInRAS:
+      return None
+    return numpy.concatenate(cornersInRAS)
+
+  def updateCameraClippingRange(self, camera):
+    """Sets the clipping range of the camera (vtkCamera) to enclose the visible models.
+    Returns False if the range could not be computed (no visible models in front of the camera).
+    """
+    cornersInRAS = self.getVisibleCornersInRAS()
+    if cornersInRAS is None:
+      return False
+    clippingRange = computeClippingRange(cornersInRAS, numpy.array(camera.GetPosition()), numpy.array(camera.GetDirectionOfProjection()))
+    if clippingRange is None:
+      return False
+    camera.SetClippingRange(clippingRange[0], clippingRange[1])
+    return True
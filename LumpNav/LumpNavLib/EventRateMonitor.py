@@ -0,0 +1,144 @@
+import array
+import timeit
+
+timer = timeit.default_timer
+
+#
+# EventRateCounter
+#
+
+class EventRateCounter(object):
+  """Counts occurrences of one kind of event. Timestamps of the most recent events are kept in a
+  preallocated ring buffer, so counting an event is cheap enough to be done in every callback.
+  """
+
+  def __init__(self, name, capacity):
+    self.name = name
+    self.capacity = capacity
+    self.timestampsSec = array.array('d', [0.0]) * capacity
+    self.reset()
+
+  def reset(self):
+    self.numberOfEvents = 0
+
+  def tick(self, timestampSec=None):
+    if timestampSec is None:
+      timestampSec = timer()
+    self.timestampsSec[self.numberOfEvents % self.capacity] = timestampSec
+    self.numberOfEvents += 1
+
+  def getRateHz(self, windowSec, nowSec=None):
+    """Returns the number of events per second in the last windowSec seconds.
+    If the ring buffer covers less than windowSec then the rate is computed from the buffered events.
+    """
+    if nowSec is None:
+      nowSec = timer()
+    numberOfBufferedEvents = min(self.numberOfEvents, self.capacity)
+    windowStartSec = nowSec - windowSec
+    numberOfEventsInWindow = 0
+    position = self.numberOfEvents
+    # Walk backwards from the newest event until the window start is reached
+    while numberOfEventsInWindow < numberOfBufferedEvents:
+      position -= 1
+      if self.timestampsSec[position % self.capacity] < windowStartSec:
+        break
+      numberOfEventsInWindow += 1
+    if numberOfEventsInWindow == numberOfBufferedEvents and numberOfBufferedEvents == self.capacity:
+      # Buffer is full and all events are in the window, only the buffered time span can be measured
+      oldestTimestampSec = self.timestampsSec[self.numberOfEvents % self.capacity]
+      if nowSec > oldestTimestampSec:
+        return numberOfEventsInWindow / (nowSec - oldestTimestampSec)
+    return numberOfEventsInWindow / float(windowSec)
+
+#
+# StallRecorder
+#
+
+class StallRecorder(object):
+  """Measures main thread stalls from the ticks of a periodic timer. Any delay of a tick beyond the timer
+  interval is time when the event loop could not process events.
+  """
+
+  def __init__(self, intervalSec, thresholdSec=0.01):
+    self.intervalSec = intervalSec
+    self.thresholdSec = thresholdSec
+    self.reset()
+
+  def reset(self):
+    self.lastTickSec = None
+    self.cumulativeStallSec = 0.0
+    self.maximumStallSec = 0.0
+    self.numberOfStalls = 0
+
+  def tick(self, timestampSec=None):
+    if timestampSec is None:
+      timestampSec = timer()
+    if self.lastTickSec is not None:
+      stallSec = timestampSec - self.lastTickSec - self.intervalSec
+      if stallSec > self.thresholdSec:
+        self.cumulativeStallSec += stallSec
+        self.numberOfStalls += 1
+        if stallSec > self.maximumStallSec:
+          self.maximumStallSec = stallSec
+    self.lastTickSec = timestampSec
+
+#
+# EventRateMonitor
+#
+
+class EventRateMonitor(object):
+  """Registry of event counters and the main thread stall recorder.
+  Rates and stall times can be read any time with getSnapshot(), e.g., for displaying or logging.
+  """
+
+  def __init__(self, capacity=1024, stallTimerIntervalSec=0.05):
+    self.capacity = capacity
+    self.counters = {}
+    self.stallRecorder = StallRecorder(stallTimerIntervalSec)
+    self.startTimeSec = timer()
+
+  def getCounter(self, name):
+    if name not in self.counters:
+      self.counters[name] = EventRateCounter(name, self.capacity)
+    return self.counters[name]
+
+  def tick(self, name):
+    self.getCounter(name).tick()
+
+  def reset(self):
+    for counter in self.counters.values():
+      counter.reset()
+    self.stallRecorder.reset()
+    self.startTimeSec = timer()
+
+  def getRatesHz(self, windowSec=1.0):
+    nowSec = timer()
+    return dict((name, counter.getRateHz(windowSec, nowSec)) for name, counter in self.counters.items())
+
+  def getSnapshot(self, windowSec=1.0):
+    """Returns a dictionary of current rates, event counts and stall statistics.
+    """
+    elapsedSec = timer() - self.startTimeSec
+    return {
+      'ratesHz': self.getRatesHz(windowSec),
+      'numberOfEvents': dict((name, counter.numberOfEvents) for name, counter in self.counters.items()),
+      'stallTimeSec': self.stallRecorder.cumulativeStallSec,
+      'stallTimePercent': 100.0 * self.stallRecorder.cumulativeStallSec / elapsedSec if elapsedSec > 0 else 0.0,
+      'maximumStallSec': self.stallRecorder.maximumStallSec,
+      'numberOfStalls': self.stallRecorder.numberOfStalls,
+      }
+
+  def getSummaryText(self, windowSec=1.0):
+    snapshot = self.getSnapshot(windowSec)
+    rates = ', '.join('{0}: {1:.1f} Hz'.format(name, snapshot['ratesHz'][name]) for name in sorted(snapshot['ratesHz'].keys()))
+    return '{0}; stall: {1:.1f}% (max {2:.0f} ms)'.format(rates, snapshot['stallTimePercent'], 1000.0 * snapshot['maximumStallSec'])
+
+# Event names counted by LumpNav modules
+TRACKER_TRANSFORM_EVENT = 'TrackerTransform'
+VIEWPOINT_CAMERA_EVENT = 'ViewpointCamera'
+TUMOR_REBUILD_EVENT = 'TumorRebuild'
+BREACH_LIGHT_COMMAND_EVENT = 'BreachLightCommand'
+RENDER_EVENT = 'Render'
+
+# Monitor shared by all LumpNav modules
+eventRateMonitor = EventRateMonitor()
@@ -0,0 +1,82 @@
+from __main__ import vtk
+import numpy
+
+from LumpNavLib.MatrixUtil import arrayFromVtkMatrix
+
+#
+# FocalDistanceService
+#
+
+class FocalDistanceService(object):
+  """Casts rays from the camera against a target model (e.g., the tumor) to find the camera-target distance.
+  The spatial index (OBB tree) of the model is rebuilt when the model mesh changes (the modified time of the mesh
+  is compared at each ray cast, as the mesh may change without a mesh modified event), a ray cast only visits
+  the few tree nodes along the ray instead of all the triangles of the mesh.
+  """
+
+  def __init__(self, modelNode, transformChainCache=None, maximumDistanceMm=1000.0):
+    self.modelNode = modelNode
+    self.transformChainCache = transformChainCache
+    self.maximumDistanceMm = maximumDistanceMm
+    self.locator = None
+    # Modified time of the mesh that the locator was built from
+    self.locatorMeshMTime = None
+    self.intersectionPoints = vtk.vtkPoints()
+    self.vtkMatrix = vtk.vtkMatrix4x4()
+    self.numberOfHits = 0
+    self.numberOfMisses = 0
+
+  def cleanup(self):
+    self.locator = None
+    self.locatorMeshMTime = None
+
+  def setTransformChainCache(self, transformChainCache):
+    self.transformChainCache = transformChainCache
+
+  def getLocator(self):
+    """Returns the spatial index of the model, or None if the model is empty.
+    """
+    polyData = self.modelNode.GetPolyData()
+    meshMTime = polyData.GetMTime() if polyData else None
+    if meshMTime is None or meshMTime != self.locatorMeshMTime:
+      self.locatorMeshMTime = meshMTime
+      self.locator = None
+      if polyData and polyData.GetNumberOfCells() > 0:
+        # The mesh is copied, so that the index stays consistent with its mesh while the model pipeline is updated
+        indexedPolyData = vtk.vtkPolyData()
+        indexedPolyData.DeepCopy(polyData)
+        self.locator = vtk.vtkOBBTree()
+        self.locator.SetDataSet(indexedPolyData)
+        self.locator.BuildLocator()
+    return self.locator
+
+  def getModelToWorldMatrix(self):
+    parentTransformNode = self.modelNode.GetParentTransformNode()
+    if not parentTransformNode:
+      return numpy.eye(4)
+    if self.transformChainCache:
+      return self.transformChainCache.getMatrixToWorld(parentTransformNode)
+    parentTransformNode.GetMatrixTransformToWorld(self.vtkMatrix)
+    return arrayFromVtkMatrix(self.vtkMatrix)
+
+  def castRay(self, originInRAS, directionInRAS):
+    """Returns the distance from the origin to the first intersection of the model surface along the direction
+    (unit vector), or None if the ray does not hit the model within the maximum distance.
+    """
+    locator = self.getLocator()
+    if not locator:
+      self.numberOfMisses += 1
+      return None
+    # Cast the ray in model coordinates, so that the index does not have to be rebuilt when the model moves
+    worldToModelMatrix = numpy.linalg.inv(self.getModelToWorldMatrix())
+    rayStartInModel = worldToModelMatrix[0:3, 0:3].dot(originInRAS) + worldToModelMatrix[0:3, 3]
+    rayEndInModel = worldToModelMatrix[0:3, 0:3].dot(numpy.asarray(originInRAS) + self.maximumDistanceMm * numpy.asarray(directionInRAS)) + worldToModelMatrix[0:3, 3]
+    if not locator.IntersectWithLine(rayStartInModel.tolist(), rayEndInModel.tolist(), self.intersectionPoints, None):
+      self.numberOfMisses += 1
+      return None
+    self.numberOfHits += 1
+    intersectionDistancesInModel = [numpy.linalg.norm(numpy.array(self.intersectionPoints.GetPoint(i)) - rayStartInModel)
+      for i in range(self.intersectionPoints.GetNumberOfPoints())]
+    # Model coordinates may be scaled relative to RAS
+    modelToWorldScale = self.maximumDistanceMm / numpy.linalg.norm(rayEndInModel - rayStartInModel)
+    return min(intersectionDistancesInModel) * modelToWorldScale
@@ -0,0 +1,90 @@
+from __main__ import vtk, qt, slicer
+import logging
+
+from LumpNavLib.SceneNodeIndex import EXCLUDE_FROM_INDEX_ATTRIBUTE_NAME
+
+#
+# IncomingTransformCoalescer
+#
+
+class IncomingTransformCoalescer(object):
+  """Receives tracker transforms of an OpenIGTLink connector into hidden staging nodes instead of the transform
+  nodes of the scene, and copies only the newest pose of each device into the scene once per UI tick.
+  Observers of the scene transforms (viewpoint, breach warning, light) are therefore notified at most once per tick,
+  and rendering is paused while all pending poses are applied.
+  """
+
+  def __init__(self, connectorNode, transformNodes, intervalMs=16):
+    self.connectorNode = connectorNode
+    self.transformNodes = transformNodes
+    self.stagingNodes = []
+    self.stagingObserverTags = []
+    self.pendingIndices = set()
+    self.matrix = vtk.vtkMatrix4x4()
+
+    self.numberOfReceivedMessages = 0
+    self.numberOfAppliedMessages = 0
+    self.numberOfDroppedMessages = 0
+
+    for index, transformNode in enumerate(self.transformNodes):
+      # Staging node has the same name as the scene node, as incoming messages are matched to nodes by device name
+      stagingNode = slicer.vtkMRMLLinearTransformNode()
+      stagingNode.SetName(transformNode.GetName())
+      stagingNode.SetHideFromEditors(True)
+      stagingNode.SetSaveWithScene(False)
+      stagingNode.SetAttribute(EXCLUDE_FROM_INDEX_ATTRIBUTE_NAME, 'true')
+      slicer.mrmlScene.AddNode(stagingNode)
+      self.connectorNode.UnregisterIncomingMRMLNode(transformNode)
+      self.connectorNode.RegisterIncomingMRMLNode(stagingNode)
+      self.stagingNodes.append(stagingNode)
+      self.stagingObserverTags.append(stagingNode.AddObserver(slicer.vtkMRMLTransformNode.TransformModifiedEvent,
+        lambda caller, eventId, index=index: self.onStagingNodeModified(index)))
+
+    self.timer = qt.QTimer()
+    self.timer.setInterval(intervalMs)
+    self.timer.connect('timeout()', self.applyPendingTransforms)
+    self.timer.start()
+    logging.info('Incoming transforms are coalesced: ' + ', '.join(transformNode.GetName() for transformNode in self.transformNodes))
+
+  def cleanup(self):
+    """Applies the pending poses and restores direct update of the scene transform nodes.
+    """
+    self.timer.stop()
+    self.timer.disconnect('timeout()', self.applyPendingTransforms)
+    self.applyPendingTransforms()
+    for stagingNode, transformNode, tag in zip(self.stagingNodes, self.transformNodes, self.stagingObserverTags):
+      stagingNode.RemoveObserver(tag)
+      self.connectorNode.UnregisterIncomingMRMLNode(stagingNode)
+      self.connectorNode.RegisterIncomingMRMLNode(transformNode)
+      slicer.mrmlScene.RemoveNode(stagingNode)
+    self.stagingNodes = []
+    self.stagingObserverTags = []
+
+  def onStagingNodeModified(self, index):
+    # no logging - called at the tracker update rate
+    self.numberOfReceivedMessages += 1
+    if index in self.pendingIndices:
+      # The previous pose of this device has not been applied yet, it is replaced by the new one
+      self.numberOfDroppedMessages += 1
+    else:
+      self.pendingIndices.add(index)
+
+  def applyPendingTransforms(self):
+    if not self.pendingIndices:
+      return
+    slicer.app.pauseRender()
+    try:
+      for index in self.pendingIndices:
+        self.stagingNodes[index].GetMatrixTransformToParent(self.matrix)
+        self.transformNodes[index].SetMatrixTransformToParent(self.matrix)
+        self.numberOfAppliedMessages += 1
+    finally:
+      self.pendingIndices.clear()
+      slicer.app.resumeRender()
+
+  def getCounters(self):
+    return {
+      'received': self.numberOfReceivedMessages,
+      'applied': self.numberOfAppliedMessages,
+      'dropped': self.numberOfDroppedMessages,
+      }
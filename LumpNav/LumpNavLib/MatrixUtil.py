@@ -0,0 +1,16 @@
+import numpy
+
+def arrayFromVtkMatrix(vtkMatrix, array=None):
+  """Copies a vtkMatrix4x4 into a 4x4 NumPy array. If array is specified then it is filled instead of allocating a new one.
+  """
+  if array is None:
+    array = numpy.empty((4,4))
+  for row in range(4):
+    for column in range(4):
+      array[row, column] = vtkMatrix.GetElement(row, column)
+  return array
+
+def updateVtkMatrixFromArray(vtkMatrix, array):
+  """Sets the elements of a vtkMatrix4x4 from a 4x4 NumPy array.
+  """
+  vtkMatrix.DeepCopy(numpy.asarray(array, dtype=numpy.float64).ravel().tolist())
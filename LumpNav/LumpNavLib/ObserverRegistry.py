@@ -0,0 +1,75 @@
+import logging
+import weakref
+
+# Registries that currently exist, for reporting the live observers of all owners
+liveRegistries = weakref.WeakSet()
+
+#
+# ObserverRegistry
+#
+
+class ObserverRegistry(object):
+  """Observers that one owner (e.g., a module logic) added to VTK objects. Observers are added through the registry
+  and are removed by group or all at once. Removing is idempotent: removed observers are forgotten, so start/stop
+  cycles neither remove stale tags again nor leave observers behind. A warning is logged when the owner has more
+  than maximumNumberOfObservers live observers, which usually means that observers are added repeatedly without
+  removing the previous ones.
+  """
+
+  def __init__(self, ownerName, maximumNumberOfObservers=100):
+    self.ownerName = ownerName
+    self.maximumNumberOfObservers = maximumNumberOfObservers
+    # [observed object, tag, group] of the live observers
+    self.observers = []
+    self.numberOfAddedObservers = 0
+    self.numberOfRemovedObservers = 0
+    self.leakReported = False
+    liveRegistries.add(self)
+
+  def addObserver(self, observedObject, event, callback, priority=None, group=None):
+    """Adds an observer and returns its tag. The group can be used to remove only some of the observers of the owner.
+    """
+    if priority is None:
+      tag = observedObject.AddObserver(event, callback)
+    else:
+      tag = observedObject.AddObserver(event, callback, priority)
+    self.observers.append([observedObject, tag, group])
+    self.numberOfAddedObservers += 1
+    if len(self.observers) > self.maximumNumberOfObservers and not self.leakReported:
+      logging.warning('{0} has {1} live observers, observers may not be removed'.format(self.ownerName, len(self.observers)))
+      self.leakReported = True
+    return tag
+
+  def removeObservers(self, group=None):
+    """Removes the observers of the group, or all observers if group is not specified.
+    Returns the number of removed observers.
+    """
+    remainingObservers = []
+    numberOfRemovedObservers = 0
+    for observer in self.observers:
+      if group is not None and observer[2] != group:
+        remainingObservers.append(observer)
+        continue
+      observer[0].RemoveObserver(observer[1])
+      numberOfRemovedObservers += 1
+    self.observers = remainingObservers
+    self.numberOfRemovedObservers += numberOfRemovedObservers
+    if len(self.observers) <= self.maximumNumberOfObservers:
+      self.leakReported = False
+    return numberOfRemovedObservers
+
+  def hasObservers(self, group=None):
+    return self.getNumberOfObservers(group) > 0
+
+  def getNumberOfObservers(self, group=None):
+    if group is None:
+      return len(self.observers)
+    return len([observer for observer in self.observers if observer[2] == group])
+
+def getLiveObserverCounts():
+  """Returns the number of live observers of each owner (owners with the same name are summed).
+  """
+  observerCounts = {}
+  for registry in list(liveRegistries):
+    observerCounts[registry.ownerName] = observerCounts.get(registry.ownerName, 0) + registry.getNumberOfObservers()
+  return observerCounts
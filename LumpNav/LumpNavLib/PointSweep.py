@@ -0,0 +1,40 @@
+import numpy
+
+#
+# PointSweep
+#
+
+class PointSweep(object):
+  """Collects points continuously (e.g., tool tip positions while sweeping along a surface) and keeps only
+  points that are at least minimumSpacingMm away from all previously kept points and the existing points.
+  """
+
+  def __init__(self, minimumSpacingMm, existingPoints=None, initialCapacity=256):
+    self.minimumSpacingMm = minimumSpacingMm
+    if existingPoints is None:
+      existingPoints = numpy.zeros((0, 3))
+    self.numberOfExistingPoints = len(existingPoints)
+    self.points = numpy.zeros((max(initialCapacity, 2 * self.numberOfExistingPoints), 3))
+    self.points[:self.numberOfExistingPoints] = existingPoints
+    self.numberOfPoints = self.numberOfExistingPoints
+    self.numberOfRejectedPoints = 0
+
+  def addPoint(self, point):
+    """Adds the point if it is not closer than the minimum spacing to any kept point. Returns True if the point is kept.
+    """
+    if self.numberOfPoints:
+      squaredDistances = numpy.sum((self.points[:self.numberOfPoints] - point) ** 2, axis=1)
+      if squaredDistances.min() < self.minimumSpacingMm * self.minimumSpacingMm:
+        self.numberOfRejectedPoints += 1
+        return False
+    if self.numberOfPoints == len(self.points):
+      # Grow the buffer by doubling, so that adding points is amortized constant time
+      self.points = numpy.concatenate([self.points, numpy.zeros_like(self.points)])
+    self.points[self.numberOfPoints] = point
+    self.numberOfPoints += 1
+    return True
+
+  def getNewPoints(self):
+    """Returns the kept points that were added by addPoint (not the existing points).
+    """
+    return self.points[self.numberOfExistingPoints:self.numberOfPoints]
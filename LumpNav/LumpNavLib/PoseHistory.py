@@ -0,0 +1,193 @@
+import numpy
+
+#
+# Rotation helpers
+#
+
+def quaternionsFromRotationMatrices(rotations):
+  """Converts rotation matrices of shape (N, 3, 3) to unit quaternions (w, x, y, z) of shape (N, 4).
+  """
+  rotations = numpy.asarray(rotations, dtype=numpy.float64)
+  # Symmetric 4x4 matrix whose largest eigenvector is the quaternion (robust for all rotation angles)
+  r = rotations
+  k = numpy.empty((len(r), 4, 4))
+  k[:, 0, 0] = r[:, 0, 0] + r[:, 1, 1] + r[:, 2, 2]
+  k[:, 1, 1] = r[:, 0, 0] - r[:, 1, 1] - r[:, 2, 2]
+  k[:, 2, 2] = r[:, 1, 1] - r[:, 0, 0] - r[:, 2, 2]
+  k[:, 3, 3] = r[:, 2, 2] - r[:, 0, 0] - r[:, 1, 1]
+  k[:, 0, 1] = k[:, 1, 0] = r[:, 2, 1] - r[:, 1, 2]
+  k[:, 0, 2] = k[:, 2, 0] = r[:, 0, 2] - r[:, 2, 0]
+  k[:, 0, 3] = k[:, 3, 0] = r[:, 1, 0] - r[:, 0, 1]
+  k[:, 1, 2] = k[:, 2, 1] = r[:, 1, 0] + r[:, 0, 1]
+  k[:, 1, 3] = k[:, 3, 1] = r[:, 0, 2] + r[:, 2, 0]
+  k[:, 2, 3] = k[:, 3, 2] = r[:, 2, 1] + r[:, 1, 2]
+  eigenvalues, eigenvectors = numpy.linalg.eigh(k)
+  quaternions = eigenvectors[:, :, -1]
+  # Use the hemisphere of positive w, so that nearby rotations have nearby quaternions
+  quaternions[quaternions[:, 0] < 0] *= -1
+  return quaternions
+
+def rotationMatricesFromQuaternions(quaternions):
+  """Converts unit quaternions (w, x, y, z) of shape (N, 4) to rotation matrices of shape (N, 3, 3).
+  """
+  w, x, y, z = numpy.asarray(quaternions, dtype=numpy.float64).T
+  rotations = numpy.empty((len(w), 3, 3))
+  rotations[:, 0, 0] = 1 - 2 * (y * y + z * z)
+  rotations[:, 0, 1] = 2 * (x * y - z * w)
+  rotations[:, 0, 2] = 2 * (x * z + y * w)
+  rotations[:, 1, 0] = 2 * (x * y + z * w)
+  rotations[:, 1, 1] = 1 - 2 * (x * x + z * z)
+  rotations[:, 1, 2] = 2 * (y * z - x * w)
+  rotations[:, 2, 0] = 2 * (x * z - y * w)
+  rotations[:, 2, 1] = 2 * (y * z + x * w)
+  rotations[:, 2, 2] = 1 - 2 * (x * x + y * y)
+  return rotations
+
+def slerp(quaternions0, quaternions1, fractions):
+  """Spherical linear interpolation between unit quaternions of shape (N, 4), fractions of shape (N,).
+  """
+  dot = numpy.sum(quaternions0 * quaternions1, axis=1)
+  # Interpolate along the shorter arc
+  quaternions1 = numpy.where((dot < 0)[:, numpy.newaxis], -quaternions1, quaternions1)
+  dot = numpy.clip(numpy.abs(dot), 0.0, 1.0)
+  angles = numpy.arccos(dot)
+  sinAngles = numpy.sin(angles)
+  nearlyParallel = sinAngles < 1e-6
+  safeSinAngles = numpy.where(nearlyParallel, 1.0, sinAngles)
+  weights0 = numpy.where(nearlyParallel, 1.0 - fractions, numpy.sin((1.0 - fractions) * angles) / safeSinAngles)
+  weights1 = numpy.where(nearlyParallel, fractions, numpy.sin(fractions * angles) / safeSinAngles)
+  quaternions = weights0[:, numpy.newaxis] * quaternions0 + weights1[:, numpy.newaxis] * quaternions1
+  return quaternions / numpy.linalg.norm(quaternions, axis=1)[:, numpy.newaxis]
+
+#
+# PoseHistory
+#
+
+class PoseHistory(object):
+  """Fixed-size ring buffer of timestamped 4x4 poses of one tool. Poses are stored in preallocated NumPy arrays,
+  adding a pose does not allocate memory. Timestamps are expected to be non-decreasing.
+  """
+
+  def __init__(self, capacity=1024):
+    self.capacity = capacity
+    self.timestamps = numpy.zeros(capacity)
+    self.poses = numpy.tile(numpy.eye(4), (capacity, 1, 1))
+    self.numberOfPosesAdded = 0
+
+  def reset(self):
+    self.numberOfPosesAdded = 0
+
+  def addPose(self, timestamp, pose):
+    position = self.numberOfPosesAdded % self.capacity
+    self.timestamps[position] = timestamp
+    self.poses[position] = pose
+    self.numberOfPosesAdded += 1
+
+  def getPoseArrayForWriting(self, timestamp):
+    """Returns the buffer slot of the next pose, so that it can be filled in place (e.g., from a VTK matrix).
+    """
+    position = self.numberOfPosesAdded % self.capacity
+    self.timestamps[position] = timestamp
+    self.numberOfPosesAdded += 1
+    return self.poses[position]
+
+  def getNumberOfPoses(self):
+    return min(self.numberOfPosesAdded, self.capacity)
+
+  def getOrderedIndices(self):
+    numberOfPoses = self.getNumberOfPoses()
+    return (numpy.arange(self.numberOfPosesAdded - numberOfPoses, self.numberOfPosesAdded)) % self.capacity
+
+  def getLatest(self):
+    """Returns the timestamp and pose of the most recent pose, or (None, None) if there are no poses.
+    """
+    if not self.numberOfPosesAdded:
+      return None, None
+    position = (self.numberOfPosesAdded - 1) % self.capacity
+    return self.timestamps[position], self.poses[position]
+
+  def getWindow(self, startTime=None, stopTime=None):
+    """Returns timestamps (N,) and poses (N, 4, 4) in the [startTime, stopTime] time range, oldest first.
+    """
+    indices = self.getOrderedIndices()
+    timestamps = self.timestamps[indices]
+    first = 0 if startTime is None else numpy.searchsorted(timestamps, startTime, side='left')
+    last = len(timestamps) if stopTime is None else numpy.searchsorted(timestamps, stopTime, side='right')
+    return timestamps[first:last], self.poses[indices[first:last]]
+
+  def getLatestWindow(self, durationSec):
+    latestTimestamp = self.getLatest()[0]
+    if latestTimestamp is None:
+      return numpy.zeros(0), numpy.zeros((0, 4, 4))
+    return self.getWindow(latestTimestamp - durationSec)
+
+  def getVelocity(self, durationSec=0.1):
+    """Returns the linear velocity (position change per second) of the pose origin, fitted to the poses
+    of the last durationSec seconds. Returns zero velocity if there are not enough poses.
+    """
+    timestamps, poses = self.getLatestWindow(durationSec)
+    if len(timestamps) < 2 or timestamps[-1] <= timestamps[0]:
+      return numpy.zeros(3)
+    # Least squares fit of a line to each coordinate
+    relativeTimestamps = timestamps - timestamps.mean()
+    positions = poses[:, 0:3, 3]
+    centeredPositions = positions - positions.mean(axis=0)
+    return relativeTimestamps.dot(centeredPositions) / relativeTimestamps.dot(relativeTimestamps)
+
+  def interpolateAtTimes(self, times):
+    """Returns poses (N, 4, 4) at the given times (N,). Positions are interpolated linearly, rotations spherically.
+    Times outside of the buffered range get the first or last pose.
+    """
+    times = numpy.atleast_1d(numpy.asarray(times, dtype=numpy.float64))
+    timestamps, poses = self.getWindow()
+    if not len(timestamps):
+      raise ValueError('Pose history is empty')
+    nextIndices = numpy.clip(numpy.searchsorted(timestamps, times, side='right'), 1, len(timestamps) - 1) if len(timestamps) > 1 else numpy.zeros(len(times), dtype=int)
+    previousIndices = numpy.maximum(nextIndices - 1, 0)
+    timeSpans = timestamps[nextIndices] - timestamps[previousIndices]
+    fractions = numpy.where(timeSpans > 0, (times - timestamps[previousIndices]) / numpy.where(timeSpans > 0, timeSpans, 1.0), 0.0)
+    fractions = numpy.clip(fractions, 0.0, 1.0)
+
+    previousPoses = poses[previousIndices]
+    nextPoses = poses[nextIndices]
+    interpolatedPoses = numpy.tile(numpy.eye(4), (len(times), 1, 1))
+    interpolatedPoses[:, 0:3, 3] = previousPoses[:, 0:3, 3] + fractions[:, numpy.newaxis] * (nextPoses[:, 0:3, 3] - previousPoses[:, 0:3, 3])
+    quaternions = slerp(quaternionsFromRotationMatrices(previousPoses[:, 0:3, 0:3]), quaternionsFromRotationMatrices(nextPoses[:, 0:3, 0:3]), fractions)
+    interpolatedPoses[:, 0:3, 0:3] = rotationMatricesFromQuaternions(quaternions)
+    return interpolatedPoses
+
+  def interpolateAtTime(self, time):
+    return self.interpolateAtTimes([time])[0]
+
+#
+# PoseHistoryService
+#
+
+class PoseHistoryService(object):
+  """Pose histories of all tracked tools, filled once per tracker update and shared by all consumers.
+  """
+
+  def __init__(self, capacity=1024):
+    self.capacity = capacity
+    self.toolHistories = {}
+
+  def getToolHistory(self, toolName):
+    if toolName not in self.toolHistories:
+      self.toolHistories[toolName] = PoseHistory(self.capacity)
+    return self.toolHistories[toolName]
+
+  def getToolNames(self):
+    return sorted(self.toolHistories.keys())
+
+  def addPose(self, toolName, timestamp, pose):
+    self.getToolHistory(toolName).addPose(timestamp, pose)
+
+  def getLatestPose(self, toolName):
+    return self.getToolHistory(toolName).getLatest()[1]
+
+  def reset(self):
+    for toolHistory in self.toolHistories.values():
+      toolHistory.reset()
+
+# Pose history shared by all LumpNav modules
+poseHistoryService = PoseHistoryService()
@@ -0,0 +1,110 @@
+import math
+import numpy
+
+#
+# ResectionCoverageMap
+#
+
+class ResectionCoverageMap(object):
+  """Sparse voxel occupancy grid of the cautery tip path (in the needle coordinate system).
+  Voxels are stored in fixed-size blocks in a dictionary (hash of blocks), only the blocks that the path passed
+  through are allocated, and at most maximumNumberOfBlocks blocks are kept (points in new blocks are dropped
+  when the limit is reached). Adding a tip position marks the voxels along the segment from the previous
+  position, visiting at most maximumSegmentSteps voxels, so each tracker update takes constant time. Longer segments
+  are jumps (e.g., after a tracking dropout) that the tip did not travel along, only their end position is marked.
+  """
+
+  def __init__(self, voxelSizeMm=1.0, blockSize=8, maximumNumberOfBlocks=4096, maximumSegmentSteps=16):
+    self.voxelSizeMm = voxelSizeMm
+    self.blockSize = blockSize
+    self.maximumNumberOfBlocks = maximumNumberOfBlocks
+    self.maximumSegmentSteps = maximumSegmentSteps
+    self.reset()
+
+  def reset(self):
+    self.blocks = {}
+    self.previousPosition = None
+    self.numberOfOccupiedVoxels = 0
+    self.numberOfDroppedPoints = 0
+    # Incremented whenever a voxel becomes occupied, consumers can skip updates if it has not changed
+    self.version = 0
+
+  def resetPath(self):
+    """Starts a new path segment, e.g., after tracking was interrupted, so that the gap is not filled.
+    """
+    self.previousPosition = None
+
+  def addVoxel(self, x, y, z):
+    # no logging - called at the tracker update rate
+    voxelIndex = (int(math.floor(x / self.voxelSizeMm)), int(math.floor(y / self.voxelSizeMm)), int(math.floor(z / self.voxelSizeMm)))
+    blockKey = (voxelIndex[0] // self.blockSize, voxelIndex[1] // self.blockSize, voxelIndex[2] // self.blockSize)
+    block = self.blocks.get(blockKey)
+    if block is None:
+      if len(self.blocks) >= self.maximumNumberOfBlocks:
+        self.numberOfDroppedPoints += 1
+        return
+      block = numpy.zeros((self.blockSize, self.blockSize, self.blockSize), dtype=bool)
+      self.blocks[blockKey] = block
+    localIndex = (voxelIndex[0] % self.blockSize, voxelIndex[1] % self.blockSize, voxelIndex[2] % self.blockSize)
+    if not block[localIndex]:
+      block[localIndex] = True
+      self.numberOfOccupiedVoxels += 1
+      self.version += 1
+
+  def addTipPosition(self, position):
+    """Marks the voxels along the path from the previous tip position to this position (3-element sequence).
+    """
+    x, y, z = float(position[0]), float(position[1]), float(position[2])
+    if self.previousPosition is None:
+      self.addVoxel(x, y, z)
+    else:
+      px, py, pz = self.previousPosition
+      segmentLengthMm = math.sqrt((x - px) ** 2 + (y - py) ** 2 + (z - pz) ** 2)
+      numberOfSteps = max(int(math.ceil(segmentLengthMm / self.voxelSizeMm)), 1)
+      if numberOfSteps > self.maximumSegmentSteps:
+        self.resetPath()
+        self.addVoxel(x, y, z)
+      else:
+        for step in range(1, numberOfSteps + 1):
+          fraction = float(step) / numberOfSteps
+          self.addVoxel(px + fraction * (x - px), py + fraction * (y - py), pz + fraction * (z - pz))
+    self.previousPosition = (x, y, z)
+
+  def getOccupiedVoxelCenters(self, lowerBoundsMm=None, upperBoundsMm=None):
+    """Returns the centers of the occupied voxels (array of shape (N, 3)), optionally only in the blocks that
+    overlap with the box between lowerBoundsMm and upperBoundsMm.
+    """
+    blockSizeMm = self.blockSize * self.voxelSizeMm
+    voxelIndices = []
+    for blockKey, block in self.blocks.items():
+      if lowerBoundsMm is not None:
+        blockLowerMm = numpy.array(blockKey) * blockSizeMm
+        if (blockLowerMm + blockSizeMm < lowerBoundsMm).any() or (blockLowerMm > upperBoundsMm).any():
+          continue
+      localIndices = numpy.argwhere(block)
+      if len(localIndices):
+        voxelIndices.append(localIndices + numpy.array(blockKey) * self.blockSize)
+    if not voxelIndices:
+      return numpy.zeros((0, 3))
+    return (numpy.concatenate(voxelIndices) + 0.5) * self.voxelSizeMm
+
+  def computeNearestApproachDistances(self, points, maximumDistanceMm, maximumPairsPerChunk=1000000):
+    """Returns for each point (e.g., tumor surface vertices, array of shape (N, 3)) the distance to the closest
+    occupied voxel center, or maximumDistanceMm if the path did not come closer than that. Only voxels within
+    maximumDistanceMm of the points are considered, they are compared to all points at once in chunks.
+    The distances are accurate up to half of the voxel diagonal.
+    """
+    points = numpy.asarray(points, dtype=numpy.float64)
+    distancesMm = numpy.full(len(points), float(maximumDistanceMm))
+    if not len(points) or not self.blocks:
+      return distancesMm
+    voxelCenters = self.getOccupiedVoxelCenters(points.min(axis=0) - maximumDistanceMm, points.max(axis=0) + maximumDistanceMm)
+    if not len(voxelCenters):
+      return distancesMm
+    pointsPerChunk = max(1, maximumPairsPerChunk // len(voxelCenters))
+    voxelCenterSquaredNorms = numpy.sum(voxelCenters * voxelCenters, axis=1)
+    for start in range(0, len(points), pointsPerChunk):
+      chunk = points[start:start + pointsPerChunk]
+      squaredDistances = numpy.sum(chunk * chunk, axis=1)[:, numpy.newaxis] + voxelCenterSquaredNorms - 2.0 * chunk.dot(voxelCenters.T)
+      distancesMm[start:start + pointsPerChunk] = numpy.minimum(numpy.sqrt(numpy.maximum(squaredDistances.min(axis=1), 0.0)), maximumDistanceMm)
+    return distancesMm
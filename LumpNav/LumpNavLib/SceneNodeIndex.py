@@ -0,0 +1,149 @@
+from __main__ import vtk, slicer
+import fnmatch
+import logging
+
+# Nodes that have this attribute set are not indexed (e.g., internal staging nodes that share a name with a real node)
+EXCLUDE_FROM_INDEX_ATTRIBUTE_NAME = 'LumpNav.ExcludeFromNodeIndex'
+
+#
+# SceneNodeIndex
+#
+
+class SceneNodeIndex(object):
+  """Name to node index of the MRML scene. The index is kept up to date from scene NodeAdded/NodeRemoved events,
+  so finding a node by name does not require scanning all nodes of the scene.
+  """
+
+  def __init__(self, scene):
+    self.scene = scene
+    self.nodesByName = {}
+    # Name under which each node is indexed, so that a removed or renamed node is found without scanning all names
+    self.indexedNamesByNodeID = {}
+    self.sceneObserverTags = []
+    self.rebuild()
+    self.addObservers()
+
+  def addObservers(self):
+    self.sceneObserverTags.append(self.scene.AddObserver(self.scene.NodeAddedEvent, self.onNodeAdded))
+    self.sceneObserverTags.append(self.scene.AddObserver(self.scene.NodeRemovedEvent, self.onNodeRemoved))
+    # Node names may be changed while a scene is loaded, so index is recreated after bulk operations
+    for event in [self.scene.EndCloseEvent, self.scene.EndImportEvent, self.scene.EndRestoreEvent]:
+      self.sceneObserverTags.append(self.scene.AddObserver(event, self.onSceneBulkChangeEnded))
+
+  def removeObservers(self):
+    for tag in self.sceneObserverTags:
+      self.scene.RemoveObserver(tag)
+    self.sceneObserverTags = []
+
+  def rebuild(self):
+    self.nodesByName = {}
+    self.indexedNamesByNodeID = {}
+    for i in range(self.scene.GetNumberOfNodes()):
+      self.addNodeToIndex(self.scene.GetNthNode(i))
+
+  def addNodeToIndex(self, node):
+    if not node or not node.GetName() or node.GetAttribute(EXCLUDE_FROM_INDEX_ATTRIBUTE_NAME):
+      return
+    indexedName = self.indexedNamesByNodeID.get(node.GetID())
+    if indexedName is not None and indexedName != node.GetName():
+      # Node has been renamed since it was indexed
+      self.removeNodeFromName(node, indexedName)
+    nodes = self.nodesByName.setdefault(node.GetName(), [])
+    if node not in nodes:
+      nodes.append(node)
+    self.indexedNamesByNodeID[node.GetID()] = node.GetName()
+
+  def removeNodeFromIndex(self, node):
+    indexedName = self.indexedNamesByNodeID.pop(node.GetID(), None)
+    if indexedName is not None:
+      self.removeNodeFromName(node, indexedName)
+
+  def removeNodeFromName(self, node, name):
+    nodes = self.nodesByName.get(name)
+    if nodes and node in nodes:
+      nodes.remove(node)
+      if not nodes:
+        del self.nodesByName[name]
+
+  @vtk.calldata_type(vtk.VTK_OBJECT)
+  def onNodeAdded(self, caller, eventId, node):
+    self.addNodeToIndex(node)
+
+  @vtk.calldata_type(vtk.VTK_OBJECT)
+  def onNodeRemoved(self, caller, eventId, node):
+    self.removeNodeFromIndex(node)
+
+  def onSceneBulkChangeEnded(self, caller, eventId):
+    self.rebuild()
+
+  def getNode(self, name):
+    """Returns the first node with the given name, or None if there is no such node in the scene.
+    """
+    nodes = self.nodesByName.get(name)
+    if nodes:
+      for node in list(nodes):
+        if node.GetName() == name:
+          return node
+        # Node has been renamed since it was indexed, move it to its new name
+        self.removeNodeFromIndex(node)
+        self.addNodeToIndex(node)
+    # A node may have been renamed to this name after it was added to the scene
+    node = self.scene.GetFirstNodeByName(name)
+    if not node or node.GetAttribute(EXCLUDE_FROM_INDEX_ATTRIBUTE_NAME):
+      return None
+    self.addNodeToIndex(node)
+    return node
+
+  def getNodes(self, pattern):
+    """Returns all nodes whose name matches the pattern (same rules as slicer.util.getNodes).
+    """
+    matchingNodes = []
+    for name in list(self.nodesByName.keys()):
+      if fnmatch.fnmatchcase(name, pattern):
+        node = self.getNode(name)
+        if node:
+          matchingNodes.append(node)
+    return matchingNodes
+
+  def setNodeName(self, node, name):
+    self.removeNodeFromIndex(node)
+    node.SetName(name)
+    self.addNodeToIndex(node)
+
+  def getOrCreateTransformNodes(self, transformTree):
+    """Finds or creates all linear transforms of a transform tree in one call.
+    transformTree is a list of (name, parent, defaultMatrix) items. parent is a transform node, or the name of a transform
+    that is listed before its children or already exists in the scene. defaultMatrix (vtkMatrix4x4 or None) is only
+    applied to newly created nodes.
+    Returns a dictionary of transform nodes by name.
+    """
+    transformNodes = {}
+    for name, parent, defaultMatrix in transformTree:
+      transformNode = self.getNode(name)
+      if not transformNode:
+        transformNode = slicer.vtkMRMLLinearTransformNode()
+        transformNode.SetName(name)
+        if defaultMatrix:
+          transformNode.SetMatrixTransformToParent(defaultMatrix)
+        self.scene.AddNode(transformNode)
+      if parent:
+        # Parent nodes are used directly, names are looked up among the already processed and the indexed nodes
+        parentNode = parent if hasattr(parent, 'GetID') else (transformNodes.get(parent) or self.getNode(parent))
+        if parentNode:
+          transformNode.SetAndObserveTransformNodeID(parentNode.GetID())
+        else:
+          logging.warning("Parent transform {0} of {1} is not found".format(parent, name))
+      transformNodes[name] = transformNode
+    return transformNodes
+
+sceneNodeIndexInstance = None
+
+def getSceneNodeIndex():
+  """Returns the node index of the main MRML scene. The index is created at first use.
+  """
+  global sceneNodeIndexInstance
+  if sceneNodeIndexInstance is None or sceneNodeIndexInstance.scene != slicer.mrmlScene:
+    if sceneNodeIndexInstance:
+      sceneNodeIndexInstance.removeObservers()
+    sceneNodeIndexInstance = SceneNodeIndex(slicer.mrmlScene)
+  return sceneNodeIndexInstance
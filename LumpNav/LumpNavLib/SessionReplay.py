@@ -0,0 +1,166 @@
+from __main__ import vtk, qt, slicer
+import logging
+import time
+import numpy
+from vtk.util import numpy_support
+
+from LumpNavLib.MatrixUtil import updateVtkMatrixFromArray
+
+#
+# SessionReplay
+#
+
+class SessionReplay(object):
+  """Replays a recording made by TrackedUltrasoundRecorder: sets the recorded tool transforms, the ultrasound image
+  and the tumor markups at real-time or accelerated rate. Frames are read from the memory-mapped recording,
+  only the currently displayed frame is copied into the scene. The live ultrasound image and tumor points are
+  saved when the replay is created and are restored by cleanup().
+  """
+
+  def __init__(self, reader, transformNodes, ultrasoundNode=None, markupsNode=None):
+    """transformNodes is a dictionary that maps recorded transform names to transform nodes.
+    """
+    self.reader = reader
+    self.transformNodes = transformNodes
+    self.ultrasoundNode = ultrasoundNode
+    self.markupsNode = markupsNode
+    self.playbackRate = 1.0
+
+    timestamps = self.reader.getTimestamps()
+    self.startTimestamp = float(timestamps[0]) if len(timestamps) else 0.0
+    self.durationSec = float(timestamps[-1]) - self.startTimestamp if len(timestamps) else 0.0
+
+    self.currentTimeSec = 0.0
+    self.currentFrameIndex = -1
+    self.currentMarkupsSnapshotIndex = -1
+    self.playStartWallTime = 0.0
+    self.playStartTimeSec = 0.0
+    self.matrix = vtk.vtkMatrix4x4()
+    self.imageData = None
+
+    # Live state that the replay overwrites
+    self.liveImageData = None
+    self.liveIJKToRASMatrix = None
+    if self.ultrasoundNode:
+      self.liveImageData = self.ultrasoundNode.GetImageData()
+      self.liveIJKToRASMatrix = vtk.vtkMatrix4x4()
+      self.ultrasoundNode.GetIJKToRASMatrix(self.liveIJKToRASMatrix)
+    self.liveMarkupsPoints = None
+    if self.markupsNode:
+      position = [0.0, 0.0, 0.0]
+      self.liveMarkupsPoints = numpy.zeros((self.markupsNode.GetNumberOfFiducials(), 3))
+      for pointIndex in range(self.markupsNode.GetNumberOfFiducials()):
+        self.markupsNode.GetNthFiducialPosition(pointIndex, position)
+        self.liveMarkupsPoints[pointIndex] = position
+    self.markupsReplaced = False
+
+    self.timer = qt.QTimer()
+    self.timer.setInterval(15)
+    self.timer.connect('timeout()', self.onTimerTimeout)
+
+    # Callback function called with the current time (in seconds, from the start of the recording) after each update
+    self.timeChangedCallback = None
+
+    if self.ultrasoundNode and 'ImageIJKToReference' in self.reader.staticTransforms:
+      updateVtkMatrixFromArray(self.matrix, self.reader.staticTransforms['ImageIJKToReference'])
+      self.ultrasoundNode.SetIJKToRASMatrix(self.matrix)
+
+  def cleanup(self):
+    self.stop()
+    self.timer.disconnect('timeout()', self.onTimerTimeout)
+    self.restoreLiveState()
+
+  def restoreLiveState(self):
+    # Tumor points that were placed during the replay are replaced by the live points as well
+    if self.ultrasoundNode and self.imageData:
+      self.ultrasoundNode.SetIJKToRASMatrix(self.liveIJKToRASMatrix)
+      self.ultrasoundNode.SetAndObserveImageData(self.liveImageData)
+      self.imageData = None
+    if self.markupsNode and self.markupsReplaced:
+      self.setMarkupsPoints(self.liveMarkupsPoints)
+      self.markupsReplaced = False
+
+  def setPlaybackRate(self, playbackRate):
+    if self.isPlaying():
+      # Restart the clock so that the new rate applies from the current position
+      self.playStartTimeSec = self.currentTimeSec
+      self.playStartWallTime = time.time()
+    self.playbackRate = playbackRate
+
+  def isPlaying(self):
+    return self.timer.isActive()
+
+  def play(self):
+    if self.currentTimeSec >= self.durationSec:
+      self.seek(0.0)
+    self.playStartTimeSec = self.currentTimeSec
+    self.playStartWallTime = time.time()
+    self.timer.start()
+
+  def stop(self):
+    self.timer.stop()
+
+  def onTimerTimeout(self):
+    timeSec = self.playStartTimeSec + (time.time() - self.playStartWallTime) * self.playbackRate
+    if timeSec >= self.durationSec:
+      timeSec = self.durationSec
+      self.stop()
+    self.seek(timeSec)
+
+  def seek(self, timeSec):
+    self.currentTimeSec = min(max(timeSec, 0.0), self.durationSec)
+    if self.isPlaying():
+      self.playStartTimeSec = self.currentTimeSec
+      self.playStartWallTime = time.time()
+    timestamp = self.startTimestamp + self.currentTimeSec
+    frameIndex = self.reader.getFrameIndexAtTime(timestamp)
+    if frameIndex != self.currentFrameIndex and self.reader.getNumberOfFrames() > 0:
+      self.applyFrame(frameIndex)
+    markupsSnapshotIndex = self.reader.getMarkupsSnapshotIndexAtTime(timestamp)
+    if markupsSnapshotIndex != self.currentMarkupsSnapshotIndex:
+      self.applyMarkupsSnapshot(markupsSnapshotIndex)
+    if self.timeChangedCallback:
+      self.timeChangedCallback(self.currentTimeSec)
+
+  def applyFrame(self, frameIndex):
+    # no logging - called at replay frame rate
+    self.currentFrameIndex = frameIndex
+    poses = self.reader.getPoses(frameIndex)
+    for transformIndex, transformName in enumerate(self.reader.transformNames):
+      transformNode = self.transformNodes.get(transformName)
+      if transformNode:
+        updateVtkMatrixFromArray(self.matrix, poses[transformIndex])
+        transformNode.SetMatrixTransformToParent(self.matrix)
+    if self.ultrasoundNode and self.reader.frameShape:
+      frame = self.reader.getFrame(frameIndex)
+      if not self.imageData:
+        self.createImageData(frame)
+      # Copy only the displayed frame from the memory-mapped recording into the image buffer
+      self.imageArray[:] = frame.reshape(self.imageArray.shape)
+      self.imageData.Modified()
+      self.ultrasoundNode.Modified()
+
+  def createImageData(self, frame):
+    # Frames are stored in (slices, rows, columns, components) order
+    self.imageData = vtk.vtkImageData()
+    self.imageData.SetDimensions(frame.shape[2], frame.shape[1], frame.shape[0])
+    self.imageData.AllocateScalars(numpy_support.get_vtk_array_type(frame.dtype), frame.shape[3])
+    self.imageArray = numpy_support.vtk_to_numpy(self.imageData.GetPointData().GetScalars())
+    self.imageArray = self.imageArray.reshape(self.imageArray.shape[0], -1)
+    self.ultrasoundNode.SetAndObserveImageData(self.imageData)
+
+  def applyMarkupsSnapshot(self, snapshotIndex):
+    self.currentMarkupsSnapshotIndex = snapshotIndex
+    if not self.markupsNode:
+      return
+    points = self.reader.getMarkupsSnapshot(snapshotIndex) if snapshotIndex >= 0 else numpy.zeros((0, 3))
+    self.markupsReplaced = True
+    self.setMarkupsPoints(points)
+
+  def setMarkupsPoints(self, points):
+    # Replace all points with a single Modified event, so the tumor surface is only regenerated once
+    wasModifying = self.markupsNode.StartModify()
+    self.markupsNode.RemoveAllMarkups()
+    for point in points:
+      self.markupsNode.AddFiducial(point[0], point[1], point[2])
+    self.markupsNode.EndModify(wasModifying)
@@ -0,0 +1,141 @@
+from __main__ import vtk, slicer
+import logging
+
+#
+# SliceIntersectionCache
+#
+
+class SliceViewIntersection(object):
+  """Intersection contour of a model in one slice view, displayed by a 2D actor in the slice view renderer.
+  The contour is only recomputed when the model surface or the position of the slice plane relative
+  to the model has changed.
+  """
+
+  def __init__(self, sliceWidget):
+    self.sliceWidget = sliceWidget
+    self.sliceNode = sliceWidget.mrmlSliceNode()
+    self.renderer = sliceWidget.sliceView().renderWindow().GetRenderers().GetFirstRenderer()
+    self.cacheKey = None
+
+    self.plane = vtk.vtkPlane()
+    self.cutter = vtk.vtkCutter()
+    self.cutter.SetCutFunction(self.plane)
+    self.modelToXYTransform = vtk.vtkTransform()
+    self.transformFilter = vtk.vtkTransformPolyDataFilter()
+    self.transformFilter.SetTransform(self.modelToXYTransform)
+    self.transformFilter.SetInputConnection(self.cutter.GetOutputPort())
+    mapper = vtk.vtkPolyDataMapper2D()
+    mapper.SetInputConnection(self.transformFilter.GetOutputPort())
+    self.actor = vtk.vtkActor2D()
+    self.actor.SetMapper(mapper)
+    self.renderer.AddActor2D(self.actor)
+
+  def cleanup(self):
+    self.renderer.RemoveActor2D(self.actor)
+
+  def update(self, polyData, modelToRASMatrix):
+    """Recomputes the contour if the polydata or the slice plane to model transform changed since the last update.
+    Returns True if the contour was recomputed.
+    """
+    xyToModelMatrix = vtk.vtkMatrix4x4()
+    rasToModelMatrix = vtk.vtkMatrix4x4()
+    vtk.vtkMatrix4x4.Invert(modelToRASMatrix, rasToModelMatrix)
+    vtk.vtkMatrix4x4.Multiply4x4(rasToModelMatrix, self.sliceNode.GetXYToRAS(), xyToModelMatrix)
+    cacheKey = (polyData.GetMTime(), tuple(xyToModelMatrix.GetElement(row, column) for row in range(4) for column in range(4)))
+    if cacheKey == self.cacheKey:
+      return False
+    self.cacheKey = cacheKey
+
+    # Slice plane is the z=0 plane of the XY coordinate system
+    origin = [xyToModelMatrix.GetElement(row, 3) for row in range(3)]
+    xAxis = [xyToModelMatrix.GetElement(row, 0) for row in range(3)]
+    yAxis = [xyToModelMatrix.GetElement(row, 1) for row in range(3)]
+    normal = [0.0, 0.0, 0.0]
+    vtk.vtkMath.Cross(xAxis, yAxis, normal)
+    vtk.vtkMath.Normalize(normal)
+    self.plane.SetOrigin(origin)
+    self.plane.SetNormal(normal)
+
+    modelToXYMatrix = vtk.vtkMatrix4x4()
+    vtk.vtkMatrix4x4.Invert(xyToModelMatrix, modelToXYMatrix)
+    self.modelToXYTransform.SetMatrix(modelToXYMatrix)
+    self.cutter.SetInputData(polyData)
+    self.transformFilter.Update()
+    return True
+
+class SliceIntersectionCache(object):
+  """Displays the intersection of a model with the slice views, like the slice intersection display of models,
+  but keeps the contour of each slice view and only recomputes it when the model surface, the model transform
+  or the slice plane has changed. Slice intersection visibility of the model display node is turned off while
+  the cache is in use (and restored by cleanup), color, thickness and visibility are taken from the display node.
+  """
+
+  def __init__(self, modelNode, sliceViewNames=None):
+    self.modelNode = modelNode
+    layoutManager = slicer.app.layoutManager()
+    if sliceViewNames is None:
+      sliceViewNames = layoutManager.sliceViewNames()
+    self.intersections = [SliceViewIntersection(layoutManager.sliceWidget(name)) for name in sliceViewNames]
+    self.modelToRASMatrix = vtk.vtkMatrix4x4()
+    self.numberOfRecomputedContours = 0
+
+    displayNode = self.modelNode.GetDisplayNode()
+    self.previousSliceIntersectionVisibility = displayNode.GetSliceIntersectionVisibility()
+    displayNode.SliceIntersectionVisibilityOff()
+
+    self.observations = []
+    self.addObserver(self.modelNode, vtk.vtkCommand.ModifiedEvent, self.onModelModified)
+    self.addObserver(self.modelNode, slicer.vtkMRMLTransformableNode.TransformModifiedEvent, self.onModelModified)
+    self.addObserver(displayNode, vtk.vtkCommand.ModifiedEvent, self.onDisplayNodeModified)
+    for intersection in self.intersections:
+      self.addObserver(intersection.sliceNode, vtk.vtkCommand.ModifiedEvent, self.onSliceNodeModified)
+
+    self.onDisplayNodeModified(displayNode, None)
+    self.updateAll()
+
+  def addObserver(self, observedObject, event, method):
+    self.observations.append((observedObject, observedObject.AddObserver(event, method)))
+
+  def cleanup(self):
+    for observedObject, tag in self.observations:
+      observedObject.RemoveObserver(tag)
+    self.observations = []
+    for intersection in self.intersections:
+      intersection.cleanup()
+      intersection.sliceWidget.sliceView().scheduleRender()
+    self.intersections = []
+    # Model is displayed by the slice intersection display of the model again
+    displayNode = self.modelNode.GetDisplayNode()
+    if displayNode:
+      displayNode.SetSliceIntersectionVisibility(self.previousSliceIntersectionVisibility)
+
+  def updateIntersection(self, intersection):
+    polyData = self.modelNode.GetPolyData()
+    if not polyData:
+      return
+    if intersection.update(polyData, self.modelToRASMatrix):
+      self.numberOfRecomputedContours += 1
+      intersection.sliceWidget.sliceView().scheduleRender()
+
+  def updateAll(self):
+    self.modelToRASMatrix.Identity()
+    if self.modelNode.GetParentTransformNode():
+      self.modelNode.GetParentTransformNode().GetMatrixTransformToWorld(self.modelToRASMatrix)
+    for intersection in self.intersections:
+      self.updateIntersection(intersection)
+
+  def onModelModified(self, caller, eventId):
+    self.updateAll()
+
+  def onSliceNodeModified(self, caller, eventId):
+    for intersection in self.intersections:
+      if intersection.sliceNode == caller:
+        self.updateIntersection(intersection)
+
+  def onDisplayNodeModified(self, caller, eventId):
+    for intersection in self.intersections:
+      actorProperty = intersection.actor.GetProperty()
+      actorProperty.SetColor(caller.GetColor())
+      actorProperty.SetLineWidth(caller.GetSliceIntersectionThickness())
+      intersection.actor.SetVisibility(caller.GetVisibility())
+      intersection.sliceWidget.sliceView().scheduleRender()
@@ -0,0 +1,101 @@
+import os
+import logging
+import numpy
+import vtk
+from vtk.util import numpy_support
+
+#
+# ToolModelCache
+#
+
+class ToolModelCache(object):
+  """Stores generated tool model geometry (points, normals, triangles) as .npy files.
+  Cached arrays are memory-mapped on load, so generating the models again at every launch is not needed.
+  """
+
+  def __init__(self, cacheDirectoryPath):
+    self.cacheDirectoryPath = cacheDirectoryPath
+
+  def getNeedleKey(self, lengthMm, radiusMm, tipRadiusMm, markers):
+    return "Needle_L{0:g}_R{1:g}_T{2:g}_M{3:d}".format(lengthMm, radiusMm, tipRadiusMm, int(markers))
+
+  def getArrayFilePath(self, key, arrayName):
+    return os.path.join(self.cacheDirectoryPath, "{0}_{1}.npy".format(key, arrayName))
+
+  def load(self, key):
+    pointsFilePath = self.getArrayFilePath(key, 'Points')
+    trianglesFilePath = self.getArrayFilePath(key, 'Triangles')
+    if not os.path.exists(pointsFilePath) or not os.path.exists(trianglesFilePath):
+      return None
+
+    try:
+      # Copy-on-write mapping: pages are read lazily and VTK gets a writable buffer
+      points = numpy.load(pointsFilePath, mmap_mode='c')
+      triangles = numpy.load(trianglesFilePath, mmap_mode='c')
+    except (IOError, ValueError) as e:
+      logging.warning("Failed to load cached tool model {0}: {1}".format(key, e))
+      return None
+
+    polyData = vtk.vtkPolyData()
+    vtkPoints = vtk.vtkPoints()
+    vtkPoints.SetData(numpy_support.numpy_to_vtk(points))
+    polyData.SetPoints(vtkPoints)
+
+    # Legacy cell array layout: [3, i0, i1, i2, 3, ...]
+    numberOfTriangles = triangles.shape[0]
+    connectivity = numpy.empty((numberOfTriangles, 4), dtype=numpy_support.ID_TYPE_CODE)
+    connectivity[:,0] = 3
+    connectivity[:,1:] = triangles
+    cellArray = vtk.vtkCellArray()
+    cellArray.SetCells(numberOfTriangles, numpy_support.numpy_to_vtkIdTypeArray(connectivity.ravel(), deep=1))
+    polyData.SetPolys(cellArray)
+
+    normalsFilePath = self.getArrayFilePath(key, 'Normals')
+    if os.path.exists(normalsFilePath):
+      normals = numpy_support.numpy_to_vtk(numpy.load(normalsFilePath, mmap_mode='c'))
+      normals.SetName('Normals')
+      polyData.GetPointData().SetNormals(normals)
+
+    logging.debug("Tool model {0} loaded from cache".format(key))
+    return polyData
+
+  def save(self, key, polyData):
+    if not os.path.isdir(self.cacheDirectoryPath):
+      try:
+        os.makedirs(self.cacheDirectoryPath)
+      except OSError as e:
+        logging.warning("Cannot create tool model cache directory {0}: {1}".format(self.cacheDirectoryPath, e))
+        return False
+
+    # Strips and polygons are stored as plain triangles, the rendered surface is the same
+    triangleFilter = vtk.vtkTriangleFilter()
+    triangleFilter.SetInputData(polyData)
+    triangleFilter.PassVertsOff()
+    triangleFilter.PassLinesOff()
+    triangleFilter.Update()
+    triangulated = triangleFilter.GetOutput()
+
+    points = numpy_support.vtk_to_numpy(triangulated.GetPoints().GetData())
+    connectivity = numpy_support.vtk_to_numpy(triangulated.GetPolys().GetData())
+    triangles = connectivity.reshape(-1, 4)[:,1:]
+    arrays = {'Points': points, 'Triangles': triangles}
+    normals = triangulated.GetPointData().GetNormals()
+    if normals:
+      arrays['Normals'] = numpy_support.vtk_to_numpy(normals)
+
+    try:
+      for arrayName in arrays:
+        # Write to a temporary file first so that an interrupted save never leaves a truncated cache entry
+        filePath = self.getArrayFilePath(key, arrayName)
+        temporaryFilePath = filePath + '.tmp'
+        with open(temporaryFilePath, 'wb') as f:
+          numpy.save(f, numpy.ascontiguousarray(arrays[arrayName]))
+        if os.path.exists(filePath):
+          os.remove(filePath)
+        os.rename(temporaryFilePath, filePath)
+    except (IOError, OSError) as e:
+      logging.warning("Failed to save tool model {0} to cache: {1}".format(key, e))
+      return False
+
+    logging.debug("Tool model {0} saved to cache".format(key))
+    return True
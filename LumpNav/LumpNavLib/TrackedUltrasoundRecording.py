@@ -0,0 +1,370 @@
+import os
+import json
+import logging
+import threading
+import numpy
+
+try:
+  import Queue as queue
+except ImportError:
+  import queue
+
+#
+# Tracked ultrasound recording container
+#
+# A recording is a directory with the following files:
+#   Header.json             frame shape and type, names of recorded transforms, static (calibration) transforms,
+#                           tumor surface parameters (to regenerate the tumor from the markups snapshots as LumpNav did)
+#   FrameIndex.bin          one FRAME_INDEX_DTYPE record per frame, written after the frame data
+#   ChunkNNNNN.frames       raw image frames, FRAMES_PER_CHUNK frames per file
+#   ChunkNNNNN.poses        raw float64 4x4 matrices of all recorded transforms, FRAMES_PER_CHUNK frames per file
+#   Markups.bin             raw float64 point coordinates of all tumor markups snapshots
+#   MarkupsIndex.bin        one MARKUPS_INDEX_DTYPE record per snapshot, written after the snapshot points
+# All files are append-only, therefore a recording that was interrupted is still readable up to the last indexed frame.
+#
+
+HEADER_FILE_NAME = 'Header.json'
+FRAME_INDEX_FILE_NAME = 'FrameIndex.bin'
+FRAME_INDEX_DTYPE = numpy.dtype([('timestamp', '<f8'), ('chunk', '<u4'), ('frameInChunk', '<u4')])
+MARKUPS_FILE_NAME = 'Markups.bin'
+MARKUPS_INDEX_FILE_NAME = 'MarkupsIndex.bin'
+MARKUPS_INDEX_DTYPE = numpy.dtype([('timestamp', '<f8'), ('firstPoint', '<u8'), ('numberOfPoints', '<u8')])
+FRAMES_PER_CHUNK = 500
+FORMAT_VERSION = 1
+
+def getChunkFilePath(recordingPath, chunkIndex, extension):
+  return os.path.join(recordingPath, 'Chunk{0:05d}.{1}'.format(chunkIndex, extension))
+
+#
+# TrackedUltrasoundRecorder
+#
+
+class TrackedUltrasoundRecorder(object):
+  """Appends ultrasound frames and tool poses to a chunked recording from a background thread.
+  addFrame only copies the data and puts it in a queue, so it can be called from observer callbacks.
+  """
+
+  def __init__(self, recordingPath, transformNames, staticTransforms=None, framesPerChunk=FRAMES_PER_CHUNK, maximumQueuedFrames=256,
+    maximumPendingMarkupsSnapshots=64, tumorSurfaceParameters=None):
+    """tumorSurfaceParameters is a dictionary of the LumpNav tumor point preprocessing and surface strategy parameters
+    that are in effect when the recording is started.
+    """
+    self.recordingPath = recordingPath
+    self.transformNames = list(transformNames)
+    self.staticTransforms = staticTransforms if staticTransforms else {}
+    self.tumorSurfaceParameters = dict(tumorSurfaceParameters) if tumorSurfaceParameters else {}
+    self.framesPerChunk = framesPerChunk
+    self.frameQueue = queue.Queue(maximumQueuedFrames)
+    self.writerThread = None
+    self.frameShape = None
+    self.frameDtype = None
+    self.numberOfFramesWritten = 0
+    self.numberOfFramesDropped = 0
+    # Markups snapshots that did not fit in the queue, they are queued before the next frame
+    self.pendingMarkupsSnapshots = []
+    self.maximumPendingMarkupsSnapshots = maximumPendingMarkupsSnapshots
+    self.numberOfMarkupsSnapshotsDropped = 0
+    self.writeError = None
+
+  def start(self):
+    """Creates the recording directory and starts the writer thread. Returns False if the directory cannot be created.
+    """
+    try:
+      if not os.path.isdir(self.recordingPath):
+        os.makedirs(self.recordingPath)
+    except (IOError, OSError) as e:
+      self.writeError = e
+      logging.error("Creating recording {0} failed: {1}".format(self.recordingPath, e))
+      return False
+    self.writerThread = threading.Thread(target=self.writeFrames, name='TrackedUltrasoundRecorder')
+    self.writerThread.daemon = True
+    self.writerThread.start()
+    return True
+
+  def stop(self):
+    if not self.writerThread:
+      return
+    # None tells the writer thread that there are no more frames
+    while self.pendingMarkupsSnapshots and self.putWhileWriterAlive(self.pendingMarkupsSnapshots[0]):
+      del self.pendingMarkupsSnapshots[0]
+    self.numberOfMarkupsSnapshotsDropped += len(self.pendingMarkupsSnapshots)
+    self.pendingMarkupsSnapshots = []
+    self.putWhileWriterAlive(None)
+    self.writerThread.join()
+    self.writerThread = None
+    self.discardQueuedFrames()
+    try:
+      self.writeHeader()
+    except (IOError, OSError) as e:
+      logging.error("Writing recording {0} header failed: {1}".format(self.recordingPath, e))
+    logging.info("Recording {0} completed: {1} frames written, {2} frames dropped, {3} markups snapshots dropped".format(
+      self.recordingPath, self.numberOfFramesWritten, self.numberOfFramesDropped, self.numberOfMarkupsSnapshotsDropped))
+
+  def putWhileWriterAlive(self, item, timeoutSec=0.1):
+    """Waits until the item fits in the queue. Returns False if the writer thread exited (e.g., writing failed),
+    in this case the queue is not emptied anymore and waiting would block forever.
+    """
+    while self.writerThread.is_alive():
+      try:
+        self.frameQueue.put(item, timeout=timeoutSec)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def discardQueuedFrames(self):
+    # Frames that were queued but not written because the writer thread exited
+    while True:
+      try:
+        item = self.frameQueue.get_nowait()
+      except queue.Empty:
+        return
+      if item is None:
+        continue
+      if item[1] is not None:
+        self.numberOfFramesDropped += 1
+      else:
+        self.numberOfMarkupsSnapshotsDropped += 1
+
+  def isRecording(self):
+    return self.writerThread is not None
+
+  def addFrame(self, timestamp, frame, poses):
+    """Queue a frame for writing. frame is a NumPy array (copied here), poses is an array of shape
+    (number of transforms, 4, 4) in the order of transformNames. Returns False if the frame was dropped.
+    """
+    if self.writeError is not None:
+      # Writer thread exited, queued frames would never be written
+      self.numberOfFramesDropped += 1
+      return False
+    if self.frameShape is None:
+      self.frameShape = frame.shape
+      self.frameDtype = frame.dtype
+      try:
+        self.writeHeader()
+      except (IOError, OSError) as e:
+        # Same as a failure in the writer thread, no more frames are accepted
+        self.writeError = e
+        logging.error("Writing recording {0} header failed: {1}".format(self.recordingPath, e))
+        self.numberOfFramesDropped += 1
+        return False
+    elif frame.shape != self.frameShape or frame.dtype != self.frameDtype:
+      # Image size changed while recording, these frames cannot be stored in the same container
+      self.numberOfFramesDropped += 1
+      return False
+    # Snapshots are written before the frame, the queue may have room again
+    self.queuePendingMarkupsSnapshots()
+    try:
+      self.frameQueue.put_nowait((timestamp, numpy.array(frame, copy=True), numpy.array(poses, dtype=numpy.float64)))
+    except queue.Full:
+      # Writing cannot keep up (e.g., slow disk), drop the frame instead of blocking the application
+      self.numberOfFramesDropped += 1
+      return False
+    return True
+
+  def addMarkupsSnapshot(self, timestamp, points):
+    """Queue the current tumor markups point positions (array of shape (number of points, 3)) for writing.
+    If the queue is full then the snapshot is kept and queued later, this is called from the main thread and must not
+    wait for the writer. Returns False if a snapshot was dropped.
+    """
+    if self.writeError is not None:
+      self.numberOfMarkupsSnapshotsDropped += 1
+      return False
+    self.pendingMarkupsSnapshots.append((timestamp, None, numpy.array(points, dtype=numpy.float64).reshape(-1, 3)))
+    snapshotDropped = False
+    if len(self.pendingMarkupsSnapshots) > self.maximumPendingMarkupsSnapshots:
+      # The latest contour is the most important, the oldest pending snapshot is dropped
+      del self.pendingMarkupsSnapshots[0]
+      self.numberOfMarkupsSnapshotsDropped += 1
+      snapshotDropped = True
+    self.queuePendingMarkupsSnapshots()
+    return not snapshotDropped
+
+  def queuePendingMarkupsSnapshots(self):
+    while self.pendingMarkupsSnapshots:
+      try:
+        self.frameQueue.put_nowait(self.pendingMarkupsSnapshots[0])
+      except queue.Full:
+        return
+      del self.pendingMarkupsSnapshots[0]
+
+  def writeHeader(self):
+    header = {
+      'FormatVersion': FORMAT_VERSION,
+      'FrameShape': list(self.frameShape) if self.frameShape else None,
+      'FrameDtype': self.frameDtype.str if self.frameDtype else None,
+      'FramesPerChunk': self.framesPerChunk,
+      'TransformNames': self.transformNames,
+      'StaticTransforms': dict((name, list(numpy.asarray(matrix, dtype=numpy.float64).ravel())) for name, matrix in self.staticTransforms.items()),
+      'NumberOfFrames': self.numberOfFramesWritten,
+      'TumorSurfaceParameters': self.tumorSurfaceParameters,
+      }
+    temporaryHeaderFilePath = os.path.join(self.recordingPath, HEADER_FILE_NAME + '.tmp')
+    with open(temporaryHeaderFilePath, 'w') as headerFile:
+      json.dump(header, headerFile, indent=2)
+    headerFilePath = os.path.join(self.recordingPath, HEADER_FILE_NAME)
+    if os.path.exists(headerFilePath):
+      os.remove(headerFilePath)
+    os.rename(temporaryHeaderFilePath, headerFilePath)
+
+  def writeFrames(self):
+    # Runs in the writer thread
+    frameIndexFile = None
+    markupsFile = None
+    markupsIndexFile = None
+    numberOfMarkupsPointsWritten = 0
+    markupsIndexRecord = numpy.zeros(1, dtype=MARKUPS_INDEX_DTYPE)
+    framesFile = None
+    posesFile = None
+    chunkIndex = -1
+    indexRecord = numpy.zeros(1, dtype=FRAME_INDEX_DTYPE)
+    try:
+      frameIndexFile = open(os.path.join(self.recordingPath, FRAME_INDEX_FILE_NAME), 'ab')
+      markupsFile = open(os.path.join(self.recordingPath, MARKUPS_FILE_NAME), 'ab')
+      markupsIndexFile = open(os.path.join(self.recordingPath, MARKUPS_INDEX_FILE_NAME), 'ab')
+      while True:
+        item = self.frameQueue.get()
+        if item is None:
+          break
+        timestamp, frame, poses = item
+        if frame is None:
+          # Markups snapshot, poses contains the point coordinates
+          markupsFile.write(poses.tobytes())
+          markupsFile.flush()
+          markupsIndexRecord['timestamp'] = timestamp
+          markupsIndexRecord['firstPoint'] = numberOfMarkupsPointsWritten
+          markupsIndexRecord['numberOfPoints'] = poses.shape[0]
+          markupsIndexFile.write(markupsIndexRecord.tobytes())
+          markupsIndexFile.flush()
+          numberOfMarkupsPointsWritten += poses.shape[0]
+          continue
+        frameInChunk = self.numberOfFramesWritten % self.framesPerChunk
+        if frameInChunk == 0:
+          if framesFile:
+            framesFile.close()
+            posesFile.close()
+          chunkIndex += 1
+          framesFile = open(getChunkFilePath(self.recordingPath, chunkIndex, 'frames'), 'ab')
+          posesFile = open(getChunkFilePath(self.recordingPath, chunkIndex, 'poses'), 'ab')
+        framesFile.write(frame.tobytes())
+        posesFile.write(poses.tobytes())
+        # Frame data is flushed before the index record, so that every indexed frame is complete on disk
+        framesFile.flush()
+        posesFile.flush()
+        indexRecord['timestamp'] = timestamp
+        indexRecord['chunk'] = chunkIndex
+        indexRecord['frameInChunk'] = frameInChunk
+        frameIndexFile.write(indexRecord.tobytes())
+        frameIndexFile.flush()
+        self.numberOfFramesWritten += 1
+    except (IOError, OSError) as e:
+      self.writeError = e
+      logging.error("Writing recording {0} failed: {1}".format(self.recordingPath, e))
+    finally:
+      for openedFile in [framesFile, posesFile, frameIndexFile, markupsFile, markupsIndexFile]:
+        if openedFile:
+          openedFile.close()
+
+#
+# TrackedUltrasoundRecordingReader
+#
+
+class TrackedUltrasoundRecordingReader(object):
+  """Random access to the frames and poses of a recording. Data files are memory-mapped,
+  so only the frames that are actually accessed are read from disk.
+  """
+
+  def __init__(self, recordingPath):
+    self.recordingPath = recordingPath
+    with open(os.path.join(recordingPath, HEADER_FILE_NAME)) as headerFile:
+      self.header = json.load(headerFile)
+    self.transformNames = self.header['TransformNames']
+    self.framesPerChunk = self.header['FramesPerChunk']
+    self.frameShape = tuple(self.header['FrameShape']) if self.header['FrameShape'] else None
+    self.frameDtype = numpy.dtype(self.header['FrameDtype']) if self.header['FrameDtype'] else None
+    self.staticTransforms = dict((name, numpy.array(values).reshape(4,4)) for name, values in self.header['StaticTransforms'].items())
+    # Recordings made before the parameters were stored have none, their tumor is regenerated with the defaults
+    self.tumorSurfaceParameters = self.header.get('TumorSurfaceParameters', {})
+
+    frameIndexFilePath = os.path.join(recordingPath, FRAME_INDEX_FILE_NAME)
+    numberOfIndexedFrames = os.path.getsize(frameIndexFilePath) // FRAME_INDEX_DTYPE.itemsize if os.path.exists(frameIndexFilePath) else 0
+    if numberOfIndexedFrames > 0:
+      self.frameIndex = numpy.memmap(frameIndexFilePath, dtype=FRAME_INDEX_DTYPE, mode='r', shape=(numberOfIndexedFrames,))
+    else:
+      self.frameIndex = numpy.zeros(0, dtype=FRAME_INDEX_DTYPE)
+    self.chunkFrames = {}
+    self.chunkPoses = {}
+
+    markupsIndexFilePath = os.path.join(recordingPath, MARKUPS_INDEX_FILE_NAME)
+    markupsFilePath = os.path.join(recordingPath, MARKUPS_FILE_NAME)
+    if os.path.exists(markupsIndexFilePath) and os.path.getsize(markupsIndexFilePath) >= MARKUPS_INDEX_DTYPE.itemsize:
+      self.markupsIndex = numpy.fromfile(markupsIndexFilePath, dtype=MARKUPS_INDEX_DTYPE)
+    else:
+      self.markupsIndex = numpy.zeros(0, dtype=MARKUPS_INDEX_DTYPE)
+    numberOfMarkupsPoints = os.path.getsize(markupsFilePath) // (3 * 8) if os.path.exists(markupsFilePath) else 0
+    if numberOfMarkupsPoints > 0:
+      self.markupsPoints = numpy.memmap(markupsFilePath, dtype='<f8', mode='r', shape=(numberOfMarkupsPoints, 3))
+    else:
+      self.markupsPoints = numpy.zeros((0, 3))
+
+  def getNumberOfFrames(self):
+    return len(self.frameIndex)
+
+  def getTimestamps(self):
+    return self.frameIndex['timestamp']
+
+  def getTransformIndex(self, transformName):
+    return self.transformNames.index(transformName)
+
+  def getChunkArray(self, chunkArrays, chunkIndex, extension, itemShape, itemDtype):
+    if chunkIndex not in chunkArrays:
+      chunkFilePath = getChunkFilePath(self.recordingPath, chunkIndex, extension)
+      itemSize = int(numpy.prod(itemShape)) * itemDtype.itemsize
+      numberOfItems = os.path.getsize(chunkFilePath) // itemSize
+      chunkArrays[chunkIndex] = numpy.memmap(chunkFilePath, dtype=itemDtype, mode='r', shape=(numberOfItems,) + tuple(itemShape))
+    return chunkArrays[chunkIndex]
+
+  def getFrame(self, frameIndex):
+    record = self.frameIndex[frameIndex]
+    frames = self.getChunkArray(self.chunkFrames, int(record['chunk']), 'frames', self.frameShape, self.frameDtype)
+    return frames[int(record['frameInChunk'])]
+
+  def getPoses(self, frameIndex):
+    """Returns all recorded transforms of a frame as an array of shape (number of transforms, 4, 4)
+    """
+    record = self.frameIndex[frameIndex]
+    poses = self.getChunkArray(self.chunkPoses, int(record['chunk']), 'poses', (len(self.transformNames), 4, 4), numpy.dtype('<f8'))
+    return poses[int(record['frameInChunk'])]
+
+  def getPose(self, frameIndex, transformName):
+    return self.getPoses(frameIndex)[self.getTransformIndex(transformName)]
+
+  def getTransformTimeline(self, transformName, startFrameIndex=0, stopFrameIndex=None):
+    """Returns the poses of one transform for a range of frames as an array of shape (number of frames, 4, 4).
+    Only the chunks that overlap with the range are read.
+    """
+    if stopFrameIndex is None:
+      stopFrameIndex = self.getNumberOfFrames()
+    transformIndex = self.getTransformIndex(transformName)
+    timeline = numpy.empty((max(stopFrameIndex - startFrameIndex, 0), 4, 4))
+    records = self.frameIndex[startFrameIndex:stopFrameIndex]
+    for chunkIndex in numpy.unique(records['chunk']):
+      inChunk = (records['chunk'] == chunkIndex)
+      poses = self.getChunkArray(self.chunkPoses, int(chunkIndex), 'poses', (len(self.transformNames), 4, 4), numpy.dtype('<f8'))
+      timeline[inChunk] = poses[records['frameInChunk'][inChunk].astype(numpy.intp), transformIndex]
+    return timeline
+
+  def getFrameIndexAtTime(self, timestamp):
+    """Returns the index of the last frame recorded at or before timestamp (0 if timestamp is before the first frame).
+    """
+    return max(int(numpy.searchsorted(self.getTimestamps(), timestamp, side='right')) - 1, 0)
+
+  def getMarkupsSnapshotIndexAtTime(self, timestamp):
+    """Returns the index of the markups snapshot that was valid at timestamp, or -1 if there was none.
+    """
+    return int(numpy.searchsorted(self.markupsIndex['timestamp'], timestamp, side='right')) - 1
+
+  def getMarkupsSnapshot(self, snapshotIndex):
+    record = self.markupsIndex[snapshotIndex]
+    firstPoint = int(record['firstPoint'])
+    return self.markupsPoints[firstPoint:firstPoint + int(record['numberOfPoints'])]
@@ -0,0 +1,101 @@
+from __main__ import vtk, slicer
+import numpy
+
+from LumpNavLib.MatrixUtil import arrayFromVtkMatrix, updateVtkMatrixFromArray
+
+#
+# TransformChainCache
+#
+
+class TransformChainCache(object):
+  """Caches composite linear transforms (node-to-world and node-to-node) computed from transform node chains.
+  Every node of a queried chain is observed. A modification only invalidates the cached matrices that depend on
+  that node, and they are recomputed at the first query after the change. All consumers share the same product,
+  e.g., CauteryTipToNeedle is computed once per tracker frame regardless of how many consumers query it.
+  """
+
+  # Cache observers are invoked before other observers of the same transform node, so that
+  # consumers that are notified of the same modification already get the updated matrices.
+  observerPriority = 10.0
+
+  def __init__(self):
+    self.observerTagsByNodeID = {}
+    self.nodeVersions = {}
+    self.toParentMatrices = {}
+    self.toWorldCache = {}
+    self.betweenCache = {}
+    self.vtkMatrix = vtk.vtkMatrix4x4()
+
+  def cleanup(self):
+    for nodeID, (transformNode, tag) in self.observerTagsByNodeID.items():
+      transformNode.RemoveObserver(tag)
+    self.observerTagsByNodeID = {}
+    self.nodeVersions = {}
+    self.toParentMatrices = {}
+    self.toWorldCache = {}
+    self.betweenCache = {}
+
+  def onTransformModified(self, caller, eventId):
+    # no logging - called at the tracker update rate
+    nodeID = caller.GetID()
+    self.nodeVersions[nodeID] += 1
+    self.toParentMatrices.pop(nodeID, None)
+
+  def getChain(self, transformNode):
+    """Returns the transform node and all its parents, the node first. All of them are observed.
+    """
+    chain = []
+    while transformNode:
+      nodeID = transformNode.GetID()
+      if nodeID not in self.observerTagsByNodeID:
+        tag = transformNode.AddObserver(slicer.vtkMRMLTransformNode.TransformModifiedEvent, self.onTransformModified, self.observerPriority)
+        self.observerTagsByNodeID[nodeID] = (transformNode, tag)
+        self.nodeVersions[nodeID] = 0
+      chain.append(transformNode)
+      transformNode = transformNode.GetParentTransformNode()
+    return chain
+
+  def getChainVersion(self, chain):
+    return tuple((transformNode.GetID(), self.nodeVersions[transformNode.GetID()]) for transformNode in chain)
+
+  def getMatrixToParent(self, transformNode):
+    nodeID = transformNode.GetID()
+    if nodeID not in self.toParentMatrices:
+      transformNode.GetMatrixTransformToParent(self.vtkMatrix)
+      self.toParentMatrices[nodeID] = arrayFromVtkMatrix(self.vtkMatrix)
+    return self.toParentMatrices[nodeID]
+
+  def getMatrixToWorld(self, transformNode):
+    """Returns the node-to-world transform matrix as a 4x4 NumPy array. The array must not be modified.
+    """
+    if not transformNode:
+      return numpy.eye(4)
+    chain = self.getChain(transformNode)
+    chainVersion = self.getChainVersion(chain)
+    cachedVersion, matrix = self.toWorldCache.get(transformNode.GetID(), (None, None))
+    if cachedVersion == chainVersion:
+      return matrix
+    matrix = numpy.eye(4)
+    for chainNode in chain:
+      matrix = self.getMatrixToParent(chainNode).dot(matrix)
+    self.toWorldCache[transformNode.GetID()] = (chainVersion, matrix)
+    return matrix
+
+  def getMatrixBetween(self, fromNode, toNode):
+    """Returns the transform matrix from the coordinate system of fromNode to the coordinate system of toNode
+    (like vtkMRMLTransformNode::GetMatrixTransformToNode) as a 4x4 NumPy array. The array must not be modified.
+    """
+    key = (fromNode.GetID(), toNode.GetID())
+    version = (self.getChainVersion(self.getChain(fromNode)), self.getChainVersion(self.getChain(toNode)))
+    cachedVersion, matrix = self.betweenCache.get(key, (None, None))
+    if cachedVersion == version:
+      return matrix
+    matrix = numpy.linalg.inv(self.getMatrixToWorld(toNode)).dot(self.getMatrixToWorld(fromNode))
+    self.betweenCache[key] = (version, matrix)
+    return matrix
+
+  def getVtkMatrixToWorld(self, transformNode, vtkMatrix):
+    updateVtkMatrixFromArray(vtkMatrix, self.getMatrixToWorld(transformNode))
+
+  def getVtkMatrixBetween(self, fromNode, toNode, vtkMatrix):
+    updateVtkMatrixFromArray(vtkMatrix, self.getMatrixBetween(fromNode, toNode))
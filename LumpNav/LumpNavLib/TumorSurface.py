@@ -0,0 +1,269 @@
+import logging
+import numpy
+import vtk
+from vtk.util import numpy_support
+
+#
+# Surface generation strategy selection
+#
+
+# Points are glyphed by unit cubes, point sets smaller than this are treated as a single point
+MINIMUM_SPREAD_MM = 0.5
+
+GLYPH_STRATEGY = 'glyph'
+EXTRUDE_STRATEGY = 'extrude'
+DIRECT_STRATEGY = 'direct'
+
+# Strategy decision thresholds (names match the LumpNav parameters they can be set by).
+# Defaults are replaced by calibrated values computed by LumpNavBenchmark.py --calibrate-tumor-surface.
+DEFAULT_STRATEGY_THRESHOLDS = {
+  # Minimum number of non-degenerate points that Delaunay3D reliably turns into a closed surface
+  'TumorSurfaceDirectDelaunayMinimumPoints': 10,
+  # Point sets are coplanar (collinear) if their thinnest (second) extent is smaller than this ratio of their largest extent
+  'TumorSurfaceDegenerateSpreadRatio': 0.05,
+  }
+
+def getPointSpread(points):
+  """Returns the RMS extents of the points along their principal axes (largest first) and the axes (as rows).
+  """
+  centeredPoints = points - points.mean(axis=0)
+  singularValues, principalAxes = numpy.linalg.svd(centeredPoints, full_matrices=False)[1:]
+  return singularValues / numpy.sqrt(len(points)), principalAxes
+
+def selectTumorSurfaceStrategy(points, thresholds=None):
+  """Selects the cheapest pipeline that is expected to produce a valid closed surface from the points:
+  - direct: Delaunay3D of the points
+  - extrude: Delaunay3D of the coplanar points and their copies offset along the plane normal (2x points)
+  - glyph: Delaunay3D of a cube around each point (24x points), for very few, coincident or collinear points
+  Selection is validity-first: the cost of the strategies is in the order direct < extrude < glyph for any number
+  of points, so the thresholds only mark where a cheaper strategy stops producing a closed surface.
+  """
+  if thresholds is None:
+    thresholds = DEFAULT_STRATEGY_THRESHOLDS
+  if len(points) < 4:
+    return GLYPH_STRATEGY
+  extentsMm = getPointSpread(points)[0]
+  if extentsMm[0] < MINIMUM_SPREAD_MM:
+    return GLYPH_STRATEGY
+  degenerateSpreadRatio = float(thresholds['TumorSurfaceDegenerateSpreadRatio'])
+  if extentsMm[1] < degenerateSpreadRatio * extentsMm[0]:
+    return GLYPH_STRATEGY
+  if extentsMm[2] < degenerateSpreadRatio * extentsMm[0]:
+    return EXTRUDE_STRATEGY
+  if len(points) < int(thresholds['TumorSurfaceDirectDelaunayMinimumPoints']):
+    return GLYPH_STRATEGY
+  return DIRECT_STRATEGY
+
+#
+# Contour point preprocessing
+#
+
+# Preprocessing parameters (names match the LumpNav parameters they can be set by)
+DEFAULT_PREPROCESSING_PARAMETERS = {
+  # Points in the same voxel are replaced by their mean, 0 disables thinning
+  'TumorPointThinningVoxelSizeMm': 1.0,
+  # Points with mean neighbor distance above mean + ratio * standard deviation are removed, 0 disables outlier removal
+  'TumorPointOutlierStdRatio': 2.5,
+  'TumorPointOutlierNumberOfNeighbors': 6,
+  }
+
+def getTumorSurfaceParameters(parameters=None):
+  """Returns the preprocessing parameters and the strategy thresholds from a dictionary of LumpNav parameters
+  (e.g., the parameter node values or the parameters stored in a recording). Missing parameters get their defaults.
+  """
+  parameters = parameters or {}
+  thresholds = dict((name, parameters.get(name, value)) for name, value in DEFAULT_STRATEGY_THRESHOLDS.items())
+  preprocessingParameters = dict((name, parameters.get(name, value)) for name, value in DEFAULT_PREPROCESSING_PARAMETERS.items())
+  # Preprocessing reports the shape of the points with the same degeneracy threshold as the strategy selection
+  preprocessingParameters.update(thresholds)
+  return preprocessingParameters, thresholds
+
+# Outliers are only searched in point sets that have this many points, small contours are kept as is
+OUTLIER_REMOVAL_MINIMUM_POINTS = 12
+
+# Neighbor distances are computed for row chunks of the distance matrix that have at most this many elements
+DEFAULT_MAXIMUM_PAIRS_PER_CHUNK = 1000000
+
+def thinPoints(points, voxelSizeMm):
+  """Replaces the points that fall into the same cubic voxel by their mean position.
+  """
+  if voxelSizeMm <= 0 or len(points) < 2:
+    return points
+  voxelIndices = numpy.floor(points / voxelSizeMm).astype(numpy.int64)
+  # Points are grouped by sorting their voxel indices (numpy.unique with axis requires NumPy 1.13)
+  sortedPointIndices = numpy.lexsort(voxelIndices.T[::-1])
+  sortedVoxelIndices = voxelIndices[sortedPointIndices]
+  isFirstInVoxel = numpy.ones(len(points), dtype=bool)
+  isFirstInVoxel[1:] = (sortedVoxelIndices[1:] != sortedVoxelIndices[:-1]).any(axis=1)
+  pointVoxels = numpy.empty(len(points), dtype=numpy.int64)
+  pointVoxels[sortedPointIndices] = numpy.cumsum(isFirstInVoxel) - 1
+  numberOfVoxels = int(numpy.count_nonzero(isFirstInVoxel))
+  numberOfPointsInVoxels = numpy.bincount(pointVoxels, minlength=numberOfVoxels).astype(numpy.float64)
+  thinnedPoints = numpy.empty((numberOfVoxels, 3))
+  for axis in range(3):
+    thinnedPoints[:, axis] = numpy.bincount(pointVoxels, weights=points[:, axis], minlength=numberOfVoxels) / numberOfPointsInVoxels
+  return thinnedPoints
+
+def removeOutlierPoints(points, stdRatio, numberOfNeighbors, maximumPairsPerChunk=DEFAULT_MAXIMUM_PAIRS_PER_CHUNK):
+  """Removes points whose mean distance to their nearest neighbors is much larger than typical (statistical outlier removal).
+  Distances are computed for chunks of points, so memory use is bounded by maximumPairsPerChunk instead of growing
+  with the square of the number of points.
+  """
+  if stdRatio <= 0 or len(points) < max(OUTLIER_REMOVAL_MINIMUM_POINTS, numberOfNeighbors + 2):
+    return points
+  squaredNorms = numpy.sum(points * points, axis=1)
+  meanNeighborDistances = numpy.empty(len(points))
+  pointsPerChunk = max(1, maximumPairsPerChunk // len(points))
+  for startPointIndex in range(0, len(points), pointsPerChunk):
+    chunkPoints = points[startPointIndex:startPointIndex + pointsPerChunk]
+    squaredDistances = numpy.maximum(squaredNorms[startPointIndex:startPointIndex + pointsPerChunk, numpy.newaxis]
+      + squaredNorms[numpy.newaxis, :] - 2.0 * chunkPoints.dot(points.T), 0.0)
+    # Nearest neighbors, excluding the point itself (which is at index 0 after partitioning)
+    nearestSquaredDistances = numpy.partition(squaredDistances, numberOfNeighbors, axis=1)[:, 1:numberOfNeighbors + 1]
+    meanNeighborDistances[startPointIndex:startPointIndex + len(chunkPoints)] = numpy.sqrt(nearestSquaredDistances).mean(axis=1)
+  threshold = meanNeighborDistances.mean() + stdRatio * meanNeighborDistances.std()
+  return points[meanNeighborDistances <= threshold]
+
+def preprocessTumorPoints(points, parameters=None):
+  """Thins dense clusters and removes stray points, so that surface generation cost is bounded by the contour size
+  instead of the number of marked points. Returns the processed points and a report dictionary with the number of
+  input and effective points and the shape (degeneracy) of the effective point set.
+  """
+  if parameters is None:
+    parameters = DEFAULT_PREPROCESSING_PARAMETERS
+  processedPoints = thinPoints(points, float(parameters['TumorPointThinningVoxelSizeMm']))
+  numberOfThinnedPoints = len(processedPoints)
+  processedPoints = removeOutlierPoints(processedPoints, float(parameters['TumorPointOutlierStdRatio']),
+    int(parameters['TumorPointOutlierNumberOfNeighbors']))
+  report = {
+    'numberOfInputPoints': len(points),
+    'numberOfThinnedPoints': numberOfThinnedPoints,
+    'numberOfEffectivePoints': len(processedPoints),
+    'shape': 'point',
+    }
+  if len(processedPoints) >= 2:
+    extentsMm = getPointSpread(processedPoints)[0]
+    degenerateSpreadRatio = float(parameters.get('TumorSurfaceDegenerateSpreadRatio', DEFAULT_STRATEGY_THRESHOLDS['TumorSurfaceDegenerateSpreadRatio']))
+    if extentsMm[0] < MINIMUM_SPREAD_MM:
+      report['shape'] = 'point'
+    elif extentsMm[1] < degenerateSpreadRatio * extentsMm[0]:
+      report['shape'] = 'collinear'
+    elif len(processedPoints) < 4 or extentsMm[2] < degenerateSpreadRatio * extentsMm[0]:
+      report['shape'] = 'coplanar'
+    else:
+      report['shape'] = 'volume'
+  return processedPoints, report
+
+def isClosedSurface(polyData):
+  """Returns True if the surface is not empty and has no boundary or non-manifold edges.
+  """
+  if not polyData or polyData.GetNumberOfCells() == 0:
+    return False
+  featureEdges = vtk.vtkFeatureEdges()
+  featureEdges.SetInputData(polyData)
+  featureEdges.BoundaryEdgesOn()
+  featureEdges.NonManifoldEdgesOn()
+  featureEdges.FeatureEdgesOff()
+  featureEdges.ManifoldEdgesOff()
+  featureEdges.Update()
+  return featureEdges.GetOutput().GetNumberOfLines() == 0
+
+#
+# Tumor surface generation from contour points
+#
+
+class TumorSurfacePipeline(object):
+  """Long-lived surface generation pipeline. The filters are created once, each update only replaces
+  the input points and re-executes the pipeline, so the output port stays the same and can stay connected
+  to the tumor model.
+  """
+
+  def __init__(self, forceConvexShape=True):
+    self.forceConvexShape = forceConvexShape
+    self.strategy = None
+
+    self.points = vtk.vtkPoints()
+    self.points.SetDataTypeToDouble()
+    self.pointPolyData = vtk.vtkPolyData()
+    self.pointPolyData.SetPoints(self.points)
+    self.pointProducer = vtk.vtkTrivialProducer()
+    self.pointProducer.SetOutput(self.pointPolyData)
+
+    self.cubeSource = vtk.vtkCubeSource()
+    self.glyph = vtk.vtkGlyph3D()
+    self.glyph.SetInputConnection(self.pointProducer.GetOutputPort())
+    self.glyph.SetSourceConnection(self.cubeSource.GetOutputPort())
+
+    self.delaunay = vtk.vtkDelaunay3D()
+    self.delaunay.SetInputConnection(self.pointProducer.GetOutputPort())
+
+    self.surfaceFilter = vtk.vtkDataSetSurfaceFilter()
+    self.surfaceFilter.SetInputConnection(self.delaunay.GetOutputPort())
+
+    self.smoother = vtk.vtkButterflySubdivisionFilter()
+    self.smoother.SetInputConnection(self.surfaceFilter.GetOutputPort())
+    self.smoother.SetNumberOfSubdivisions(3)
+
+    self.delaunaySmooth = vtk.vtkDelaunay3D()
+    self.delaunaySmooth.SetInputConnection(self.smoother.GetOutputPort())
+
+    self.smoothSurfaceFilter = vtk.vtkDataSetSurfaceFilter()
+    self.smoothSurfaceFilter.SetInputConnection(self.delaunaySmooth.GetOutputPort())
+
+    self.outputAlgorithm = self.smoothSurfaceFilter if self.forceConvexShape else self.smoother
+
+  def GetOutputPort(self):
+    return self.outputAlgorithm.GetOutputPort()
+
+  def setPoints(self, points, thresholds=None, strategy=None):
+    """Sets the tumor contour points (NumPy array of shape (number of points, 3)) and updates the surface.
+    The pipeline is chosen by selectTumorSurfaceStrategy, unless a strategy is specified.
+    """
+    if strategy is None:
+      strategy = selectTumorSurfaceStrategy(points, thresholds)
+    if strategy == EXTRUDE_STRATEGY:
+      # Offset by the half size of the glyph cube, so that the surface is as thick as with glyphs
+      normal = getPointSpread(points)[1][2]
+      points = numpy.concatenate([points + 0.5 * normal, points - 0.5 * normal])
+
+    # Copy the points into the existing point array (it is only reallocated if it grows)
+    self.points.SetNumberOfPoints(len(points))
+    if len(points):
+      numpy_support.vtk_to_numpy(self.points.GetData())[:] = points
+    self.points.Modified()
+    self.pointPolyData.Modified()
+
+    if strategy != self.strategy:
+      self.strategy = strategy
+      if strategy == GLYPH_STRATEGY:
+        logging.debug("use glyphs")
+        self.delaunay.SetInputConnection(self.glyph.GetOutputPort())
+      else:
+        self.delaunay.SetInputConnection(self.pointProducer.GetOutputPort())
+
+    self.outputAlgorithm.Update()
+
+def createTumorSurface(points, forceConvexShape=True, thresholds=None, strategy=None):
+  """Creates a smooth closed surface from tumor contour points (NumPy array of shape (number of points, 3)).
+  Returns the last algorithm of the surface generation pipeline, its output port provides the surface.
+  A new pipeline is created for each call, use TumorSurfacePipeline to update a surface repeatedly.
+  """
+  pipeline = TumorSurfacePipeline(forceConvexShape)
+  pipeline.setPoints(points, thresholds, strategy)
+  return pipeline.outputAlgorithm
+
+def createDisplaySurface(surfaceAlgorithm, triangleBudget, decimation=None):
+  """Returns an algorithm that provides a decimated copy of the surface with at most about triangleBudget triangles,
+  for rendering and slice intersection. The input surface is used as is if it is within the budget.
+  If a decimation filter is specified then it is reused instead of creating a new one.
+  """
+  surfaceAlgorithm.Update()
+  numberOfTriangles = surfaceAlgorithm.GetOutputDataObject(0).GetNumberOfCells()
+  if numberOfTriangles <= triangleBudget:
+    return surfaceAlgorithm
+  if decimation is None:
+    decimation = vtk.vtkQuadricDecimation()
+  decimation.SetInputConnection(surfaceAlgorithm.GetOutputPort())
+  decimation.SetTargetReduction(1.0 - float(triangleBudget) / numberOfTriangles)
+  decimation.VolumePreservationOn()
+  return decimation
@@ -0,0 +1,133 @@
+from __main__ import vtk, slicer
+import timeit
+
+timer = timeit.default_timer
+
+#
+# ViewFrameTimer
+#
+
+class ViewFrameTimer(object):
+  """Measures the render time of a view from the start and end events of its render window.
+  """
+
+  def __init__(self, name, renderWindow):
+    self.name = name
+    self.renderWindow = renderWindow
+    self.renderStartTimeSec = None
+    self.reset()
+    self.observerTags = [
+      self.renderWindow.AddObserver(vtk.vtkCommand.StartEvent, self.onRenderStart),
+      self.renderWindow.AddObserver(vtk.vtkCommand.EndEvent, self.onRenderEnd),
+      ]
+
+  def cleanup(self):
+    for tag in self.observerTags:
+      self.renderWindow.RemoveObserver(tag)
+    self.observerTags = []
+
+  def reset(self):
+    self.numberOfFrames = 0
+    self.cumulativeFrameTimeSec = 0.0
+    self.maximumFrameTimeSec = 0.0
+    self.firstFrameTimeSec = None
+    self.lastFrameTimeSec = None
+
+  def onRenderStart(self, caller, eventId):
+    self.renderStartTimeSec = timer()
+
+  def onRenderEnd(self, caller, eventId):
+    if self.renderStartTimeSec is None:
+      return
+    nowSec = timer()
+    frameTimeSec = nowSec - self.renderStartTimeSec
+    self.renderStartTimeSec = None
+    self.numberOfFrames += 1
+    self.cumulativeFrameTimeSec += frameTimeSec
+    self.maximumFrameTimeSec = max(self.maximumFrameTimeSec, frameTimeSec)
+    if self.firstFrameTimeSec is None:
+      self.firstFrameTimeSec = nowSec
+    self.lastFrameTimeSec = nowSec
+
+  def getStatistics(self):
+    meanFrameTimeMs = 1000.0 * self.cumulativeFrameTimeSec / self.numberOfFrames if self.numberOfFrames else 0.0
+    elapsedSec = (self.lastFrameTimeSec - self.firstFrameTimeSec) if self.numberOfFrames > 1 else 0.0
+    return {
+      'numberOfFrames': self.numberOfFrames,
+      'meanFrameTimeMs': meanFrameTimeMs,
+      'maximumFrameTimeMs': 1000.0 * self.maximumFrameTimeSec,
+      'frameRateHz': (self.numberOfFrames - 1) / elapsedSec if elapsedSec > 0 else 0.0,
+      }
+
+#
+# ViewRenderThrottle
+#
+
+class ViewRenderThrottle(object):
+  """Limits the render rate of the secondary 3D views, so that the view of the camera that follows the tool
+  (the primary view) gets most of the rendering time. Render time of each view is measured.
+  """
+
+  def __init__(self, viewNames, primaryMaximumUpdateRateHz=60.0):
+    """viewNames are the names of the 3D view nodes (e.g., 'View1'). Views that do not exist yet (their layout
+    has not been shown yet) are added by updateViews.
+    """
+    self.viewNames = list(viewNames)
+    self.primaryMaximumUpdateRateHz = primaryMaximumUpdateRateHz
+    self.threeDViews = {}
+    self.frameTimers = {}
+    # Maximum update rate of each view when it is not the primary view
+    self.secondaryMaximumUpdateRatesHz = {}
+    self.primaryViewName = None
+    self.updateViews()
+
+  def updateViews(self):
+    """Adds the views that have been created by the layout manager since the last update.
+    Returns True if views were added.
+    """
+    if len(self.threeDViews) == len(self.viewNames):
+      return False
+    viewsAdded = False
+    layoutManager = slicer.app.layoutManager()
+    for threeDViewIndex in range(layoutManager.threeDViewCount):
+      threeDView = layoutManager.threeDWidget(threeDViewIndex).threeDView()
+      viewName = threeDView.mrmlViewNode().GetName()
+      if viewName in self.viewNames and viewName not in self.threeDViews:
+        self.threeDViews[viewName] = threeDView
+        self.frameTimers[viewName] = ViewFrameTimer(viewName, threeDView.renderWindow())
+        viewsAdded = True
+    return viewsAdded
+
+  def cleanup(self):
+    self.setPrimaryView(None)
+    for frameTimer in self.frameTimers.values():
+      frameTimer.cleanup()
+    self.frameTimers = {}
+    self.threeDViews = {}
+    # Views are not added again after cleanup
+    self.viewNames = []
+
+  def setSecondaryMaximumUpdateRate(self, viewName, maximumUpdateRateHz):
+    self.secondaryMaximumUpdateRatesHz[viewName] = maximumUpdateRateHz
+    self.setPrimaryView(self.primaryViewName)
+
+  def setPrimaryView(self, primaryViewName):
+    """Sets the view that is rendered at full rate, all other views are throttled.
+    If primaryViewName is None then all views are rendered at full rate.
+    """
+    self.updateViews()
+    self.primaryViewName = primaryViewName
+    for viewName, threeDView in self.threeDViews.items():
+      maximumUpdateRateHz = self.primaryMaximumUpdateRateHz
+      if primaryViewName is not None and viewName != primaryViewName:
+        maximumUpdateRateHz = self.secondaryMaximumUpdateRatesHz.get(viewName, self.primaryMaximumUpdateRateHz)
+      threeDView.maximumUpdateRate = maximumUpdateRateHz
+
+  def resetStatistics(self):
+    for frameTimer in self.frameTimers.values():
+      frameTimer.reset()
+
+  def getStatistics(self):
+    """Returns frame time statistics of each view.
+    """
+    return dict((viewName, frameTimer.getStatistics()) for viewName, frameTimer in self.frameTimers.items())
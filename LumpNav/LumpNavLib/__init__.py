@@ -0,0 +1,3 @@
+# Helper classes for the LumpNav guidelet.
+# Submodules are imported explicitly (e.g. "from LumpNavLib.ToolModelCache import ToolModelCache")
+# so that the ones without a Slicer dependency can also be used from a plain Python interpreter.
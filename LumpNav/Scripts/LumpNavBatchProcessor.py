@@ -0,0 +1,399 @@
+"""Headless batch processing of recorded LumpNav cases.
+
+Each subdirectory of the cases directory is a case, e.g., a saved scene directory (DefaultSavedScenesPath) with the
+tumor markups (T.fcsv) and the recordings of the case: Plus sequence metafiles (RecordingFilenamePrefix*.mhd) and/or
+LumpNav streaming recordings. For each case the tumor surface is regenerated from the markups, the cautery tip to tumor
+distance is computed for every recorded frame, and margin/breach statistics are written to OUTPUT/<case>/Summary.json.
+
+Cases are processed in parallel, each in its own worker process with a memory cap. A worker that is killed or aborts
+(e.g., a VTK allocation above the memory cap) only fails its case. Completed cases are recorded in OUTPUT/jobs.jsonl,
+so an interrupted run continues with the remaining cases when it is restarted. Run it in Python with NumPy and VTK
+(not in the Slicer application), for example:
+
+  python LumpNavBatchProcessor.py CASES_DIRECTORY OUTPUT_DIRECTORY --jobs 8 --worker-memory-mb 4000
+
+Plus sequence metafile recordings do not contain the cautery tip calibration. It is read from CauteryTipToCautery.tfm
+(or .txt) in the case directory, or from the file given by --cautery-tip-to-cautery. Cases with sequence metafiles and
+no calibration fail, instead of measuring the distance of the cautery sensor origin. Similarly, the tumor point
+preprocessing and surface strategy parameters are taken from the streaming recordings of the case. Cases that only have
+sequence metafiles use the default parameters, the parameters that were used are written to the summary.
+"""
+
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+import numpy
+import vtk
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from LumpNavLib.BreachAnalysis import computeBreachStatistics, computeToolTipPositions, getTriangleMeshArrays, TriangleMesh
+from LumpNavLib.TrackedUltrasoundRecording import HEADER_FILE_NAME, TrackedUltrasoundRecordingReader
+from LumpNavLib.TumorSurface import getTumorSurfaceParameters, preprocessTumorPoints, TumorSurfacePipeline
+from LumpNavBreachAnalysis import computeDistanceTimeline, writeTimeline, DEFAULT_MARGIN_SIZE_MM
+
+JOBS_FILE_NAME = 'jobs.jsonl'
+SUMMARY_FILE_NAME = 'Summary.json'
+# Same defaults as the RecordingFilenamePrefix LumpNav parameter and the tumor markups node name
+DEFAULT_RECORDING_PREFIX = 'LumpNavRecording-'
+TUMOR_MARKUPS_FILE_NAME = 'T.fcsv'
+CAUTERY_TIP_TO_CAUTERY_FILE_NAMES = ['CauteryTipToCautery.tfm', 'CauteryTipToCautery.txt']
+
+#
+# Case file readers
+#
+
+def readMarkupsPoints(filePath):
+  """Returns the point positions of a markups fiducial file (.fcsv) in RAS as an array of shape (N, 3).
+  """
+  points = []
+  lpsCoordinates = False
+  with open(filePath) as markupsFile:
+    for line in markupsFile:
+      line = line.strip()
+      if line.startswith('#'):
+        # Coordinate system is 0 or RAS (default), 1 or LPS
+        if line.replace(' ', '').lower().startswith('#coordinatesystem='):
+          lpsCoordinates = line.split('=')[1].strip().upper() in ['1', 'LPS']
+        continue
+      if line:
+        points.append([float(value) for value in line.split(',')[1:4]])
+  points = numpy.array(points, dtype=numpy.float64).reshape(-1, 3)
+  if lpsCoordinates:
+    points[:, 0:2] *= -1.0
+  return points
+
+def readTransformFile(filePath):
+  """Returns the transform-to-parent matrix (RAS) of a linear ITK transform file (.tfm, .txt) saved by Slicer.
+  """
+  parameters = None
+  fixedParameters = [0.0, 0.0, 0.0]
+  with open(filePath) as transformFile:
+    for line in transformFile:
+      if line.startswith('Parameters:'):
+        parameters = [float(value) for value in line.split(':')[1].split()]
+      elif line.startswith('FixedParameters:'):
+        fixedParameters = [float(value) for value in line.split(':')[1].split()]
+  if parameters is None or len(parameters) != 12:
+    raise ValueError('Not a linear transform file: ' + filePath)
+  rotation = numpy.array(parameters[0:9]).reshape(3, 3)
+  center = numpy.array(fixedParameters[0:3])
+  transformFromParentLps = numpy.eye(4)
+  transformFromParentLps[0:3, 0:3] = rotation
+  transformFromParentLps[0:3, 3] = numpy.array(parameters[9:12]) + center - rotation.dot(center)
+  # ITK files store the resampling (from parent) transform in LPS coordinates
+  lpsToRas = numpy.diag([-1.0, -1.0, 1.0, 1.0])
+  return numpy.linalg.inv(lpsToRas.dot(transformFromParentLps).dot(lpsToRas))
+
+def readSequenceMetafileTransforms(filePath, transformNames):
+  """Returns the timestamps (N,) and poses of the transforms (dictionary of (N, 4, 4) arrays, NaN for invalid poses)
+  of a Plus sequence metafile (.mhd). Only the header is read, image data is not needed.
+  """
+  fields = {}
+  with open(filePath) as sequenceFile:
+    for line in sequenceFile:
+      if '=' not in line:
+        continue
+      name, value = line.split('=', 1)
+      name = name.strip()
+      if name == 'ElementDataFile':
+        # Image data follows (or is in a separate file)
+        break
+      if name.startswith('Seq_Frame'):
+        fields[name] = value.strip()
+  frameNumbers = sorted(set(int(name[len('Seq_Frame'):].split('_')[0]) for name in fields))
+  timestamps = numpy.array([float(fields.get('Seq_Frame{0:04d}_Timestamp'.format(frameNumber), 'nan')) for frameNumber in frameNumbers])
+  poses = {}
+  for transformName in transformNames:
+    transformPoses = numpy.full((len(frameNumbers), 4, 4), numpy.nan)
+    for frameIndex, frameNumber in enumerate(frameNumbers):
+      prefix = 'Seq_Frame{0:04d}_{1}Transform'.format(frameNumber, transformName)
+      if prefix in fields and fields.get(prefix + 'Status', 'OK') == 'OK':
+        transformPoses[frameIndex] = numpy.array([float(value) for value in fields[prefix].split()]).reshape(4, 4)
+    poses[transformName] = transformPoses
+  return timestamps, poses
+
+def findCases(casesPath):
+  return sorted(name for name in os.listdir(casesPath) if os.path.isdir(os.path.join(casesPath, name)))
+
+def findCaseFiles(casePath, recordingPrefix):
+  """Returns the tumor markups file, the Plus sequence metafiles, the streaming recording directories
+  and the cautery tip calibration file of a case.
+  """
+  markupsFilePath = os.path.join(casePath, TUMOR_MARKUPS_FILE_NAME)
+  if not os.path.exists(markupsFilePath):
+    markupsFilePaths = sorted(glob.glob(os.path.join(casePath, '*.fcsv')))
+    markupsFilePath = markupsFilePaths[0] if markupsFilePaths else None
+  sequenceFilePaths = sorted(glob.glob(os.path.join(casePath, recordingPrefix + '*.mhd')) + glob.glob(os.path.join(casePath, '*', recordingPrefix + '*.mhd')))
+  streamingRecordingPaths = sorted(os.path.dirname(headerFilePath) for headerFilePath in
+    glob.glob(os.path.join(casePath, HEADER_FILE_NAME)) + glob.glob(os.path.join(casePath, '*', HEADER_FILE_NAME)))
+  cauteryTipFilePath = None
+  for fileName in CAUTERY_TIP_TO_CAUTERY_FILE_NAMES:
+    if os.path.exists(os.path.join(casePath, fileName)):
+      cauteryTipFilePath = os.path.join(casePath, fileName)
+      break
+  return markupsFilePath, sequenceFilePaths, streamingRecordingPaths, cauteryTipFilePath
+
+#
+# Case processing (runs in the worker processes)
+#
+
+def getRecordedTumorSurfaceParameters(streamingRecordingPaths):
+  """Returns the tumor surface parameters stored in the first streaming recording that has them, or None.
+  """
+  for recordingPath in streamingRecordingPaths:
+    tumorSurfaceParameters = TrackedUltrasoundRecordingReader(recordingPath).tumorSurfaceParameters
+    if tumorSurfaceParameters:
+      return tumorSurfaceParameters
+  return None
+
+def createTumorMesh(points, tumorSurfaceParameters=None):
+  """Regenerates the tumor surface from markups points the same way as LumpNav does, with the LumpNav tumor surface
+  parameters (defaults are used for missing parameters). Returns the mesh, the preprocessing report and the tumor volume.
+  """
+  preprocessingParameters, thresholds = getTumorSurfaceParameters(tumorSurfaceParameters)
+  points, preprocessingReport = preprocessTumorPoints(points, preprocessingParameters)
+  pipeline = TumorSurfacePipeline()
+  pipeline.setPoints(points, thresholds)
+  surface = pipeline.outputAlgorithm.GetOutput()
+  massProperties = vtk.vtkMassProperties()
+  massProperties.SetInputData(surface)
+  massProperties.Update()
+  return TriangleMesh(*getTriangleMeshArrays(surface)), preprocessingReport, massProperties.GetVolume()
+
+def analyzeSequenceFile(sequenceFilePath, tumorMesh, cauteryTipToCautery, marginSizeMm):
+  timestamps, poses = readSequenceMetafileTransforms(sequenceFilePath, ['CauteryToReference', 'NeedleToReference'])
+  distancesMm = numpy.full(len(timestamps), numpy.nan)
+  valid = ~(numpy.isnan(poses['CauteryToReference']).any(axis=(1, 2)) | numpy.isnan(poses['NeedleToReference']).any(axis=(1, 2)))
+  if valid.any():
+    tipPositions = computeToolTipPositions(poses['CauteryToReference'][valid], poses['NeedleToReference'][valid], cauteryTipToCautery)
+    distancesMm[valid] = tumorMesh.computeSignedDistances(tipPositions)
+  return timestamps, distancesMm
+
+def processCase(job):
+  """Processes one case and writes its summary. Returns the job ledger record.
+  """
+  casePath, outputPath, options = job
+  caseName = os.path.basename(casePath)
+  startTime = time.time()
+  record = {'case': caseName, 'pid': os.getpid(), 'startTime': startTime}
+  try:
+    markupsFilePath, sequenceFilePaths, streamingRecordingPaths, cauteryTipFilePath = findCaseFiles(casePath, options['recordingPrefix'])
+    if not sequenceFilePaths and not streamingRecordingPaths:
+      raise ValueError('No recordings found')
+    caseOutputPath = os.path.join(outputPath, caseName)
+    if not os.path.isdir(caseOutputPath):
+      os.makedirs(caseOutputPath)
+
+    summary = {'case': caseName, 'marginSizeMm': options['marginSizeMm'], 'recordings': []}
+    tumorMesh = None
+    if markupsFilePath:
+      tumorSurfaceParameters = getRecordedTumorSurfaceParameters(streamingRecordingPaths)
+      tumorMesh, preprocessingReport, volumeMm3 = createTumorMesh(readMarkupsPoints(markupsFilePath), tumorSurfaceParameters)
+      summary['tumor'] = {'markupsFile': markupsFilePath, 'volumeMm3': volumeMm3,
+        'numberOfTriangles': tumorMesh.getNumberOfTriangles(), 'preprocessing': preprocessingReport,
+        'parameters': getTumorSurfaceParameters(tumorSurfaceParameters)[0],
+        'parametersSource': 'recording' if tumorSurfaceParameters else 'default'}
+    if not cauteryTipFilePath:
+      cauteryTipFilePath = options.get('cauteryTipFilePath')
+    cauteryTipToCautery = None
+    if cauteryTipFilePath:
+      cauteryTipToCautery = readTransformFile(cauteryTipFilePath)
+    elif sequenceFilePaths:
+      # LumpNav keeps the calibration in the application settings, it is not in the sequence metafiles
+      raise ValueError('No cautery tip calibration found ({0} in the case directory or --cautery-tip-to-cautery)'.format(
+        ' or '.join(CAUTERY_TIP_TO_CAUTERY_FILE_NAMES)))
+    summary['cauteryTipToCauteryFile'] = cauteryTipFilePath
+
+    for recordingIndex, recordingPath in enumerate(sequenceFilePaths + streamingRecordingPaths):
+      if recordingPath in sequenceFilePaths:
+        if tumorMesh is None:
+          raise ValueError('No tumor markups found for ' + recordingPath)
+        timestamps, distancesMm = analyzeSequenceFile(recordingPath, tumorMesh, cauteryTipToCautery, options['marginSizeMm'])
+      else:
+        reader = TrackedUltrasoundRecordingReader(recordingPath)
+        # Tumor is taken from the recorded markups snapshots if there are any, otherwise from the case markups
+        recordedTumor = len(reader.markupsIndex) > 0
+        timestamps, distancesMm = computeDistanceTimeline(reader, None if recordedTumor else tumorMesh)
+      statistics = computeBreachStatistics(timestamps, distancesMm, options['marginSizeMm'])
+      statistics['recordingPath'] = recordingPath
+      summary['recordings'].append(statistics)
+      if options['writeTimelines']:
+        writeTimeline(os.path.join(caseOutputPath, 'Timeline{0:02d}.csv'.format(recordingIndex)), timestamps, distancesMm)
+
+    summaryFilePath = os.path.join(caseOutputPath, SUMMARY_FILE_NAME)
+    with open(summaryFilePath + '.tmp', 'w') as summaryFile:
+      json.dump(summary, summaryFile, indent=2, sort_keys=True)
+    if os.path.exists(summaryFilePath):
+      os.remove(summaryFilePath)
+    os.rename(summaryFilePath + '.tmp', summaryFilePath)
+    record['status'] = 'done'
+    record['numberOfRecordings'] = len(summary['recordings'])
+  except MemoryError:
+    record['status'] = 'failed'
+    record['error'] = 'MemoryError: worker memory limit ({0} MB) exceeded'.format(options['workerMemoryMb'])
+  except Exception as e:
+    record['status'] = 'failed'
+    record['error'] = '{0}: {1}'.format(type(e).__name__, e)
+    record['traceback'] = traceback.format_exc()
+  record['durationSec'] = time.time() - startTime
+  return record
+
+def initializeWorker(workerMemoryMb):
+  # Allocations above the limit fail in the worker instead of making the whole machine swap. Python allocations
+  # raise MemoryError, VTK allocations abort the worker process, which fails the case.
+  if not workerMemoryMb:
+    return
+  try:
+    import resource
+  except ImportError:
+    logging.warning('Worker memory limit is not supported on this platform')
+    return
+  limitBytes = int(workerMemoryMb) * 1024 * 1024
+  resource.setrlimit(resource.RLIMIT_AS, (limitBytes, limitBytes))
+
+def runCaseInWorker(job, workerMemoryMb, resultConnection):
+  # Runs in the worker process
+  initializeWorker(workerMemoryMb)
+  resultConnection.send(processCase(job))
+  resultConnection.close()
+
+def startWorker(job, workerMemoryMb):
+  resultConnection, workerConnection = multiprocessing.Pipe(False)
+  process = multiprocessing.Process(target=runCaseInWorker, args=(job, workerMemoryMb, workerConnection))
+  process.daemon = True
+  process.start()
+  workerConnection.close()
+  return {'process': process, 'resultConnection': resultConnection, 'job': job, 'startTime': time.time()}
+
+def getWorkerRecord(worker, caseTimeoutSec):
+  """Returns the job record of the worker if it completed, failed or timed out, otherwise None.
+  """
+  process = worker['process']
+  # Result is checked again after the process exited, the worker may have sent it just before exiting
+  if worker['resultConnection'].poll() or (not process.is_alive() and worker['resultConnection'].poll()):
+    try:
+      record = worker['resultConnection'].recv()
+    except EOFError:
+      record = None
+    if record is not None:
+      process.join()
+      return record
+  error = None
+  if not process.is_alive():
+    # Killed or aborted before reporting a result, e.g., an allocation above the memory limit in VTK
+    error = 'Worker process terminated with exit code {0}'.format(process.exitcode)
+  elif caseTimeoutSec and time.time() - worker['startTime'] > caseTimeoutSec:
+    process.terminate()
+    error = 'Case timeout ({0} s) exceeded'.format(caseTimeoutSec)
+  if error is None:
+    return None
+  process.join()
+  caseName = os.path.basename(worker['job'][0])
+  return {'case': caseName, 'pid': process.pid, 'startTime': worker['startTime'], 'status': 'failed', 'error': error,
+    'durationSec': time.time() - worker['startTime']}
+
+#
+# Job ledger
+#
+
+def readCompletedCases(jobsFilePath):
+  """Returns the names of the cases that have a 'done' record in the job ledger.
+  """
+  completedCases = set()
+  if not os.path.exists(jobsFilePath):
+    return completedCases
+  with open(jobsFilePath) as jobsFile:
+    for line in jobsFile:
+      try:
+        record = json.loads(line)
+      except ValueError:
+        # Last line may be incomplete if the previous run was killed while writing it
+        continue
+      if record.get('status') == 'done':
+        completedCases.add(record['case'])
+      else:
+        completedCases.discard(record.get('case'))
+  return completedCases
+
+def appendJobRecord(jobsFile, record):
+  jobsFile.write(json.dumps(record, sort_keys=True) + '\n')
+  jobsFile.flush()
+  os.fsync(jobsFile.fileno())
+
+def processCases(casesPath, outputPath, numberOfJobs=None, workerMemoryMb=None, marginSizeMm=DEFAULT_MARGIN_SIZE_MM,
+  recordingPrefix=DEFAULT_RECORDING_PREFIX, writeTimelines=False, force=False, cauteryTipFilePath=None, caseTimeoutSec=None):
+  """Processes all cases that are not completed yet. Returns the job records of this run.
+  """
+  if not os.path.isdir(outputPath):
+    os.makedirs(outputPath)
+  jobsFilePath = os.path.join(outputPath, JOBS_FILE_NAME)
+  completedCases = set() if force else readCompletedCases(jobsFilePath)
+  caseNames = [caseName for caseName in findCases(casesPath) if caseName not in completedCases]
+  logging.info('{0} cases to process, {1} already completed'.format(len(caseNames), len(completedCases)))
+  options = {'marginSizeMm': marginSizeMm, 'recordingPrefix': recordingPrefix, 'writeTimelines': writeTimelines, 'workerMemoryMb': workerMemoryMb,
+    'cauteryTipFilePath': os.path.abspath(cauteryTipFilePath) if cauteryTipFilePath else None}
+  jobs = [(os.path.join(casesPath, caseName), outputPath, options) for caseName in caseNames]
+
+  records = []
+  if not jobs:
+    return records
+  # Each case runs in a new worker process, so memory fragmentation does not accumulate and a worker that dies
+  # (unlike a worker of a process pool) is detected and fails only its own case
+  numberOfJobs = numberOfJobs or multiprocessing.cpu_count()
+  pendingJobs = list(jobs)
+  workers = []
+  try:
+    with open(jobsFilePath, 'a') as jobsFile:
+      # Records are written by this process only, in the order the cases complete
+      while pendingJobs or workers:
+        while pendingJobs and len(workers) < numberOfJobs:
+          workers.append(startWorker(pendingJobs.pop(0), workerMemoryMb))
+        runningWorkers = []
+        for worker in workers:
+          record = getWorkerRecord(worker, caseTimeoutSec)
+          if record is None:
+            runningWorkers.append(worker)
+            continue
+          appendJobRecord(jobsFile, record)
+          records.append(record)
+          logging.info('[{0}/{1}] {2}: {3} ({4:.1f} s){5}'.format(len(records), len(jobs), record['case'], record['status'],
+            record['durationSec'], ' ' + record['error'] if 'error' in record else ''))
+        if len(runningWorkers) == len(workers):
+          time.sleep(0.1)
+        workers = runningWorkers
+  finally:
+    # Completed cases are already in the ledger, the next run continues from here
+    for worker in workers:
+      worker['process'].terminate()
+      worker['process'].join()
+  return records
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='LumpNav batch processing of recorded cases')
+  parser.add_argument('cases', help='directory that contains one subdirectory per case')
+  parser.add_argument('output', help='directory to write the case summaries and the job ledger to')
+  parser.add_argument('--jobs', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+  parser.add_argument('--worker-memory-mb', type=int, default=4000, help='address space limit of each worker process [MB], 0 for no limit')
+  parser.add_argument('--margin', type=float, default=DEFAULT_MARGIN_SIZE_MM, help='margin size [mm] around the tumor')
+  parser.add_argument('--recording-prefix', default=DEFAULT_RECORDING_PREFIX, help='file name prefix of the Plus sequence metafile recordings')
+  parser.add_argument('--timelines', action='store_true', help='write the per-frame distance timeline of each recording')
+  parser.add_argument('--force', action='store_true', help='process all cases, also the ones that are completed according to the job ledger')
+  parser.add_argument('--cautery-tip-to-cautery', metavar='FILE', help='cautery tip calibration (.tfm, .txt) for cases that do not have their own')
+  parser.add_argument('--case-timeout', type=float, default=None, help='maximum processing time of a case [s], by default no limit')
+  args = parser.parse_args(argv)
+
+  logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+  records = processCases(args.cases, args.output, args.jobs, args.worker_memory_mb, args.margin, args.recording_prefix, args.timelines, args.force,
+    args.cautery_tip_to_cautery, args.case_timeout)
+  numberOfFailedCases = len([record for record in records if record['status'] != 'done'])
+  logging.info('{0} cases processed, {1} failed'.format(len(records), numberOfFailedCases))
+  return 1 if numberOfFailedCases else 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,130 @@
+"""Offline breach analysis of a recorded LumpNav session.
+
+Computes the cautery tip to tumor distance for every frame of a recording made by LumpNav (streaming recording)
+and reports breach intervals, minimum margins and the time spent inside the tumor, in the margin and outside.
+By default the tumor surface is regenerated from the tumor markups snapshots of the recording, so each frame is
+compared to the tumor as it was contoured at that time. Runs in Slicer or in any Python with NumPy and VTK, e.g.:
+
+  python LumpNavBreachAnalysis.py RECORDING_DIRECTORY --output summary.json --timeline distances.csv
+
+--tumor-model can be used to analyze against a saved tumor model (in Needle coordinates) instead.
+"""
+
+import argparse
+import json
+import os
+import sys
+import numpy
+import vtk
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from LumpNavLib.BreachAnalysis import computeBreachStatistics, computeToolTipPositions, getTriangleMeshArrays, TriangleMesh, DEFAULT_MAXIMUM_PAIRS_PER_CHUNK
+from LumpNavLib.TrackedUltrasoundRecording import TrackedUltrasoundRecordingReader
+from LumpNavLib.TumorSurface import getTumorSurfaceParameters, preprocessTumorPoints, TumorSurfacePipeline
+
+# Same default as the BreachWarningLightMarginSizeMm LumpNav parameter
+DEFAULT_MARGIN_SIZE_MM = 2.0
+
+def readTumorModel(filePath):
+  extension = os.path.splitext(filePath)[1].lower()
+  if extension == '.vtp':
+    reader = vtk.vtkXMLPolyDataReader()
+  elif extension == '.stl':
+    reader = vtk.vtkSTLReader()
+  elif extension == '.ply':
+    reader = vtk.vtkPLYReader()
+  else:
+    reader = vtk.vtkPolyDataReader()
+  reader.SetFileName(filePath)
+  reader.Update()
+  return reader.GetOutput()
+
+def createTumorMeshesFromMarkups(reader):
+  """Regenerates the tumor surface of each markups snapshot of the recording, the same way as LumpNav does
+  (with the tumor surface parameters stored in the recording). Returns a list of TriangleMesh (None for snapshots with no points).
+  """
+  preprocessingParameters, thresholds = getTumorSurfaceParameters(reader.tumorSurfaceParameters)
+  pipeline = TumorSurfacePipeline()
+  meshes = []
+  for snapshotIndex in range(len(reader.markupsIndex)):
+    points = numpy.array(reader.getMarkupsSnapshot(snapshotIndex))
+    if not len(points):
+      meshes.append(None)
+      continue
+    points = preprocessTumorPoints(points, preprocessingParameters)[0]
+    pipeline.setPoints(points, thresholds)
+    meshes.append(TriangleMesh(*getTriangleMeshArrays(pipeline.outputAlgorithm.GetOutput())))
+  return meshes
+
+def computeDistanceTimeline(reader, tumorMesh=None, framesPerChunk=5000, maximumPairsPerChunk=DEFAULT_MAXIMUM_PAIRS_PER_CHUNK):
+  """Returns the signed cautery tip to tumor surface distance (negative inside) for each frame of the recording.
+  Poses are read in chunks of frames, so memory use does not depend on the length of the recording.
+  If tumorMesh is not specified then the tumor valid at each frame is regenerated from the markups snapshots.
+  """
+  numberOfFrames = reader.getNumberOfFrames()
+  timestamps = numpy.array(reader.getTimestamps())
+  cauteryTipToCautery = reader.staticTransforms.get('CauteryTipToCautery', numpy.eye(4))
+  if tumorMesh is None:
+    tumorMeshes = createTumorMeshesFromMarkups(reader)
+    snapshotIndices = numpy.searchsorted(reader.markupsIndex['timestamp'], timestamps, side='right') - 1
+  else:
+    tumorMeshes = [tumorMesh]
+    snapshotIndices = numpy.zeros(numberOfFrames, dtype=numpy.intp)
+
+  distancesMm = numpy.full(numberOfFrames, numpy.nan)
+  for startFrameIndex in range(0, numberOfFrames, framesPerChunk):
+    stopFrameIndex = min(startFrameIndex + framesPerChunk, numberOfFrames)
+    tipPositions = computeToolTipPositions(reader.getTransformTimeline('CauteryToReference', startFrameIndex, stopFrameIndex),
+      reader.getTransformTimeline('NeedleToReference', startFrameIndex, stopFrameIndex), cauteryTipToCautery)
+    chunkSnapshotIndices = snapshotIndices[startFrameIndex:stopFrameIndex]
+    # Frames are grouped by the tumor that was valid when they were recorded, each group is one vectorized query
+    for snapshotIndex in numpy.unique(chunkSnapshotIndices):
+      if snapshotIndex < 0 or tumorMeshes[snapshotIndex] is None:
+        # Tumor was not contoured yet
+        continue
+      inSnapshot = numpy.nonzero(chunkSnapshotIndices == snapshotIndex)[0]
+      distancesMm[startFrameIndex + inSnapshot] = tumorMeshes[snapshotIndex].computeSignedDistances(tipPositions[inSnapshot], maximumPairsPerChunk)
+  return timestamps, distancesMm
+
+def writeTimeline(filePath, timestamps, distancesMm):
+  with open(filePath, 'w') as timelineFile:
+    timelineFile.write('Timestamp,DistanceMm\n')
+    for timestamp, distanceMm in zip(timestamps, distancesMm):
+      timelineFile.write('{0:.6f},{1}\n'.format(timestamp, '' if numpy.isnan(distanceMm) else '{0:.3f}'.format(distanceMm)))
+
+def analyzeRecording(recordingPath, tumorModelFilePath=None, marginSizeMm=DEFAULT_MARGIN_SIZE_MM, framesPerChunk=5000):
+  """Returns the breach statistics, timestamps and distances of a recording.
+  """
+  reader = TrackedUltrasoundRecordingReader(recordingPath)
+  tumorMesh = None
+  if tumorModelFilePath:
+    tumorMesh = TriangleMesh(*getTriangleMeshArrays(readTumorModel(tumorModelFilePath)))
+  timestamps, distancesMm = computeDistanceTimeline(reader, tumorMesh, framesPerChunk)
+  statistics = computeBreachStatistics(timestamps, distancesMm, marginSizeMm)
+  statistics['recordingPath'] = recordingPath
+  statistics['tumorModel'] = tumorModelFilePath if tumorModelFilePath else 'markups'
+  return statistics, timestamps, distancesMm
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='LumpNav recorded session breach analysis')
+  parser.add_argument('recording', help='recording directory (LumpNav streaming recording)')
+  parser.add_argument('--tumor-model', help='tumor model file (.vtk, .vtp, .stl, .ply) in Needle coordinates, by default the tumor is regenerated from the recorded markups')
+  parser.add_argument('--margin', type=float, default=DEFAULT_MARGIN_SIZE_MM, help='margin size [mm] around the tumor')
+  parser.add_argument('--frames-per-chunk', type=int, default=5000, help='number of frames processed at once')
+  parser.add_argument('--output', help='JSON file to write the statistics to')
+  parser.add_argument('--timeline', help='CSV file to write the distance of each frame to')
+  args = parser.parse_args(argv)
+
+  statistics, timestamps, distancesMm = analyzeRecording(args.recording, args.tumor_model, args.margin, args.frames_per_chunk)
+  if args.timeline:
+    writeTimeline(args.timeline, timestamps, distancesMm)
+  statisticsText = json.dumps(statistics, indent=2, sort_keys=True)
+  if args.output:
+    with open(args.output, 'w') as outputFile:
+      outputFile.write(statisticsText)
+  sys.stdout.write(statisticsText + '\n')
+  return statistics
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
+  sys.exit(0)
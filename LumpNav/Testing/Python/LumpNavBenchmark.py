@@ -0,0 +1,413 @@
+"""Headless end-to-end navigation benchmark for LumpNav.
+
+Scripts a synthetic case (contouring, tumor generation, cautery sweep at tracker rate) and reports per-stage timings.
+Run it in Slicer (SlicerIGT and OpenIGTLinkIF are needed), for example:
+
+  Slicer --no-main-window --python-script LumpNavBenchmark.py --output results.json --compare previous.json
+
+Results are written in JSON, so that results of different commits can be compared with --compare.
+
+With --calibrate-tumor-surface the tumor surface strategy thresholds are measured on this machine and VTK version,
+and with --write-settings CONFIGURATION they are stored in that LumpNav configuration of the application settings.
+"""
+
+from __main__ import vtk, slicer
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+import numpy
+
+import BreachWarningLight
+import Viewpoint
+from LumpNavLib.CallbackProfiler import callbackProfiler
+from LumpNavLib.MatrixUtil import updateVtkMatrixFromArray
+from LumpNavLib.TumorSurface import createTumorSurface, getPointSpread, DEFAULT_STRATEGY_THRESHOLDS, TumorSurfacePipeline, isClosedSurface, DIRECT_STRATEGY
+
+timer = timeit.default_timer
+
+#
+# Measurement helpers
+#
+
+class StageTimer(object):
+  def __init__(self):
+    self.durationsSec = {}
+
+  def measure(self, stageName, function, *args):
+    startTime = timer()
+    result = function(*args)
+    self.durationsSec.setdefault(stageName, []).append(timer() - startTime)
+    return result
+
+  def getSummary(self):
+    summary = {}
+    for stageName, durationsSec in self.durationsSec.items():
+      durationsMs = numpy.array(durationsSec) * 1000.0
+      summary[stageName] = {
+        'count': len(durationsMs),
+        'totalMs': float(durationsMs.sum()),
+        'meanMs': float(durationsMs.mean()),
+        'medianMs': float(numpy.median(durationsMs)),
+        'p95Ms': float(numpy.percentile(durationsMs, 95)),
+        'maxMs': float(durationsMs.max()),
+        }
+    return summary
+
+def getMemoryUsageMb():
+  # Current resident set size if available (Linux), peak resident set size otherwise
+  try:
+    with open('/proc/self/statm') as statmFile:
+      return int(statmFile.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024.0 * 1024.0)
+  except (IOError, OSError, ValueError):
+    pass
+  try:
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+  except ImportError:
+    return None
+
+#
+# Synthetic case
+#
+
+def createSyntheticContour(numberOfPoints, radiiMm=(15.0, 10.0, 8.0), noiseMm=0.5, seed=0):
+  """Points on the surface of an ellipsoid (in the needle coordinate system), in random order like manual marking.
+  """
+  randomState = numpy.random.RandomState(seed)
+  directions = randomState.normal(size=(numberOfPoints, 3))
+  directions /= numpy.linalg.norm(directions, axis=1)[:, numpy.newaxis]
+  return directions * numpy.array(radiiMm) + randomState.normal(scale=noiseMm, size=(numberOfPoints, 3))
+
+def createCauteryPath(numberOfFrames, startMm=(-40.0, 0.0, 0.0), endMm=(40.0, 0.0, 0.0), wobbleMm=5.0):
+  """CauteryToReference poses of a sweep that enters and leaves the tumor.
+  """
+  poses = numpy.tile(numpy.eye(4), (numberOfFrames, 1, 1))
+  fraction = numpy.linspace(0.0, 1.0, numberOfFrames)
+  poses[:, 0:3, 3] = numpy.array(startMm) + fraction[:, numpy.newaxis] * (numpy.array(endMm) - numpy.array(startMm))
+  poses[:, 1, 3] += wobbleMm * numpy.sin(fraction * 8 * numpy.pi)
+  return poses
+
+class StandInBreachWarningLightLogic(BreachWarningLight.BreachWarningLightLogic):
+  """Light logic that counts commands instead of sending them to a light controller.
+  """
+  def __init__(self):
+    BreachWarningLight.BreachWarningLightLogic.__init__(self)
+    self.numberOfSentCommands = 0
+
+  def sendLightSetCommand(self):
+    self.numberOfSentCommands += 1
+
+def createTransformNode(name, parentNode=None):
+  transformNode = slicer.vtkMRMLLinearTransformNode()
+  transformNode.SetName(name)
+  slicer.mrmlScene.AddNode(transformNode)
+  if parentNode:
+    transformNode.SetAndObserveTransformNodeID(parentNode.GetID())
+  return transformNode
+
+def setupScene():
+  nodes = {}
+  nodes['NeedleToReference'] = createTransformNode('NeedleToReference')
+  nodes['CauteryToReference'] = createTransformNode('CauteryToReference')
+  nodes['CauteryTipToCautery'] = createTransformNode('CauteryTipToCautery', nodes['CauteryToReference'])
+  nodes['CauteryCameraToCautery'] = createTransformNode('CauteryCameraToCautery', nodes['CauteryToReference'])
+
+  tumorModel = slicer.vtkMRMLModelNode()
+  tumorModel.SetName('TumorModel')
+  slicer.mrmlScene.AddNode(tumorModel)
+  tumorModelDisplayNode = slicer.vtkMRMLModelDisplayNode()
+  tumorModelDisplayNode.SetColor(0,1,0)
+  slicer.mrmlScene.AddNode(tumorModelDisplayNode)
+  tumorModel.SetAndObserveDisplayNodeID(tumorModelDisplayNode.GetID())
+  tumorModel.SetAndObserveTransformNodeID(nodes['NeedleToReference'].GetID())
+  nodes['TumorModel'] = tumorModel
+
+  cameraNode = slicer.vtkMRMLCameraNode()
+  cameraNode.SetName('BenchmarkCamera')
+  slicer.mrmlScene.AddNode(cameraNode)
+  nodes['Camera'] = cameraNode
+
+  connectorNode = slicer.vtkMRMLIGTLConnectorNode()
+  connectorNode.SetName('BenchmarkConnector')
+  slicer.mrmlScene.AddNode(connectorNode)
+  nodes['Connector'] = connectorNode
+  return nodes
+
+def createBreachWarningNode(nodes):
+  breachWarningNode = slicer.mrmlScene.CreateNodeByClass('vtkMRMLBreachWarningNode')
+  breachWarningNode.SetName('BenchmarkBreachWarning')
+  slicer.mrmlScene.AddNode(breachWarningNode)
+  breachWarningNode.UnRegister(None)
+  breachWarningNode.SetPlayWarningSound(False)
+  breachWarningNode.SetAndObserveToolTransformNodeId(nodes['CauteryTipToCautery'].GetID())
+  breachWarningNode.SetAndObserveWatchedModelNodeID(nodes['TumorModel'].GetID())
+  return breachWarningNode
+
+#
+# Benchmark
+#
+
+def runBenchmark(numberOfPoints, numberOfFrames, trackerRateHz):
+  slicer.mrmlScene.Clear(0)
+  nodes = setupScene()
+  stageTimer = StageTimer()
+  matrix = vtk.vtkMatrix4x4()
+  memoryUsageMb = {'start': getMemoryUsageMb()}
+
+  # Contouring: surface is regenerated after each marked point, as in the guidelet
+  contourPoints = createSyntheticContour(numberOfPoints)
+  tumorSurfacePipeline = TumorSurfacePipeline()
+  nodes['TumorModel'].SetPolyDataConnection(tumorSurfacePipeline.GetOutputPort())
+  for pointIndex in range(1, numberOfPoints + 1):
+    def rebuildTumor():
+      tumorSurfacePipeline.setPoints(contourPoints[:pointIndex])
+      nodes['TumorModel'].Modified()
+    stageTimer.measure('tumorRebuild', rebuildTumor)
+  memoryUsageMb['afterContouring'] = getMemoryUsageMb()
+
+  cauteryPoses = createCauteryPath(numberOfFrames)
+  breachWarningNode = createBreachWarningNode(nodes)
+
+  # Distance query: breach warning node is the only observer of the tool transform
+  distancesMm = numpy.zeros(numberOfFrames)
+  for frameIndex in range(numberOfFrames):
+    updateVtkMatrixFromArray(matrix, cauteryPoses[frameIndex])
+    stageTimer.measure('distanceQuery', nodes['CauteryToReference'].SetMatrixTransformToParent, matrix)
+    distancesMm[frameIndex] = breachWarningNode.GetClosestDistanceToModelFromToolTip()
+
+  # Camera update: Viewpoint camera computation for each tool pose
+  viewpointLogic = Viewpoint.ViewpointLogic()
+  viewpointLogic.setCameraNode(nodes['Camera'])
+  viewpointLogic.setTransformNode(nodes['CauteryCameraToCautery'])
+  for frameIndex in range(numberOfFrames):
+    updateVtkMatrixFromArray(matrix, cauteryPoses[frameIndex])
+    nodes['CauteryToReference'].SetMatrixTransformToParent(matrix)
+    stageTimer.measure('cameraUpdate', viewpointLogic.updateViewpointCamera)
+
+  # Light command: light pattern computation and command queueing with a stand-in connector
+  lightLogic = StandInBreachWarningLightLogic()
+  lightLogic.breachWarningNode = breachWarningNode
+  lightLogic.connectorNode = nodes['Connector']
+  lightLogic.lightFeedbackActive = True
+  for frameIndex in range(numberOfFrames):
+    updateVtkMatrixFromArray(matrix, cauteryPoses[frameIndex])
+    nodes['CauteryToReference'].SetMatrixTransformToParent(matrix)
+    stageTimer.measure('lightCommand', lightLogic.onBreachWarningNodeModified, None, None)
+
+  # End-to-end: all observers are active, as during navigation
+  viewpointLogic.startViewpoint()
+  lightLogic.startLightFeedback(breachWarningNode, nodes['Connector'])
+  for frameIndex in range(numberOfFrames):
+    updateVtkMatrixFromArray(matrix, cauteryPoses[frameIndex])
+    stageTimer.measure('trackerFrame', nodes['CauteryToReference'].SetMatrixTransformToParent, matrix)
+  viewpointLogic.stopViewpoint()
+  lightLogic.stopLightFeedback()
+  memoryUsageMb['end'] = getMemoryUsageMb()
+
+  summary = stageTimer.getSummary()
+  frameBudgetMs = 1000.0 / trackerRateHz
+  trackerFrameDurationsMs = numpy.array(stageTimer.durationsSec['trackerFrame']) * 1000.0
+  summary['trackerFrame']['framesOverBudgetPercent'] = float(100.0 * numpy.mean(trackerFrameDurationsMs > frameBudgetMs))
+
+  return {
+    'stages': summary,
+    'memoryUsageMb': memoryUsageMb,
+    'numberOfLightCommands': lightLogic.numberOfSentCommands,
+    'minimumDistanceMm': float(distancesMm.min()),
+    }
+
+def measureObserverToggleCycles(numberOfCycles):
+  """Switches light feedback and the viewpoint camera on and off repeatedly, as the GUI buttons do. Returns the number
+  of live observers, the number of callbacks invoked by one tracker update and the memory usage after the first and
+  the last cycle, which stay the same if no observers are leaked.
+  """
+  slicer.mrmlScene.Clear(0)
+  nodes = setupScene()
+  breachWarningNode = createBreachWarningNode(nodes)
+  lightLogic = StandInBreachWarningLightLogic()
+  viewpointLogic = Viewpoint.ViewpointLogic()
+  stageTimer = StageTimer()
+  matrix = vtk.vtkMatrix4x4()
+  callbackNames = ['BreachWarningLightLogic.onBreachWarningNodeModified', 'ViewpointLogic.onTransformModified']
+
+  def measureCycle(cycleIndex):
+    lightLogic.startLightFeedback(breachWarningNode, nodes['Connector'])
+    viewpointLogic.addCameraBinding(nodes['CauteryCameraToCautery'], nodes['Camera'])
+    callbackProfiler.reset()
+    wasEnabled = callbackProfiler.enabled
+    callbackProfiler.setEnabled(True)
+    matrix.SetElement(0, 3, cycleIndex % 100)
+    nodes['CauteryToReference'].SetMatrixTransformToParent(matrix)
+    callbackProfiler.setEnabled(wasEnabled)
+    measurement = {
+      'lightObservers': lightLogic.observers.getNumberOfObservers(),
+      'viewpointObservers': viewpointLogic.observers.getNumberOfObservers(),
+      'callbacksPerTrackerUpdate': sum(callbackProfiler.getRecord(name).numberOfCalls for name in callbackNames),
+      }
+    lightLogic.stopLightFeedback()
+    viewpointLogic.removeCameraBinding(nodes['Camera'])
+    measurement['observersAfterStop'] = lightLogic.observers.getNumberOfObservers() + viewpointLogic.observers.getNumberOfObservers()
+    measurement['memoryUsageMb'] = getMemoryUsageMb()
+    return measurement
+
+  def toggle():
+    lightLogic.startLightFeedback(breachWarningNode, nodes['Connector'])
+    viewpointLogic.addCameraBinding(nodes['CauteryCameraToCautery'], nodes['Camera'])
+    lightLogic.stopLightFeedback()
+    viewpointLogic.removeCameraBinding(nodes['Camera'])
+
+  results = {'cycles': numberOfCycles, 'first': measureCycle(0)}
+  for cycleIndex in range(1, numberOfCycles - 1):
+    stageTimer.measure('toggleCycle', toggle)
+  results['last'] = measureCycle(numberOfCycles - 1)
+  results['stages'] = stageTimer.getSummary()
+  return results
+
+def measureContouringSession(numberOfPoints):
+  """Regenerates the tumor surface after each marked point, once with a new pipeline for each update
+  and once with a persistent pipeline. Returns timing and memory growth of both.
+  """
+  contourPoints = createSyntheticContour(numberOfPoints)
+  tumorModel = slicer.vtkMRMLModelNode()
+  slicer.mrmlScene.AddNode(tumorModel)
+  results = {}
+
+  def rebuildWithNewPipeline(points):
+    tumorSurface = createTumorSurface(points)
+    tumorModel.SetPolyDataConnection(tumorSurface.GetOutputPort())
+    tumorModel.Modified()
+
+  tumorSurfacePipeline = TumorSurfacePipeline()
+  def rebuildWithPersistentPipeline(points):
+    tumorSurfacePipeline.setPoints(points)
+    if tumorModel.GetPolyDataConnection() != tumorSurfacePipeline.GetOutputPort():
+      tumorModel.SetPolyDataConnection(tumorSurfacePipeline.GetOutputPort())
+    tumorModel.Modified()
+
+  for sessionName, rebuild in [('newPipeline', rebuildWithNewPipeline), ('persistentPipeline', rebuildWithPersistentPipeline)]:
+    stageTimer = StageTimer()
+    startMemoryUsageMb = getMemoryUsageMb()
+    for pointIndex in range(1, numberOfPoints + 1):
+      stageTimer.measure(sessionName, rebuild, contourPoints[:pointIndex])
+    endMemoryUsageMb = getMemoryUsageMb()
+    results[sessionName] = stageTimer.getSummary()[sessionName]
+    if startMemoryUsageMb is not None and endMemoryUsageMb is not None:
+      results[sessionName]['memoryGrowthMb'] = endMemoryUsageMb - startMemoryUsageMb
+
+  slicer.mrmlScene.RemoveNode(tumorModel)
+  return results
+
+#
+# Tumor surface strategy calibration
+#
+
+def isDirectDelaunayValid(points):
+  tumorSurface = createTumorSurface(points, strategy=DIRECT_STRATEGY)
+  tumorSurface.Update()
+  return isClosedSurface(tumorSurface.GetOutput())
+
+def calibrateTumorSurfaceStrategy(numberOfTrials=10, maximumNumberOfPoints=30):
+  """Finds the tumor surface strategy thresholds by testing when direct Delaunay triangulation fails to
+  produce a closed surface on synthetic contours. Only validity is tested: direct triangulation is always cheaper than
+  the other strategies (they triangulate 2x or 24x points), so it is selected wherever it is valid.
+  Thresholds that could not be calibrated keep their default values and are listed in 'failedThresholds'.
+  """
+  # Smallest number of points from which direct triangulation is always valid
+  directDelaunayMinimumPoints = None
+  for numberOfPoints in range(maximumNumberOfPoints, 3, -1):
+    contours = [createSyntheticContour(numberOfPoints, seed=seed) for seed in range(numberOfTrials)]
+    if not all(isDirectDelaunayValid(contour) for contour in contours):
+      break
+    directDelaunayMinimumPoints = numberOfPoints
+
+  # Smallest thickness to size ratio at which direct triangulation of flattened contours is always valid
+  degenerateSpreadRatio = None
+  for flatteningFactor in [0.5, 0.2, 0.1, 0.05, 0.02, 0.01, 0.005, 0.002, 0.001]:
+    contours = [createSyntheticContour(maximumNumberOfPoints, noiseMm=0.0, seed=seed) * [1.0, 1.0, flatteningFactor] for seed in range(numberOfTrials)]
+    if not all(isDirectDelaunayValid(contour) for contour in contours):
+      break
+    degenerateSpreadRatio = max(getPointSpread(contour)[0][2] / getPointSpread(contour)[0][0] for contour in contours)
+
+  calibratedThresholds = {
+    'TumorSurfaceDirectDelaunayMinimumPoints': directDelaunayMinimumPoints,
+    'TumorSurfaceDegenerateSpreadRatio': degenerateSpreadRatio,
+    }
+  # Direct triangulation failed already at the first (easiest) test, the result would disable it for real contours
+  failedThresholds = sorted(name for name, value in calibratedThresholds.items() if value is None)
+  thresholds = dict((name, DEFAULT_STRATEGY_THRESHOLDS[name] if value is None else value) for name, value in calibratedThresholds.items())
+  return {'thresholds': thresholds, 'failedThresholds': failedThresholds}
+
+def writeSettings(configurationName, parameters):
+  settings = slicer.app.userSettings()
+  settings.beginGroup('LumpNav/Configurations/' + configurationName)
+  for name, value in parameters.items():
+    settings.setValue(name, str(value))
+  settings.endGroup()
+
+def compareResults(currentResults, previousResults):
+  lines = ['{0:<16}{1:>14}{2:>14}{3:>10}'.format('Stage', 'Previous [ms]', 'Current [ms]', 'Change')]
+  for stageName in sorted(currentResults['stages'].keys()):
+    currentMs = currentResults['stages'][stageName]['meanMs']
+    previousStage = previousResults.get('stages', {}).get(stageName)
+    if not previousStage:
+      lines.append('{0:<16}{1:>14}{2:>14.3f}{3:>10}'.format(stageName, '-', currentMs, '-'))
+      continue
+    previousMs = previousStage['meanMs']
+    changePercent = 100.0 * (currentMs - previousMs) / previousMs if previousMs > 0 else 0.0
+    lines.append('{0:<16}{1:>14.3f}{2:>14.3f}{3:>9.1f}%'.format(stageName, previousMs, currentMs, changePercent))
+  return '\n'.join(lines)
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='LumpNav navigation benchmark')
+  parser.add_argument('--points', type=int, default=50, help='number of contour points')
+  parser.add_argument('--frames', type=int, default=600, help='number of tracker frames in the cautery sweep')
+  parser.add_argument('--tracker-rate', type=float, default=60.0, help='tracker update rate [Hz], used for the frame time budget')
+  parser.add_argument('--label', default='', help='label stored in the results, e.g., commit hash')
+  parser.add_argument('--output', help='JSON file to write the results to')
+  parser.add_argument('--compare', help='JSON file of previous results to compare with')
+  parser.add_argument('--session-points', type=int, default=200, help='number of points of the contouring session used for comparing tumor pipelines')
+  parser.add_argument('--toggle-cycles', type=int, default=2000, help='number of light feedback and viewpoint on/off cycles used for checking observer leaks')
+  parser.add_argument('--calibrate-tumor-surface', action='store_true', help='calibrate tumor surface strategy thresholds instead of running the benchmark')
+  parser.add_argument('--write-settings', metavar='CONFIGURATION', help='store calibrated thresholds in this LumpNav configuration')
+  args = parser.parse_args(argv)
+
+  if args.calibrate_tumor_surface:
+    calibration = calibrateTumorSurfaceStrategy()
+    if calibration['failedThresholds']:
+      sys.stderr.write('Calibration failed for {0}, default values are reported\n'.format(', '.join(calibration['failedThresholds'])))
+      if args.write_settings:
+        sys.stderr.write('Settings are not written\n')
+    elif args.write_settings:
+      writeSettings(args.write_settings, calibration['thresholds'])
+    sys.stdout.write(json.dumps(calibration, indent=2, sort_keys=True) + '\n')
+    return calibration
+
+  results = {
+    'label': args.label,
+    'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+    'platform': platform.platform(),
+    'parameters': {'points': args.points, 'frames': args.frames, 'trackerRateHz': args.tracker_rate, 'sessionPoints': args.session_points,
+      'toggleCycles': args.toggle_cycles},
+    }
+  results.update(runBenchmark(args.points, args.frames, args.tracker_rate))
+  results['contouringSession'] = measureContouringSession(args.session_points)
+  results['observerToggleCycles'] = measureObserverToggleCycles(args.toggle_cycles)
+
+  resultsText = json.dumps(results, indent=2, sort_keys=True)
+  if args.output:
+    with open(args.output, 'w') as outputFile:
+      outputFile.write(resultsText)
+  sys.stdout.write(resultsText + '\n')
+
+  if args.compare:
+    with open(args.compare) as previousFile:
+      sys.stdout.write(compareResults(results, json.load(previousFile)) + '\n')
+  return results
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
+  sys.exit(0)
@@ -0,0 +1,181 @@
+"""Tests of the NumPy-only LumpNavLib modules. They do not need the Slicer application, e.g.:
+
+  python -m unittest discover -s LumpNav/Testing/Python -p "LumpNavLibTest.py"
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from LumpNavLib.BreachAnalysis import computeBreachStatistics, computeToolTipPositions, TriangleMesh
+from LumpNavLib.BreachEventLog import BreachEventLogWriter, readBreachEventLog, BREACH_EVENT_DTYPE, BREACH_EVENT_LOG_HEADER_DTYPE, ZONE_INSIDE, ZONE_OUTSIDE, COMMAND_SENT
+from LumpNavLib.PoseHistory import PoseHistory
+from LumpNavLib.ResectionCoverage import ResectionCoverageMap
+
+def createUnitCubeMesh():
+  """Closed triangle mesh of the [0, 1]^3 cube with outward facing triangles.
+  """
+  vertices = numpy.array([[x, y, z] for x in [0.0, 1.0] for y in [0.0, 1.0] for z in [0.0, 1.0]])
+  triangles = []
+  for axis in range(3):
+    for side in [0.0, 1.0]:
+      corners = [index for index in range(8) if vertices[index, axis] == side]
+      # Corners of the face are a, b, c, d with a and d opposite
+      a, b, c, d = corners
+      for triangle in [[a, b, d], [a, d, c]]:
+        normal = numpy.cross(vertices[triangle[1]] - vertices[triangle[0]], vertices[triangle[2]] - vertices[triangle[0]])
+        if normal.dot(vertices[triangle].mean(axis=0) - 0.5) < 0:
+          triangle = [triangle[0], triangle[2], triangle[1]]
+        triangles.append(triangle)
+  return TriangleMesh(vertices, numpy.array(triangles))
+
+def computeUnitCubeSignedDistances(points):
+  # Closed form signed distance of the [0, 1]^3 cube, negative inside
+  offsets = numpy.abs(points - 0.5) - 0.5
+  return numpy.linalg.norm(numpy.maximum(offsets, 0.0), axis=1) + numpy.minimum(offsets.max(axis=1), 0.0)
+
+class TriangleMeshTest(unittest.TestCase):
+
+  def test_unitCubeSignedDistances(self):
+    points = numpy.random.RandomState(0).uniform(-1.0, 2.0, size=(2000, 3))
+    # Small chunks, so that points are processed in many chunks
+    distances = createUnitCubeMesh().computeSignedDistances(points, maximumPairsPerChunk=1000)
+    numpy.testing.assert_allclose(distances, computeUnitCubeSignedDistances(points), atol=1e-9)
+
+  def test_emptyMesh(self):
+    distances = TriangleMesh(numpy.zeros((0, 3)), numpy.zeros((0, 3), dtype=numpy.int64)).computeSignedDistances(numpy.zeros((3, 3)))
+    self.assertTrue(numpy.isnan(distances).all())
+
+  def test_toolTipPositions(self):
+    toolToReference = numpy.tile(numpy.eye(4), (2, 1, 1))
+    toolToReference[1, 0:3, 3] = [10.0, 0.0, 0.0]
+    modelToReference = numpy.tile(numpy.eye(4), (2, 1, 1))
+    modelToReference[:, 0:3, 3] = [0.0, 5.0, 0.0]
+    toolTipToTool = numpy.eye(4)
+    toolTipToTool[2, 3] = 3.0
+    numpy.testing.assert_allclose(computeToolTipPositions(toolToReference, modelToReference, toolTipToTool),
+      [[0.0, -5.0, 3.0], [10.0, -5.0, 3.0]])
+
+class BreachStatisticsTest(unittest.TestCase):
+
+  def test_syntheticTimeline(self):
+    timestamps = numpy.arange(10.0)
+    distancesMm = [5.0, 1.0, -1.0, -2.0, 1.0, 5.0, -0.5, 1.0, numpy.nan, 5.0]
+    statistics = computeBreachStatistics(timestamps, distancesMm, 2.0)
+    self.assertEqual(statistics['numberOfFrames'], 10)
+    self.assertEqual(statistics['numberOfAnalyzedFrames'], 9)
+    self.assertEqual(statistics['numberOfBreaches'], 2)
+    self.assertEqual([(interval['startFrame'], interval['stopFrame']) for interval in statistics['breachIntervals']], [(2, 3), (6, 6)])
+    self.assertEqual([interval['maximumDepthMm'] for interval in statistics['breachIntervals']], [2.0, 0.5])
+    # Each frame lasts until the next frame, the last frame has no duration
+    self.assertEqual(statistics['timeInsideSec'], 3.0)
+    self.assertEqual(statistics['timeInMarginSec'], 3.0)
+    self.assertEqual(statistics['timeOutsideSec'], 2.0)
+    self.assertEqual((statistics['minimumDistanceMm'], statistics['minimumDistanceTime']), (-2.0, 3.0))
+    self.assertEqual((statistics['minimumMarginMm'], statistics['minimumMarginTime']), (1.0, 1.0))
+
+  def test_noBreach(self):
+    statistics = computeBreachStatistics([0.0, 1.0], [numpy.nan, 3.0], 2.0)
+    self.assertEqual(statistics['numberOfBreaches'], 0)
+    self.assertEqual(statistics['minimumDistanceMm'], 3.0)
+
+class ResectionCoverageMapTest(unittest.TestCase):
+
+  def test_pathSegmentsAndJumps(self):
+    coverageMap = ResectionCoverageMap(voxelSizeMm=1.0, maximumSegmentSteps=16)
+    coverageMap.addTipPosition([0.5, 0.5, 0.5])
+    coverageMap.addTipPosition([5.5, 0.5, 0.5])
+    self.assertEqual(coverageMap.numberOfOccupiedVoxels, 6)
+    # Jump longer than the segment step bound, voxels in between are not marked
+    coverageMap.addTipPosition([105.5, 0.5, 0.5])
+    self.assertEqual(coverageMap.numberOfOccupiedVoxels, 7)
+    voxelCenters = coverageMap.getOccupiedVoxelCenters()
+    self.assertEqual(sorted(voxelCenters[:, 0]), [0.5, 1.5, 2.5, 3.5, 4.5, 5.5, 105.5])
+
+  def test_nearestApproachDistances(self):
+    coverageMap = ResectionCoverageMap(voxelSizeMm=1.0)
+    coverageMap.addTipPosition([0.5, 0.5, 0.5])
+    distancesMm = coverageMap.computeNearestApproachDistances([[0.5, 3.5, 0.5], [50.0, 0.0, 0.0]], maximumDistanceMm=10.0, maximumPairsPerChunk=1)
+    numpy.testing.assert_allclose(distancesMm, [3.0, 10.0])
+
+  def test_blockLimit(self):
+    coverageMap = ResectionCoverageMap(voxelSizeMm=1.0, blockSize=2, maximumNumberOfBlocks=1)
+    coverageMap.addTipPosition([0.5, 0.5, 0.5])
+    coverageMap.resetPath()
+    coverageMap.addTipPosition([10.5, 0.5, 0.5])
+    self.assertEqual(coverageMap.numberOfOccupiedVoxels, 1)
+    self.assertEqual(coverageMap.numberOfDroppedPoints, 1)
+
+class BreachEventLogTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directoryPath = tempfile.mkdtemp()
+    self.logFilePath = os.path.join(self.directoryPath, 'Logs', 'BreachEvents.bin')
+
+  def tearDown(self):
+    shutil.rmtree(self.directoryPath)
+
+  def test_roundTripAcrossCapacityDoubling(self):
+    numberOfEvents = 10
+    writer = BreachEventLogWriter(self.logFilePath, initialCapacity=4)
+    for eventIndex in range(numberOfEvents):
+      writer.append(100.0 + eventIndex, eventIndex - 5.0, ZONE_INSIDE if eventIndex < 5 else ZONE_OUTSIDE,
+        [eventIndex, 2.0 * eventIndex, 3.0 * eventIndex], COMMAND_SENT)
+      if eventIndex == 5:
+        # Complete records are readable while the log is written
+        self.assertEqual(len(readBreachEventLog(self.logFilePath)), 6)
+    self.assertEqual(writer.capacity, 16)
+    writer.close()
+    self.assertEqual(os.path.getsize(self.logFilePath), BREACH_EVENT_LOG_HEADER_DTYPE.itemsize + numberOfEvents * BREACH_EVENT_DTYPE.itemsize)
+
+    for memoryMapped in [False, True]:
+      records = readBreachEventLog(self.logFilePath, memoryMapped)
+      self.assertEqual(len(records), numberOfEvents)
+      numpy.testing.assert_array_equal(records['timestamp'], 100.0 + numpy.arange(numberOfEvents))
+      numpy.testing.assert_array_equal(records['distanceMm'], numpy.arange(numberOfEvents) - 5.0)
+      numpy.testing.assert_array_equal(records['tipPositionInNeedle'][:, 1], 2.0 * numpy.arange(numberOfEvents))
+      numpy.testing.assert_array_equal(records['zone'], [ZONE_INSIDE] * 5 + [ZONE_OUTSIDE] * 5)
+      self.assertTrue((records['commandStatus'] == COMMAND_SENT).all())
+      del records
+
+  def test_notALogFile(self):
+    os.makedirs(os.path.dirname(self.logFilePath))
+    with open(self.logFilePath, 'wb') as logFile:
+      logFile.write(b'\0' * 64)
+    self.assertRaises(ValueError, readBreachEventLog, self.logFilePath)
+
+class PoseHistoryTest(unittest.TestCase):
+
+  def test_ringBufferOrder(self):
+    poseHistory = PoseHistory(capacity=4)
+    for poseIndex in range(6):
+      pose = numpy.eye(4)
+      pose[0, 3] = poseIndex
+      poseHistory.addPose(float(poseIndex), pose)
+    timestamps, poses = poseHistory.getWindow()
+    numpy.testing.assert_array_equal(timestamps, [2.0, 3.0, 4.0, 5.0])
+    numpy.testing.assert_array_equal(poses[:, 0, 3], [2.0, 3.0, 4.0, 5.0])
+    self.assertEqual(poseHistory.getLatest()[0], 5.0)
+    numpy.testing.assert_allclose(poseHistory.getVelocity(durationSec=10.0), [1.0, 0.0, 0.0])
+
+  def test_interpolation(self):
+    poseHistory = PoseHistory()
+    poseHistory.addPose(0.0, numpy.eye(4))
+    rotatedPose = numpy.eye(4)
+    rotatedPose[0:3, 0:3] = [[0.0, -1.0, 0.0], [1.0, 0.0, 0.0], [0.0, 0.0, 1.0]] # 90 degrees around z
+    rotatedPose[0:3, 3] = [10.0, 0.0, 0.0]
+    poseHistory.addPose(1.0, rotatedPose)
+    pose = poseHistory.interpolateAtTime(0.5)
+    numpy.testing.assert_allclose(pose[0:3, 3], [5.0, 0.0, 0.0])
+    halfAngle = numpy.pi / 4
+    numpy.testing.assert_allclose(pose[0:3, 0:3], [[numpy.cos(halfAngle), -numpy.sin(halfAngle), 0.0],
+      [numpy.sin(halfAngle), numpy.cos(halfAngle), 0.0], [0.0, 0.0, 1.0]], atol=1e-12)
+    # Times outside of the buffered range get the first or last pose
+    numpy.testing.assert_allclose(poseHistory.interpolateAtTimes([-1.0, 2.0])[:, 0, 3], [0.0, 10.0])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,5 +1,19 @@
 from __main__ import vtk, qt, ctk, slicer
 import logging
+import os
+import sys
+
+# Shared helpers are in LumpNavLib, in the LumpNav module directory. In the build and install trees all modules of the
+# extension are in the same directory, in the source tree LumpNavLib is only on the path once LumpNav is loaded,
+# therefore the LumpNav module directory is added here, so that the module loads independently of the load order.
+try:
+  import LumpNavLib
+except ImportError:
+  sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'LumpNav'))
+
+from LumpNavLib.CallbackProfiler import profiled
+from LumpNavLib.EventRateMonitor import eventRateMonitor, VIEWPOINT_CAMERA_EVENT
+from LumpNavLib.ObserverRegistry import ObserverRegistry
 
 #
 # Viewpoint
@@ -419,7 +433,22 @@ class ViewpointLogic:
     self.modelPOVOffNode = None
     
     self.currentlyInViewpoint = False
-    self.transformNodeObserverTags = []
+    self.observers = ObserverRegistry('ViewpointLogic')
+    # Active (transform, camera) pairs, each camera follows its transform.
+    # Cameras bound to the same transform share one transform-to-world computation.
+    self.cameraBindings = []
+    # Bound transform nodes that depend on each observed transform node (the bound node itself and its parents)
+    self.boundTransformNodesByObservedNodeID = {}
+    # Optional LumpNavLib TransformChainCache, if set then transform-to-world matrices are taken from it
+    self.transformChainCache = None
+    # Optional LumpNavLib ClippingRangeEngine, if set then clipping ranges are computed from the bounds of its models
+    # instead of the bounds of all props in the renderer
+    self.clippingRangeEngine = None
+    # Optional LumpNavLib FocalDistanceService, if set then the focal point is placed on the target surface
+    # the camera is looking at. The default distance is used if the camera does not look at the target.
+    self.focalDistanceService = None
+    self.defaultFocalDistanceMm = 200.0
+    self.minimumFocalDistanceMm = 1.0
     
     self.cameraXPosMm =  0.0
     self.cameraYPosMm =  0.0
@@ -443,24 +472,67 @@ class ViewpointLogic:
   def addObservers(self): # mostly copied from PositionErrorMapping.py in PLUS
     logging.debug("Adding observers...")
     transformModifiedEvent = 15000
-    transformNode = self.transformNode
-    while transformNode:
-      logging.debug("Add observer to {0}".format(transformNode.GetName()))
-      self.transformNodeObserverTags.append([transformNode, transformNode.AddObserver(transformModifiedEvent, self.onTransformModified)])
-      transformNode = transformNode.GetParentTransformNode()
+    # Each transform in the bound chains is observed only once, even if it is shared by several bindings
+    for boundTransformNode in self.getBoundTransformNodes():
+      transformNode = boundTransformNode
+      while transformNode:
+        if transformNode.GetID() not in self.boundTransformNodesByObservedNodeID:
+          logging.debug("Add observer to {0}".format(transformNode.GetName()))
+          self.boundTransformNodesByObservedNodeID[transformNode.GetID()] = []
+          self.observers.addObserver(transformNode, transformModifiedEvent, self.onTransformModified)
+        self.boundTransformNodesByObservedNodeID[transformNode.GetID()].append(boundTransformNode)
+        transformNode = transformNode.GetParentTransformNode()
     logging.debug("Done adding observers")
 
   def removeObservers(self):
     logging.debug("Removing observers...")
-    for nodeTagPair in self.transformNodeObserverTags:
-      nodeTagPair[0].RemoveObserver(nodeTagPair[1])
+    self.observers.removeObservers()
+    self.boundTransformNodesByObservedNodeID = {}
     logging.debug("Done removing observers")
+
+  def getBoundTransformNodes(self):
+    boundTransformNodes = []
+    for transformNode, cameraNode in self.cameraBindings:
+      if transformNode not in boundTransformNodes:
+        boundTransformNodes.append(transformNode)
+    return boundTransformNodes
+
+  def getBoundCameraNodes(self):
+    return [cameraNode for transformNode, cameraNode in self.cameraBindings]
+
+  def addCameraBinding(self, transformNode, cameraNode):
+    """Makes the camera follow the transform, in addition to the already bound cameras.
+    If the camera is already bound then its transform is replaced.
+    """
+    self.cameraBindings = [binding for binding in self.cameraBindings if binding[1] != cameraNode]
+    self.cameraBindings.append((transformNode, cameraNode))
+    self.currentlyInViewpoint = True
+    self.removeObservers()
+    self.addObservers()
+    self.updateViewpointCamera([transformNode])
+
+  def removeCameraBinding(self, cameraNode):
+    self.cameraBindings = [binding for binding in self.cameraBindings if binding[1] != cameraNode]
+    if not self.cameraBindings:
+      self.stopViewpoint()
+      return
+    self.removeObservers()
+    self.addObservers()
     
   def setTransformNode(self, transformNode):
     self.transformNode = transformNode
     
   def setCameraNode(self, cameraNode):
     self.cameraNode = cameraNode
+
+  def setTransformChainCache(self, transformChainCache):
+    self.transformChainCache = transformChainCache
+
+  def setClippingRangeEngine(self, clippingRangeEngine):
+    self.clippingRangeEngine = clippingRangeEngine
+
+  def setFocalDistanceService(self, focalDistanceService):
+    self.focalDistanceService = focalDistanceService
     
   def setModelPOVOnNode(self, modelPOVOnNode):
     self.modelPOVOnNode = modelPOVOnNode
@@ -499,9 +571,7 @@ class ViewpointLogic:
   def startViewpoint(self):
     logging.debug("Start Viewpoint Mode")
     if (self.transformNode and self.cameraNode):
-      self.currentlyInViewpoint = True
-      self.addObservers()
-      self.updateViewpointCamera()
+      self.addCameraBinding(self.transformNode, self.cameraNode)
     else:
       logging.warning("A node is missing. Nothing will happen until the comboboxes have items selected.")
   
@@ -514,11 +584,13 @@ class ViewpointLogic:
       modelPOVOffDisplayNode = self.modelPOVOffNode.GetDisplayNode()
       modelPOVOffDisplayNode.SetVisibility(True)
     self.currentlyInViewpoint = False
+    self.cameraBindings = []
     self.removeObservers();
 
+  @profiled('ViewpointLogic.onTransformModified')
   def onTransformModified(self, observer, eventid):
     # no logging - it slows Slicer down a *lot*
-    self.updateViewpointCamera()
+    self.updateViewpointCamera(self.boundTransformNodesByObservedNodeID.get(observer.GetID()))
     
   def SetCameraParallelProjection(self,newParallelProjectionState):
     logging.debug("SetCameraParallelProjection")
@@ -560,18 +632,41 @@ class ViewpointLogic:
     if (self.currentlyInViewpoint == True):
       self.updateViewpointCamera()
 
-  def updateViewpointCamera(self):
+  def updateViewpointCamera(self, transformNodes=None):
+    """Updates the cameras that are bound to the given transform nodes (all bound cameras by default).
+    Without bindings (viewpoint not started) the selected camera is updated from the selected transform.
+    """
     # no logging - it slows Slicer down a *lot*
-    
-    # Need to set camera attributes according to the concatenated transform
-    toolCameraToRASTransform = vtk.vtkGeneralTransform()
-    self.transformNode.GetTransformToWorld(toolCameraToRASTransform)
-    
-    cameraOriginInRASMm = self.computeCameraOriginInRASMm(toolCameraToRASTransform)
-    focalPointInRASMm = self.computeCameraFocalPointInRASMm(toolCameraToRASTransform)
-    upDirectionInRAS = self.computeCameraUpDirectionInRAS(toolCameraToRASTransform,cameraOriginInRASMm,focalPointInRASMm)
-    
-    self.setCameraParameters(cameraOriginInRASMm,focalPointInRASMm,upDirectionInRAS)
+    cameraBindings = self.cameraBindings
+    if not cameraBindings:
+      cameraBindings = [(self.transformNode, self.cameraNode)]
+    if transformNodes is None:
+      transformNodes = [transformNode for transformNode, cameraNode in cameraBindings]
+
+    # Camera poses are computed once per transform, then applied to all cameras bound to that transform
+    cameraParametersByTransformNodeID = {}
+    for transformNode, cameraNode in cameraBindings:
+      if transformNode not in transformNodes:
+        continue
+      if transformNode.GetID() not in cameraParametersByTransformNodeID:
+        # Need to set camera attributes according to the concatenated transform
+        if self.transformChainCache:
+          toolCameraToRASMatrix = vtk.vtkMatrix4x4()
+          self.transformChainCache.getVtkMatrixToWorld(transformNode, toolCameraToRASMatrix)
+          toolCameraToRASTransform = vtk.vtkTransform()
+          toolCameraToRASTransform.SetMatrix(toolCameraToRASMatrix)
+        else:
+          toolCameraToRASTransform = vtk.vtkGeneralTransform()
+          transformNode.GetTransformToWorld(toolCameraToRASTransform)
+
+        cameraOriginInRASMm = self.computeCameraOriginInRASMm(toolCameraToRASTransform)
+        focalPointInRASMm = self.computeCameraFocalPointInRASMm(toolCameraToRASTransform)
+        upDirectionInRAS = self.computeCameraUpDirectionInRAS(toolCameraToRASTransform,cameraOriginInRASMm,focalPointInRASMm)
+        cameraParametersByTransformNodeID[transformNode.GetID()] = (cameraOriginInRASMm,focalPointInRASMm,upDirectionInRAS)
+
+      cameraOriginInRASMm,focalPointInRASMm,upDirectionInRAS = cameraParametersByTransformNodeID[transformNode.GetID()]
+      self.setCameraParameters(cameraOriginInRASMm,focalPointInRASMm,upDirectionInRAS,cameraNode)
+      eventRateMonitor.tick(VIEWPOINT_CAMERA_EVENT)
     
     # model visibility
     if (self.modelPOVOffNode):
@@ -594,9 +689,16 @@ class ViewpointLogic:
       focalPointInRASMm = self.targetModelMiddleInRASMm
     else:
       # camera distance depends on slider, but lies in -z (which is the direction that the camera is facing)
-      focalPointInToolCameraMm = [self.cameraXPosMm,self.cameraYPosMm,self.cameraZPosMm-200] # The number 200 mm is arbitrary. TODO: Change so that this is the camera-tumor distance
+      focalPointInToolCameraMm = [self.cameraXPosMm,self.cameraYPosMm,self.cameraZPosMm-self.defaultFocalDistanceMm]
       focalPointInRASMm = [0,0,0] # placeholder values    
       toolCameraToRASTransform.TransformPoint(focalPointInToolCameraMm,focalPointInRASMm)
+      if self.focalDistanceService:
+        # focal point is moved to the first intersection of the viewing direction with the target surface
+        cameraOriginInRASMm = self.computeCameraOriginInRASMm(toolCameraToRASTransform)
+        directionInRAS = self.computeCameraProjectionDirectionInRAS(cameraOriginInRASMm, focalPointInRASMm)
+        focalDistanceMm = self.focalDistanceService.castRay(cameraOriginInRASMm, directionInRAS)
+        if focalDistanceMm is not None and focalDistanceMm > self.minimumFocalDistanceMm:
+          focalPointInRASMm = [cameraOriginInRASMm[i] + focalDistanceMm * directionInRAS[i] for i in range(3)]
     return focalPointInRASMm
     
   def computeCameraProjectionDirectionInRAS(self, cameraOriginInRASMm, focalPointInRASMm):
@@ -641,8 +743,10 @@ class ViewpointLogic:
       toolCameraToRASTransform.TransformVectorAtPoint(dummyPoint,upDirectionInToolCamera,upDirectionInRAS)
     return upDirectionInRAS
 
-  def setCameraParameters(self,cameraOriginInRASMm,focalPointInRASMm,upDirectionInRAS):
-    camera = self.cameraNode.GetCamera()
+  def setCameraParameters(self,cameraOriginInRASMm,focalPointInRASMm,upDirectionInRAS,cameraNode=None):
+    if not cameraNode:
+      cameraNode = self.cameraNode
+    camera = cameraNode.GetCamera()
     if (self.cameraParallelProjection == False):
       camera.SetViewAngle(self.cameraViewAngleDeg)
     elif (self.cameraParallelProjection == True):
@@ -655,4 +759,6 @@ class ViewpointLogic:
     camera.SetPosition(cameraOriginInRASMm)
     camera.SetFocalPoint(focalPointInRASMm)
     camera.SetViewUp(upDirectionInRAS)
-    self.cameraNode.ResetClippingRange() # without this line, some objects do not appear in the 3D view
+    if self.clippingRangeEngine and self.clippingRangeEngine.updateCameraClippingRange(camera):
+      return
+    cameraNode.ResetClippingRange() # without this line, some objects do not appear in the 3D view